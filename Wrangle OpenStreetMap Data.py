@@ -24,6 +24,7 @@ import re
 import cerberus
 import schema
 import pprint
+import auditors
 
 
 # In[3]:
@@ -242,6 +243,10 @@ if __name__ == '__main__':
 # Now I would like to audit the full dataset to make sure I'm not missing issues before shaping the elements for the csv file.
 
 # # Data Audit
+# 
+# Update: OSMFILE can also be the compressed extract (san-francisco_california.osm.bz2, or .gz, .xz or .zst). The
+# audits and the shaping decompress it as they read it, see osm_input.py. It can also be the .osm.pbf extract, which is
+# decoded by pbf.py.
 
 # In[4]:
 
@@ -249,7 +254,7 @@ OSMFILE = "/Users/elizabethallen/Documents/Udacity_P3_Project/san-francisco_cali
 EXAMPLE = "/Users/elizabethallen/Documents/Udacity_P3_Project/sample.osm"
 
 
-# First, I'm going to iteratively parse the xml file to find what elements there are and what their attributes look like. For this and all iterative functions, I will test on the EXAMPLE file first and then execute on the OSMFILE.
+# First, I'm going to iteratively parse the xml file to find what elements there are and what their attributes look like. All of the audits below read the file through auditors.iter_elements, which hands over one complete top level element at a time and frees it once it has been audited, so that memory use stays flat on the full OSM file. For this and all iterative functions, I will test on the EXAMPLE file first and then execute on the OSMFILE.
 # 
 # I expect the output to look something like: 
 # {"bounds": {"count": 1,
@@ -263,7 +268,7 @@ def count_tags(filename):
     # attributes, increment the count by 1. Return the dictionary of tag types, attribute types and their counts. 
     tag_types = {}
     
-    for event, elem in ET.iterparse(filename):
+    for elem in auditors.iter_all_elements(filename):
         tag_info = {}
         tag = elem.tag
         if tag in tag_types:
@@ -284,7 +289,7 @@ def count_tags(filename):
 
 def test():
 
-    tags = count_tags(OSMFILE)
+    tags = count_tags(EXAMPLE)
     pprint.pprint(tags)
 
 if __name__ == "__main__":
@@ -341,7 +346,7 @@ def process_map(filename):
     # return the dictionary of tag_types.
     tag_types = {}
     
-    for _, element in ET.iterparse(filename):
+    for element in auditors.iter_all_elements(filename):
         tag = element.tag
         if tag in tag_types:
             for attrib, val in element.attrib.items():
@@ -363,7 +368,7 @@ def process_map(filename):
     return tag_types
 
 def test():
-    element_info = process_map(OSMFILE)
+    element_info = process_map(EXAMPLE)
     pprint.pprint(element_info)
 
 if __name__ == "__main__":
@@ -418,7 +423,7 @@ def audit(osmfile):
     
     osm_file = open(osmfile, "r")
     street_types = defaultdict(set)
-    for event, elem in ET.iterparse(osm_file, events=("start",)):
+    for elem in auditors.iter_elements(osm_file):
         
         if elem.tag == "node" or elem.tag == "way":
             for tag in elem.iter("tag"):
@@ -429,7 +434,7 @@ def audit(osmfile):
     return street_types
 
 if __name__ == '__main__':
-    audit(OSMFILE)
+    audit(EXAMPLE)
 
 
 # From the small sample that I looked through earlier, I didn't see any instances of abbreviation. From running this street name audit script on the full OSM file, I can see a few cases of abbreviation that we will want to fix when adding this data to the CSV.
@@ -488,7 +493,7 @@ def process_map(filename):
              'unitedstates': {'Match': 0, 'Other': 0}
             }
     
-    for _, element in ET.iterparse(filename):
+    for element in auditors.iter_elements(filename):
         if element.tag == "node" or element.tag == "way":
             for tag in element.iter("tag"):
                 tag_type = tag.attrib['k']
@@ -498,7 +503,7 @@ def process_map(filename):
     return audit_vals   
         
 def test():
-    element_info = process_map(OSMFILE)
+    element_info = process_map(EXAMPLE)
     pprint.pprint(element_info)
 
 if __name__ == "__main__":
@@ -537,7 +542,7 @@ def process_map(filename):
     # tags, grabs their attribute keys and values and then audits them for non-matching values. 
     # Returns the set of non-matching values.
     other_vals = defaultdict(set)
-    for event, elem in ET.iterparse(filename, events=("start",)):
+    for elem in auditors.iter_elements(filename):
         
         if elem.tag == "node" or elem.tag == "way":
             for tag in elem.iter("tag"):
@@ -548,7 +553,26 @@ def process_map(filename):
     return other_vals
 
 if __name__ == '__main__':
-    process_map(OSMFILE)
+    process_map(EXAMPLE)
+
+
+# Each of the audits above parses the whole file again, which adds up on the full OSM file. The same audits are
+# available as auditor objects in auditors.py, so for the full file I run all of them together in a single pass and get
+# every report back at once. Adding another auditor to the list doesn't add another parse.
+# 
+# Update: the reports are cached on disk in .audit_cache (see audit_cache.py), keyed by the file's size, modification
+# time and a hash of its contents, and by the code and settings of each auditor. Rerunning this cell on the same file
+# reads the reports back without parsing it; editing an audit only reruns that audit.
+
+# In[ ]:
+
+from audit_cache import AuditCache
+
+if __name__ == '__main__':
+    reports = auditors.run_audits(OSMFILE, auditors.default_auditors(), cache=AuditCache())
+    for name in ['tag_types', 'attributes', 'street_types', 'audit_vals', 'other_vals']:
+        print name
+        pprint.pprint(reports[name])
 
 
 # Based on this output, there are definitely a few action items:
@@ -598,28 +622,20 @@ WAY_NODES_FIELDS = ['id', 'node_id', 'position']
 # id is the top level way id, node_id is the ref attribute of the nd tag, and position is the index of the nd tag
 
 # I'm choosing to ignore osm, member, bounds and relation elements
+# 
+# Update: relations are now shaped too, in the same pass as nodes and ways, into the relations, relation_members and
+# relation_tags tables (see RELATION_FIELDS, RELATION_MEMBERS_FIELDS and RELATION_TAGS_FIELDS in shaping.py). The
+# members of a relation are its <member> elements: member_id is the ref, type is node, way or relation, and position
+# is the order of the member in the relation. Relation tags are cleaned the same way as node and way tags.
 
 
 # In[15]:
 
-# Based on the earlier analysis of street types, I have updated the mappings dictionary for street types
-
-street_mapping = { "St": "Street",
-            "St.": "Street",
-            "Ave": "Avenue",
-            "Ave.": "Avenue",
-            "Rd": "Road",
-            "Rd.": "Road",
-            "Dr.": "Drive",
-            "Dr": "Drive",
-            "Pl": "Place",
-            "Plz": "Plaza",
-            "Blvd": "Boulevard",
-            "Blvd.": "Boulevard",
-            "Ct": "Court",
-            "Ctr": "Center",
-            "Ln.": "Lane"
-            }
+# Based on the earlier analysis of street types, I have updated the mappings dictionary for street types. The mapping
+# is kept in shaping.py next to update_name, which uses it.
+
+from shaping import street_mapping
+pprint.pprint(street_mapping)
 
 
 # In[13]:
@@ -630,6 +646,8 @@ SCHEMA = schema.schema
 
 
 # Just a quick note: if I wanted to be more thorough in this audit, I would also include bound, relation and member elements in this schema. I chose to ignore those elements for simplicity.
+# 
+# Update: schema.py now includes relation, relation_members and relation_tags.
 
 # The "node" field should hold a dictionary of the following top level node attributes:
 # - id
@@ -764,227 +782,62 @@ SCHEMA = schema.schema
 
 # In[18]:
 
-street_type_re = re.compile(r'\b\S+\.?$', re.IGNORECASE)
-lower_colon_re = re.compile(r'^([a-z]|_)*:([a-z]|_)*$')
-postal_code_re = re.compile(r'\d{5}(\-\d{4}$)?')
-phone_number_re = re.compile(r'(\d\-)?\d{3}\-\d{3}\-\d{4}|\(\d{3}\)\s\d{3}\-\d{4}|\d{3}\.\d{3}\.\d{4}')
-california_re = re.compile(r'[C|c][A|a]([L|l][I|i][F|f][O|o][R|r][N|n][I|i][A|a])?')
-unitedstates_re = re.compile(r'[U|u][S|s]')
-contains_letters_re = re.compile('[a-zA-Z]')
+# The cleaning and shaping code below lives in shaping.py, the same way the schema lives in schema.py, so that
+# process_map can also be run in parallel across several worker processes (see parallel.py).
 
-def shape_element(element, node_attr_fields=NODE_FIELDS, way_attr_fields=WAY_FIELDS,
-                  problem_chars=PROBLEMCHARS, default_tag_type='regular'):
-    # Takes the element and fields lists and shapes the element into python dictionaries according to the rules 
-    # I outlined above. Returns the dictionaries.
-    node_attribs = {}
-    way_attribs = {}
-    way_nodes = []
-    tags = []  # Handle secondary tags the same way for both node and way elements
-    
-    if element.tag == 'node':
-        
-        node_attribs = get_attribs(node_attribs, element)
-        if skip_record(NODE_FIELDS, node_attribs):
-            return False
-        if element.iter("tag") != None:
-            tags = get_tag_info(element, tags)
-        return {'node': node_attribs, 'node_tags': tags}
-    elif element.tag == 'way':
-                
-        way_attribs = get_attribs(way_attribs, element)
-        if skip_record(WAY_FIELDS, way_attribs):
-            return False
-        
-        if element.iter("tag") != None:
-            tags = get_tag_info(element, tags)
-        if element.iter("nd") != None:
-            index = 0
-            for nd in element.iter("nd"):
-                tag_info = {}
-                tag_info['id'] = element.get('id')
-                tag_info['node_id'] = nd.attrib['ref']
-                tag_info['position'] = index
-                index += 1
-                
-                way_nodes.append(tag_info)
-        return {'way': way_attribs, 'way_nodes': way_nodes, 'way_tags': tags}
-
-def skip_record(FIELDS, attribs):
-    # Takes the list of fields expected and the dictionary of attributes from the element and checks if the attributes
-    # are in the list of Fields or if the value associated with the attribute is empty. If the attribute is not in the
-    # list of fields or if the value of the attribute is empty, returns True.
-    for val in FIELDS:
-        if val not in attribs:
-            return True
-        elif attribs[val] == 'NULL' or attribs[val] == None or attribs[val] == '': 
-            return True
-    
-
-def get_attribs(attrib_dict, element):
-    # Takes attribute dictionary and element, and for each attribute in the element, it adds the attribute name
-    # to the attribute dictionary and returns the dictionary.
-    for attrib in element.attrib:
-        attrib_dict[attrib] = element.get(attrib)
-    
-    return attrib_dict
-    
-
-def get_value(word, search_val):
-    # Takes an attribute and its value and does a regex search on the value depending on the type of attribute. 
-    # Depending on whether a match is found or not, an associated value is returned.
-    c = california_re.search(search_val)
-    l = postal_code_re.search(search_val)
-    p = phone_number_re.search(search_val)
-    s = street_type_re.search(search_val)
-    a = contains_letters_re.search(search_val)
-    if word == 'addr:state':
-        if c:
-            california = c.group()
-            value = 'CA'
-        else:
-            value = 'None'
-    elif word == 'addr:street':
-        if s:
-            street_type = s.group()
-            value = update_name(search_val, street_mapping)
-        else:
-            value = search_val
-    elif 'postcode' in word:
-        if l:
-            postcode = l.group()
-            value = postcode
-        else:
-            value = 'None'
-    elif 'phone' in word:
-        if a:
-            value = 'None'
-        else:
-            value = search_val
-    else:
-        value = search_val
-    return value
-
-def update_name(name, street_mapping):
-    # Takes the a name and updates the name to include the approved name mapping. Returns the new name. 
-    for key in street_mapping:
-        if name.find(street_mapping[key]) == -1:
-            if name.find(key) != -1:
-                name = name.replace(key, street_mapping[key])
-    return name
-
-def get_tag_info(element, tags):
-    # Takes the element and empty list, runs a regex search for problem characters on the tag and colons and 
-    # returns the list with the clean tag info.
-    for tag in element.iter("tag"):
-        tag_info = {}
-        tag_info['id'] = element.get('id')
-        word = tag.get('k')
-        value = tag.get('v')
-    
-        m = PROBLEMCHARS.search(tag.attrib['k'])
-        l = LOWER_COLON.search(tag.attrib['k'])
-        if m:
-            continue
-        elif l:
-            index = word.find(':')
-            tag_info['type'] = word[:index]
-            tag_info['key'] = word[index+1:]
-            tag_info['value'] = get_value(word, tag.attrib['v'])  
-        else:
-            tag_info['key'] = tag.attrib['k']
-            tag_info['type'] = 'regular'
-            tag_info['value'] = get_value(word, tag.attrib['v'])
-        tags.append(tag_info)
-    return tags
-
-# ================================================== #
-#               Helper Functions                     #
-# ================================================== #
-def get_element(osm_file, tags=('node', 'way', 'relation')):
-    """Yield element if it is the right type of tag"""
-
-    context = ET.iterparse(osm_file, events=('start', 'end'))
-    _, root = next(context)
-    for event, elem in context:
-        if event == 'end' and elem.tag in tags:
-            yield elem
-            root.clear()
+from shaping import (shape_element, skip_record, get_attribs, get_value, update_name, get_tag_info, get_element,
+                     validate_element, UnicodeDictWriter, process_map)
 
+if __name__ == '__main__':
+    # Note: Validation uses the validator compiled from the schema in validation.py, which is fast enough to leave
+    # on for the full file.
+    process_map(OSMFILE, validate=True)
 
-def validate_element(element, validator, schema=SCHEMA):
-    """Raise ValidationError if element does not match schema"""
-    if validator.validate(element, schema) is not True:
-        field, errors = next(validator.errors.iteritems())
-        message_string = "\nElement of type '{0}' has the following errors:\n{1}"
-        error_strings = (
-            "{0}: {1}".format(k, v if isinstance(v, str) else ", ".join(v))
-            for k, v in errors.iteritems()
-        )
-        raise cerberus.ValidationError(
-            message_string.format(field, "\n".join(error_strings))
-        )
 
+# On the full file this runs on a single core. parallel.process_map splits the OSM file into byte ranges that start
+# on a top level element, shapes each range in a separate worker process and joins the results back together in
+# order, so the csv files are exactly the same as the ones written above.
 
-class UnicodeDictWriter(csv.DictWriter, object):
-    """Extend csv.DictWriter to handle Unicode input"""
+# In[ ]:
 
-    def writerow(self, row):
-        super(UnicodeDictWriter, self).writerow({
-            k: (v.encode('utf-8') if isinstance(v, unicode) else v) for k, v in row.iteritems()
-        })
+import parallel
 
-    def writerows(self, rows):
-        for row in rows:
-            self.writerow(row)
+if __name__ == '__main__':
+    parallel.process_map(OSMFILE, validate=True, processes=None)
 
 
-# ================================================== #
-#               Main Function                        #
-# ================================================== #
-def process_map(file_in, validate):
-    """Iteratively process each XML element and write to csv(s)"""
+# The same tables can also be written as typed, compressed Parquet files with columnar.py (it needs pyarrow). Ids,
+# coordinates and positions are stored as numbers instead of text, and columnar.read_table only reads the columns it
+# is asked for, e.g. columnar.read_table('nodes', ['uid']).to_pandas().
 
-    with codecs.open(NODES_PATH, 'w') as nodes_file,          codecs.open(NODE_TAGS_PATH, 'w') as nodes_tags_file,          codecs.open(WAYS_PATH, 'w') as ways_file,          codecs.open(WAY_NODES_PATH, 'w') as way_nodes_file,          codecs.open(WAY_TAGS_PATH, 'w') as way_tags_file:
+# In[ ]:
 
-        nodes_writer = UnicodeDictWriter(nodes_file, NODE_FIELDS)
-        node_tags_writer = UnicodeDictWriter(nodes_tags_file, NODE_TAGS_FIELDS)
-        ways_writer = UnicodeDictWriter(ways_file, WAY_FIELDS)
-        way_nodes_writer = UnicodeDictWriter(way_nodes_file, WAY_NODES_FIELDS)
-        way_tags_writer = UnicodeDictWriter(way_tags_file, WAY_TAGS_FIELDS)
+import columnar
 
-        nodes_writer.writeheader()
-        node_tags_writer.writeheader()
-        ways_writer.writeheader()
-        way_nodes_writer.writeheader()
-        way_tags_writer.writeheader()
+if __name__ == '__main__' and columnar.pa is not None:
+    columnar.process_map(OSMFILE, validate=True)
 
-        validator = cerberus.Validator()
 
-        for element in get_element(file_in, tags=('node', 'way')):
-            el = shape_element(element)
-            if el:
-                '''if validate is True:
-                    validate_element(el, validator)'''
+# Given a node location store (node_locations.py), process_map also writes the bounding box, length and centroid of
+# every way to ways_geometry.csv. The store records the location of each node as it is shaped, in 16 bytes per node,
+# so the ways that follow are resolved in the same pass instead of joining ways_nodes to nodes in SQL.
 
-                if element.tag == 'node':
-                    nodes_writer.writerow(el['node'])
-                    node_tags_writer.writerows(el['node_tags'])
-                elif element.tag == 'way':
-                    ways_writer.writerow(el['way'])
-                    way_nodes_writer.writerows(el['way_nodes'])
-                    way_tags_writer.writerows(el['way_tags'])
+# In[ ]:
 
+import node_locations
 
 if __name__ == '__main__':
-    # Note: Validation is ~ 10X slower. For the project consider using a small
-    # sample of the map when validating.
-    process_map(OSMFILE, validate=True)
+    process_map(OSMFILE, validate=True, store=node_locations.NodeStore())
 
 
 # When I first ran the above code, the validator gave off errors showing that I have at least one case where a uid or user attribute or value is missing for node tags. To avoid this issue, I'm going to ignore cases where node or way attributes or attribute values are missing. I adjusted the above code to achieve this.
 # 
 # Additionally, since validation is ~10x slower, I'm going to remove code calling the validator.
 # 
+# Update: cerberus walks the schema rules for every field of every element, which is what made validation so slow.
+# validation.py compiles the schema into a small check function per field instead, and validates a few hundred
+# times faster than cerberus, so the validator is called again for the full file.
+# 
 # Now that the code is working as expected, here are the file sizes:
 # * ways_nodes.csv -- 128.8MB
 # * ways_tags.csv -- 48.1MB
@@ -992,6 +845,10 @@ if __name__ == '__main__':
 # * nodes_tags.csv -- 8.6MB
 # * nodes.csv -- 378.9MB
 # 
+# Update: profiler.py measures each stage of the shaping (parse, shape, clean, validate, write) instead of the rough
+# timings above: time, calls, rows, bytes read and written and memory per stage, with a progress line while it runs
+# and a JSON report at the end (python profiler.py OSMFILE, or with --db to profile loader.load_map).
+# 
 # Now that I have my csv files ready, I want to prep my database. I created a db using the following terminal command:
 # sqlite3 SanFrancisco.db
 # 
@@ -1017,78 +874,18 @@ if __name__ == '__main__':
 # In[22]:
 
 # I decided to create the tables directly using terminal, but i could've created a python script executing the 
-# following queries:
-
-NODES_FIELDS = ['id', 'lat', 'lon', 'user', 'uid', 'version', 'changeset', 'timestamp']
-'''NODES_DECODED = (i['id'].decode("utf-8"), i['lat'].decode("utf-8"), i['lon'].decode("utf-8"), i['user'].decode("utf-8"),
-                i['uid'].decode("utf-8"), i['version'].decode("utf-8"), i['changeset'].decode("utf-8"),
-                i['timestamp'].decode("utf-8"))'''
-NODES_INSERT = "INSERT INTO nodes(id, lat, lon, user, uid, version, changeset, timestamp) VALUES (?, ?, ?, ?, ?, ?, ?, ?);"
-NODES_QUERY = '''CREATE TABLE nodes (
-    id INTEGER PRIMARY KEY,
-    lat FLOAT,
-    lon FLOAT,
-    user STRING,
-    uid INTEGER,
-    version STRING,
-    changeset INTEGER,
-    timestamp STRING
-    );
-'''
-
-NODE_TAGS_FIELDS = ['id', 'key', 'value', 'type']
-#NODES_TAGS_DECODED = (i['id'].decode("utf-8"), i['key'].decode("utf-8"), i['value'].decode("utf-8"), i['type'].decode("utf-8"))
-NODES_TAGS_INSERT = '''INSERT INTO nodes_tags(id, key, value, type) VALUES (?, ?, ?, ?);'''
-NODES_TAGS_QUERY = '''CREATE TABLE nodes_tags (
-    id INTEGER,
-    key STRING,
-    value STRING,
-    type STRING,
-    FOREIGN KEY (id) REFERENCES nodes
-    );'''
-
-WAY_FIELDS = ['id', 'user', 'uid', 'version', 'changeset', 'timestamp']
-'''WAYS_DECODED = (i['id'].decode("utf-8"), i['user'].decode("utf-8"), i['uid'].decode("utf-8"), i['version'].decode("utf-8"),
-                i['changeset'].decode("utf-8"), i['timestamp'].decode("utf-8"))'''
-WAYS_INSERT = '''INSERT INTO ways(id, user, uid, version, changeset, timestamp) VALUES (?, ?, ?, ?, ?, ?);'''
-WAYS_QUERY = '''CREATE TABLE ways (
-    id INTEGER PRIMARY KEY,
-    user STRING,
-    uid INTEGER,
-    version STRING,
-    changeset INTEGER,
-    timestamp STRING
-    );'''
-
-WAY_NODES_FIELDS = ['id', 'node_id', 'position']
-#WAYS_NODES_DECODED = (i['id'].decode("utf-8"), i['node_id'].decode("utf-8"), i['position'].decode("utf-8"))
-WAYS_NODES_INSERT = '''INSERT INTO ways_nodes(id, node_id, position) VALUES (?, ?, ?);'''
-WAYS_NODES_QUERY = '''CREATE TABLE ways_nodes (
-    id INTEGER,
-    node_id INTEGER,
-    position INTEGER,
-    FOREIGN KEY (id) REFERENCES ways,
-    FOREIGN KEY (id) REFERENCES ways_tags
-    );'''
-
-WAY_TAGS_FIELDS = ['id', 'key', 'value', 'type']
-#WAYS_TAGS_DECODED = (i['id'].decode("utf-8"), i['key'].decode("utf-8"), i['value'].decode("utf-8"), i['type'].decode("utf-8"))
-WAYS_TAGS_INSERT = '''INSERT INTO ways_tags(id, key, value, type) VALUES (?, ?, ?, ?);'''
-WAYS_TAGS_QUERY = '''CREATE TABLE ways_tags (
-    id INTEGER,
-    key STRING,
-    value STRING,
-    type STRING,
-    FOREIGN KEY (id) REFERENCES ways,
-    FOREIGN KEY (id) REFERENCES ways_nodes
-    );'''
+# following queries. The queries are kept in loader.py, which can also create the tables and load them from Python.
 
+from loader import (NODES_FIELDS, NODES_INSERT, NODES_QUERY, NODE_TAGS_FIELDS, NODES_TAGS_INSERT, NODES_TAGS_QUERY,
+                    WAY_FIELDS, WAYS_INSERT, WAYS_QUERY, WAY_NODES_FIELDS, WAYS_NODES_INSERT, WAYS_NODES_QUERY,
+                    WAY_TAGS_FIELDS, WAYS_TAGS_INSERT, WAYS_TAGS_QUERY)
 
 # In[23]:
 
 import sqlite3
 import csv
 from pprint import pprint
+from loader import import_csv
 
 
 # In[24]:
@@ -1120,19 +917,8 @@ cur = conn.cursor()
 cur.execute(NODES_QUERY)
 conn.commit()
 
-# Read in the csv file as a dictionary, format the
-# data as a list of tuples:
-with open(nodes,'rb') as fin:
-    dr = csv.DictReader(fin) # comma is default delimiter
-    to_db = [(i['id'].decode("utf-8"), i['lat'].decode("utf-8"), i['lon'].decode("utf-8"), i['user'].decode("utf-8"),
-                i['uid'].decode("utf-8"), i['version'].decode("utf-8"), i['changeset'].decode("utf-8"),
-                i['timestamp'].decode("utf-8")) for i in dr]
-    #print to_db
-
-# insert the formatted data
-cur.executemany(NODES_INSERT, to_db)
-# commit the changes
-conn.commit()
+# Read in the csv file and insert its rows in batches, so the whole file is never held in memory:
+import_csv(conn, nodes, 'nodes', NODES_FIELDS, NODES_INSERT)
 
 # Now I want to check a subset of my data!
 cur.execute('SELECT id FROM nodes LIMIT 10')
@@ -1150,13 +936,7 @@ cur = conn.cursor()
 cur.execute(NODES_TAGS_QUERY)
 conn.commit()
 
-with open(nodes_tags,'rb') as fin:
-    dr = csv.DictReader(fin) # comma is default delimiter
-    to_db = [(i['id'].decode("utf-8"), i['key'].decode("utf-8"), i['value'].decode("utf-8"), 
-              i['type'].decode("utf-8")) for i in dr]
-
-cur.executemany(NODES_TAGS_INSERT, to_db)
-conn.commit()
+import_csv(conn, nodes_tags, 'nodes_tags', NODE_TAGS_FIELDS, NODES_TAGS_INSERT)
 
 cur.execute('SELECT id FROM nodes_tags LIMIT 10')
 all_rows = cur.fetchall()
@@ -1173,13 +953,7 @@ cur = conn.cursor()
 cur.execute(WAYS_QUERY)
 conn.commit()
 
-with open(ways,'rb') as fin:
-    dr = csv.DictReader(fin) # comma is default delimiter
-    to_db = [(i['id'].decode("utf-8"), i['user'].decode("utf-8"), i['uid'].decode("utf-8"), i['version'].decode("utf-8"),
-                i['changeset'].decode("utf-8"), i['timestamp'].decode("utf-8")) for i in dr]
-
-cur.executemany(WAYS_INSERT, to_db)
-conn.commit()
+import_csv(conn, ways, 'ways', WAY_FIELDS, WAYS_INSERT)
 
 cur.execute('SELECT id FROM ways LIMIT 10')
 all_rows = cur.fetchall()
@@ -1196,12 +970,7 @@ cur = conn.cursor()
 cur.execute(WAYS_NODES_QUERY)
 conn.commit()
 
-with open(ways_nodes,'rb') as fin:
-    dr = csv.DictReader(fin) # comma is default delimiter
-    to_db = [(i['id'].decode("utf-8"), i['node_id'].decode("utf-8"), i['position'].decode("utf-8")) for i in dr]
-
-cur.executemany(WAYS_NODES_INSERT, to_db)
-conn.commit()
+import_csv(conn, ways_nodes, 'ways_nodes', WAY_NODES_FIELDS, WAYS_NODES_INSERT)
 
 cur.execute('SELECT id FROM ways_nodes LIMIT 10')
 all_rows = cur.fetchall()
@@ -1218,13 +987,7 @@ cur = conn.cursor()
 cur.execute(WAYS_TAGS_QUERY)
 conn.commit()
 
-with open(ways_tags,'rb') as fin:
-    dr = csv.DictReader(fin) # comma is default delimiter
-    to_db = [(i['id'].decode("utf-8"), i['key'].decode("utf-8"), i['value'].decode("utf-8"), 
-              i['type'].decode("utf-8")) for i in dr]
-
-cur.executemany(WAYS_TAGS_INSERT, to_db)
-conn.commit()
+import_csv(conn, ways_tags, 'ways_tags', WAY_TAGS_FIELDS, WAYS_TAGS_INSERT)
 
 cur.execute('SELECT id FROM ways_tags LIMIT 10')
 all_rows = cur.fetchall()
@@ -1232,11 +995,71 @@ print('1):')
 pprint(all_rows)
 
 
+# The tables above have no indexes, so every exploration query below would scan them. loader.create_tags_table
+# first copies the rows of the tag tables into one tags table, which the tag queries below read (triggers keep it in
+# sync with the tag tables after that). loader.create_indexes then builds the indexes: (key, value, id) on the tag
+# tables, which covers the tag queries, (id) on the tag and ways_nodes tables and (node_id) on ways_nodes. It runs
+# ANALYZE so the query planner knows how selective they are, and prints how long each index took and its size.
+# Before importing into tables that already have the indexes, loader.drop_indexes removes them so the inserts don't
+# have to update them.
+
+# In[ ]:
+
+from loader import create_tags_table, create_user_stats, create_indexes, drop_indexes
+
+create_tags_table(conn)
+create_user_stats(conn)
+create_indexes(conn, verbose=True)
+
+
 # In[37]:
 
 conn.close()
 
 
+# Writing ~600Mb of csv files and then reading every one of them back into a list before inserting it is slow and uses
+# a lot of memory. loader.load_map skips the csv files altogether: it shapes the OSM file straight into the
+# tables in batches, inside a single transaction, and only creates the indexes once all of the rows are in.
+
+# In[ ]:
+
+import loader
+
+if __name__ == '__main__':
+    loader.load_map(OSMFILE, filename)
+
+
+# To look up what is in an area, spatial.py builds R*Tree indexes over the node coordinates and the way bounding boxes
+# (load_map builds them with spatial_index=True). query_bbox then returns the nodes, their tags and the ways in a
+# bounding box without scanning the nodes table, e.g. around Union Square:
+
+# In[ ]:
+
+import spatial
+
+if __name__ == '__main__':
+    conn = sqlite3.connect(filename)
+    spatial.create_spatial_index(conn)
+    union_square = spatial.query_bbox(conn, 37.7870, -122.4085, 37.7890, -122.4065)
+    print len(union_square['nodes']), len(union_square['ways'])
+    conn.close()
+
+
+# To refresh the database, there's no need to download a new extract and repeat the whole audit, shaping and import.
+# osmchange.py applies the OsmChange diffs (.osc) published for the extract to the loaded database, in one
+# transaction per file: created and modified elements are shaped and cleaned with shape_element and replace their old
+# rows, deleted elements are removed, and the tags, user_stats and R*Tree tables are kept in sync. A diff that was
+# already applied is skipped, since its versions aren't newer than the ones in the database.
+
+# In[ ]:
+
+import osmchange
+
+if __name__ == '__main__':
+    DIFF_FILE = "/Users/elizabethallen/Documents/Udacity_P3_Project/daily.osc"
+    print osmchange.apply_change_file(filename, DIFF_FILE)
+
+
 # Now that I have my tables and data imported into SQLite, I want to see how many rows each table has using the below query for each table.
 
 # In[38]:
@@ -1272,6 +1095,18 @@ print 'ways_nodes count: ' + str(row_count(filename, '''SELECT COUNT(*) FROM way
 # * Who are the top 10 contributors?
 # * How many unique users are there?
 # * What's the min, max and mean for the number of posts per user?
+# 
+# Update: the user activity queries below used to count the posts of every user from a UNION ALL of the nodes and
+# ways tables, once per query (twice in the above average query). They now read the user_stats table, which the
+# loader fills with the node, way and total counts and the first and last post of each user (see
+# loader.create_user_stats).
+# 
+# Update: the tag queries below used to rebuild a UNION ALL of ways_tags and nodes_tags for every query (twice for
+# the cuisine and place of worship queries). They now read the tags table, which loader.create_tags_table builds
+# once at load time with an element_type column (node, way or relation) and indexes on (key, value), (value) and
+# (element_type, id). The restaurant/cuisine joins match on element_type as well as id, since a node and a way can
+# have the same id. Relation tags are in the tags table too, so the counts can be slightly higher than the ones I
+# noted below.
 
 # In[46]:
 
@@ -1288,12 +1123,7 @@ QUERY = '''
 SELECT key
 , value
 , count(*) as count
-FROM (
-    SELECT *
-    FROM ways_tags
-    UNION ALL
-    SELECT *
-    FROM nodes_tags) as all_tags
+FROM tags
 WHERE key LIKE '%city%'
 GROUP BY 1,2
 ORDER BY count DESC 
@@ -1312,12 +1142,7 @@ QUERY = '''
 SELECT key
 , value
 , COUNT(*)
-FROM (
-    SELECT *
-    FROM nodes_tags
-    UNION ALL
-    SELECT *
-    FROM ways_tags) as all_tags
+FROM tags
 WHERE key LIKE '%postcode%'
 GROUP BY 1,2
 ORDER BY 3 DESC
@@ -1336,12 +1161,7 @@ QUERY = '''
 SELECT key
 , value
 , COUNT(*)
-FROM (
-    SELECT *
-    FROM nodes_tags
-    UNION ALL
-    SELECT *
-    FROM ways_tags) as all_tags
+FROM tags
 WHERE key LIKE '%country%'
 GROUP BY 1,2
 ORDER BY 3 DESC
@@ -1360,12 +1180,7 @@ QUERY = '''
 SELECT key
 , value
 , COUNT(*)
-FROM (
-    SELECT *
-    FROM nodes_tags
-    UNION ALL
-    SELECT *
-    FROM ways_tags) as all_tags
+FROM tags
 WHERE key LIKE '%state%'
 GROUP BY 1,2
 ORDER BY 3 DESC
@@ -1382,14 +1197,8 @@ pprint(results)
 # Who are the top 10 contributors?
 QUERY = '''
 SELECT user
-, COUNT(*)
-FROM (
-    SELECT user
-    FROM nodes
-    UNION ALL
-    SELECT user
-    FROM ways) as all_users
-GROUP BY 1
+, total
+FROM user_stats
 ORDER BY 2 DESC
 LIMIT 10
 '''
@@ -1404,12 +1213,7 @@ pprint(results)
 # How many unique users are there?
 QUERY = '''
 SELECT COUNT(DISTINCT user)
-FROM (
-    SELECT user
-    FROM nodes
-    UNION ALL
-    SELECT user
-    FROM ways) as all_users
+FROM user_stats
 ;
 '''
 
@@ -1422,20 +1226,10 @@ pprint(results)
 
 # What's the min, max and mean for the number of posts per user?
 QUERY = '''
-SELECT min(cnt) as min
-, max(cnt) as max
-, avg(cnt) as avg
-FROM (
-SELECT user
-, COUNT(*) as cnt
-FROM (
-    SELECT user
-    FROM nodes
-    UNION ALL
-    SELECT user
-    FROM ways) as all_users
-GROUP BY 1
-ORDER BY 2 DESC) 
+SELECT min(total) as min
+, max(total) as max
+, avg(total) as avg
+FROM user_stats
 ;
 '''
 
@@ -1460,12 +1254,7 @@ pprint(results)
 QUERY = ''' 
 SELECT key
 , count(*) as count
-FROM (
-    SELECT *
-    FROM ways_tags
-    UNION ALL
-    SELECT *
-    FROM nodes_tags) as all_tags
+FROM tags
 GROUP BY 1
 ORDER BY count DESC 
 LIMIT 50
@@ -1483,12 +1272,7 @@ QUERY = '''
 SELECT key
 , value
 , count(*) as count
-FROM (
-    SELECT *
-    FROM ways_tags
-    UNION ALL
-    SELECT *
-    FROM nodes_tags) as all_tags
+FROM tags
 WHERE key == 'amenity'
 GROUP BY 1,2
 ORDER BY count DESC 
@@ -1509,22 +1293,12 @@ SELECT r.value
 , COUNT(*) 
 FROM (
 SELECT *
-FROM (
-    SELECT *
-    FROM ways_tags
-    UNION ALL
-    SELECT *
-    FROM nodes_tags) as all_tags
+FROM tags
 WHERE value == 'restaurant') as r,
 (SELECT *
-FROM (
-    SELECT *
-    FROM ways_tags
-    UNION ALL
-    SELECT *
-    FROM nodes_tags) as all_tags
+FROM tags
 WHERE key == 'cuisine') as c
-ON r.id = c.id
+ON r.element_type = c.element_type AND r.id = c.id
 GROUP BY 1,2
 ORDER BY 3 DESC
 LIMIT 10
@@ -1544,22 +1318,12 @@ SELECT r.value
 , COUNT(*) 
 FROM (
 SELECT *
-FROM (
-    SELECT *
-    FROM ways_tags
-    UNION ALL
-    SELECT *
-    FROM nodes_tags) as all_tags
+FROM tags
 WHERE value == 'place_of_worship') as r,
 (SELECT *
-FROM (
-    SELECT *
-    FROM ways_tags
-    UNION ALL
-    SELECT *
-    FROM nodes_tags) as all_tags
+FROM tags
 WHERE key == 'religion') as c
-ON r.id = c.id
+ON r.element_type = c.element_type AND r.id = c.id
 GROUP BY 1,2
 ORDER BY 3 DESC
 LIMIT 10
@@ -1577,12 +1341,7 @@ QUERY = '''
 SELECT key
 , value
 , COUNT(*)
-FROM (
-    SELECT *
-    FROM ways_tags
-    UNION ALL
-    SELECT *
-    FROM nodes_tags) as all_tags
+FROM tags
 WHERE key == 'shop'
 GROUP BY 1,2
 ORDER BY 3 DESC
@@ -1617,31 +1376,11 @@ c = db.cursor()
 # How many users have posted more than the average amount?
 
 QUERY = '''
-SELECT COUNT(DISTINCT t.user)
-FROM (
-SELECT user
-, COUNT(*) as cnt
-FROM (
-    SELECT user
-    FROM nodes
-    UNION ALL
-    SELECT user
-    FROM ways) as all_users
-    GROUP BY 1
-    ORDER BY 2 DESC) as t,
-(SELECT ROUND(avg(cnt),2) as avg
-FROM (
-SELECT user
-, COUNT(*) as cnt
-FROM (
-    SELECT user
-    FROM nodes
-    UNION ALL
-    SELECT user
-    FROM ways) as all_users
-GROUP BY 1
-ORDER BY 2 DESC)) as a 
-WHERE t.cnt > a.avg
+SELECT COUNT(DISTINCT user)
+FROM user_stats
+WHERE total > (
+    SELECT ROUND(avg(total),2)
+    FROM user_stats)
 ;
 '''
 
@@ -1658,17 +1397,8 @@ pprint(results)
 
 QUERY = '''
 SELECT COUNT(DISTINCT user)
-FROM (
-SELECT user
-, COUNT(*) as cnt
-FROM (
-    SELECT user
-    FROM nodes
-    UNION ALL
-    SELECT user
-    FROM ways) as all_users
-GROUP BY 1
-HAVING cnt == 1)
+FROM user_stats
+WHERE total == 1
 ;
 '''
 
@@ -1688,32 +1418,9 @@ pprint(results)
 
 QUERY = '''
 SELECT user
-, cnt
-, ROUND(ROUND(cnt,4) / ROUND(total,4) * 100,2) as percent
-FROM (
-SELECT u.user as user
-, u.cnt as cnt
-, a.total as total
-FROM (
-SELECT COUNT(*) as total
-FROM (
-    SELECT user
-    FROM nodes
-    UNION ALL
-    SELECT user
-    FROM ways)) as a
-JOIN (
-SELECT user
-, COUNT(*) as cnt
-FROM (
-    SELECT user
-    FROM nodes
-    UNION ALL
-    SELECT user
-    FROM ways) as all_posts
-GROUP BY 1
-ORDER BY 2 DESC) as u
-ORDER BY 2 DESC)
+, total
+, ROUND(ROUND(total,4) / ROUND((SELECT SUM(total) FROM user_stats),4) * 100,2) as percent
+FROM user_stats
 ORDER BY 2 DESC
 ;
 '''
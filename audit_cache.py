@@ -0,0 +1,143 @@
+# Note: An on-disk cache of audit reports, so that rerunning the audits on an OSM file that hasn't changed doesn't
+# parse it again. run_audits(osm_file, cache=AuditCache()) looks up each auditor's report first and only parses the
+# file for the auditors that missed; if they all hit, the file isn't parsed at all.
+#
+# Each report is stored in its own file, named by a hash of:
+# * the OSM file's size, modification time and a fast hash of 16 blocks of 64kB spread over the file
+# * the auditor's code version: a hash of the source of the module that defines it, so that editing an audit (or a
+#   helper it uses) invalidates its reports
+# * the auditor's class and settings (e.g. the expected street types of StreetTypeAuditor)
+# The reports are pickled, since they hold sets and defaultdicts. Reading a report marks it as recently used, and
+# once the cache is bigger than max_bytes the least recently used reports are removed.
+
+import cPickle as pickle
+import hashlib
+import inspect
+import os
+import tempfile
+
+CACHE_DIR = '.audit_cache'
+MAX_BYTES = 256 << 20
+
+SAMPLE_SIZE = 1 << 16
+SAMPLES = 16
+
+# {source file: hash of its contents}, computed once per process
+source_hashes = {}
+
+
+def fast_hash(path, size):
+    """Return a hash of the whole file if it is small, or of SAMPLES blocks spread over it"""
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        if size <= SAMPLE_SIZE * SAMPLES:
+            h.update(f.read())
+        else:
+            for i in range(SAMPLES):
+                f.seek((size - SAMPLE_SIZE) * i // (SAMPLES - 1))
+                h.update(f.read(SAMPLE_SIZE))
+    return h.hexdigest()
+
+
+def file_version(path):
+    # Identifies the contents of the OSM file: its size, modification time and fast hash.
+    stat = os.stat(path)
+    return '%d:%r:%s' % (stat.st_size, stat.st_mtime, fast_hash(path, stat.st_size))
+
+
+def code_version(auditor):
+    """Return a hash of the source of the module that defines the auditor's class"""
+    source_file = inspect.getsourcefile(type(auditor))
+    if source_file not in source_hashes:
+        with open(source_file, 'rb') as f:
+            source_hashes[source_file] = hashlib.sha1(f.read()).hexdigest()
+    return source_hashes[source_file]
+
+
+class AuditCache(object):
+    """Audit reports stored in cache_dir, keyed by input file and auditor, evicted LRU beyond max_bytes"""
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def keys(self, osm_file, auditors):
+        # Returns the cache key of each auditor's report on osm_file. The keys include the auditors' settings, so
+        # they have to be computed before the auditors have seen any elements.
+        version = file_version(osm_file)
+        keys = []
+        for auditor in auditors:
+            settings = repr(sorted(vars(auditor).items()))
+            key = '\0'.join([version, code_version(auditor), type(auditor).__name__, auditor.name, settings])
+            keys.append(hashlib.sha1(key).hexdigest())
+        return keys
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key + '.pickle')
+
+    def get(self, key):
+        """Return the cached report for key, or None"""
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                report = pickle.load(f)
+        except (IOError, EOFError, pickle.UnpicklingError):
+            self.misses += 1
+            return None
+        # The modification time of a report is the time it was last used
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        self.hits += 1
+        return report
+
+    def put(self, key, report):
+        """Store a report, then evict the least recently used reports if the cache is over max_bytes"""
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        # Written to a temporary file and renamed, so a report is never read half written
+        fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(report, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(temp_path, self.path(key))
+        except:
+            os.remove(temp_path)
+            raise
+        self.evict()
+
+    def entries(self):
+        # Returns (last used, size, path) of every report in the cache, least recently used first.
+        entries = []
+        if os.path.isdir(self.cache_dir):
+            for name in os.listdir(self.cache_dir):
+                if name.endswith('.pickle'):
+                    path = os.path.join(self.cache_dir, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, path))
+        return sorted(entries)
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self):
+        for _, _, path in self.entries():
+            os.remove(path)
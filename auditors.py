@@ -0,0 +1,279 @@
+# Note: These auditors are the same audits as the "Data Audit" cells of the notebook, rewritten as objects so that
+# they can all share one pass over the OSM file. Parsing a 60Mb+ extract once per audit was the slowest part of the
+# audit section, and every new audit added another full parse.
+#
+# All of the audits read the file through iter_elements, which releases each top level element once it has been
+# audited, so memory use stays flat however big the file is. Passing run_audits an audit_cache.AuditCache skips the
+# parse for audits that already ran on an unchanged file.
+
+try:
+    import xml.etree.cElementTree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
+from collections import defaultdict
+import re
+
+import pbf
+from osm_input import open_osm
+from xml_backends import Element
+
+lower = re.compile(r'^([a-z]|_)*$')
+lower_colon = re.compile(r'^([a-z]|_)*:([a-z]|_)*$')
+problemchars = re.compile(r'[=\+/&<>;\'"\?%#$@\,\. \t\r\n]')
+alldigits = re.compile(r'^[0-9]+$')
+allletters = re.compile(r'^[a-zA-Z]+$')
+
+street_type_re = re.compile(r'\b\S+\.?$', re.IGNORECASE)
+postal_code_re = re.compile(r'\d{5}(\-\d{4}$)?')
+phone_number_re = re.compile(r'(\d\-)?\d{3}\-\d{3}\-\d{4}|\(\d{3}\)\s\d{3}\-\d{4}|\d{3}\.\d{3}\.\d{4}')
+california_re = re.compile(r'[C|c][A|z]')
+unitedstates_re = re.compile(r'[U|u][S|s]')
+
+expected = ["Street", "Avenue", "Boulevard", "Drive", "Court", "Place", "Square", "Lane", "Road",
+            "Trail", "Parkway", "Commons"]
+
+
+class Auditor(object):
+    """Base class for an audit that can be run by run_audits"""
+
+    # Key of this auditor's report in the dictionary returned by run_audits
+    name = None
+
+    def audit(self, elem):
+        # Called once for every top level element in the file, in document order, and finally for the root element.
+        # Child elements are reached through elem.iter().
+        raise NotImplementedError
+
+    def report(self):
+        # Called once the whole file has been parsed. Returns the audit results.
+        raise NotImplementedError
+
+
+class TagCounter(Auditor):
+    """Count every tag type and collect the attributes seen on it"""
+
+    name = 'tag_types'
+
+    def __init__(self):
+        self.tag_types = {}
+
+    def audit(self, elem):
+        for elem in elem.iter():
+            tag = elem.tag
+            if tag in self.tag_types:
+                tag_info = self.tag_types[tag]
+                tag_info['count'] += 1
+                for attrib in elem.attrib:
+                    if attrib not in tag_info['attributes']:
+                        tag_info['attributes'].append(attrib)
+            else:
+                self.tag_types[tag] = {'count': 1, 'attributes': list(elem.attrib)}
+
+    def report(self):
+        return self.tag_types
+
+
+class AttributeAuditor(Auditor):
+    """Classify every attribute value of every tag as lower, lower_colon, problemchars, etc."""
+
+    name = 'attributes'
+
+    def __init__(self):
+        self.tag_types = {}
+
+    def audit(self, elem):
+        for elem in elem.iter():
+            attrib_info = self.tag_types.setdefault(elem.tag, {})
+            for attrib, val in elem.attrib.items():
+                if attrib not in attrib_info:
+                    attrib_info[attrib] = {"lower": 0, "lower_colon": 0, "problemchars": 0, "alldigits": 0,
+                                           "allletters": 0, "other": 0}
+                key_audit(attrib, val, attrib_info[attrib])
+
+    def report(self):
+        return self.tag_types
+
+
+class StreetTypeAuditor(Auditor):
+    """Collect street names of node and way elements whose street type isn't in the expected list"""
+
+    name = 'street_types'
+
+    def __init__(self, expected=expected):
+        self.expected = expected
+        self.street_types = defaultdict(set)
+
+    def audit(self, elem):
+        if elem.tag == "node" or elem.tag == "way":
+            for tag in elem.iter("tag"):
+                if tag.attrib['k'] == "addr:street":
+                    m = street_type_re.search(tag.attrib['v'])
+                    if m and m.group() not in self.expected:
+                        self.street_types[m.group()].add(tag.attrib['v'])
+
+    def report(self):
+        return self.street_types
+
+
+class AddressAuditor(Auditor):
+    """Count state, country, postcode and phone number values that do and don't match the expected format"""
+
+    name = 'audit_vals'
+
+    def __init__(self):
+        self.audit_vals = {'california': {'Match': 0, 'Other': 0},
+                           'postcodes': {'Match': 0, 'Other': 0},
+                           'phonenumbers': {'Match': 0, 'Other': 0},
+                           'unitedstates': {'Match': 0, 'Other': 0}
+                           }
+
+    def audit(self, elem):
+        if elem.tag == "node" or elem.tag == "way":
+            for tag in elem.iter("tag"):
+                group = address_group(tag.attrib['k'])
+                if group is not None:
+                    if address_match(group, tag.attrib['v']):
+                        self.audit_vals[group]['Match'] += 1
+                    else:
+                        self.audit_vals[group]['Other'] += 1
+
+    def report(self):
+        return self.audit_vals
+
+
+class OtherValuesAuditor(Auditor):
+    """Collect the state, country, postcode and phone number values that don't match the expected format"""
+
+    name = 'other_vals'
+
+    def __init__(self):
+        self.other_vals = defaultdict(set)
+
+    def audit(self, elem):
+        if elem.tag == "node" or elem.tag == "way":
+            for tag in elem.iter("tag"):
+                tag_type = tag.attrib['k']
+                group = address_group(tag_type)
+                if group is not None and not address_match(group, tag.attrib['v']):
+                    self.other_vals[tag_type].add(tag.attrib['v'])
+
+    def report(self):
+        return self.other_vals
+
+
+def key_audit(attrib, val, problems):
+    # Increments the first problem type whose regex matches the value. Returns the dictionary of problems.
+    if lower.search(val):
+        problems["lower"] += 1
+    elif lower_colon.search(val):
+        problems["lower_colon"] += 1
+    elif problemchars.search(val):
+        problems["problemchars"] += 1
+    elif alldigits.search(val):
+        problems["alldigits"] += 1
+    elif allletters.search(val):
+        problems['allletters'] += 1
+    else:
+        problems["other"] += 1
+    return problems
+
+
+def address_group(tag_type):
+    # Returns which of the address audits a tag key belongs to, or None if it isn't audited.
+    if tag_type == 'addr:state':
+        return 'california'
+    elif 'country' in tag_type:
+        return 'unitedstates'
+    elif 'postcode' in tag_type:
+        return 'postcodes'
+    elif 'phone' in tag_type:
+        return 'phonenumbers'
+    return None
+
+
+ADDRESS_RES = {'california': california_re,
+               'unitedstates': unitedstates_re,
+               'postcodes': postal_code_re,
+               'phonenumbers': phone_number_re}
+
+
+def address_match(group, tag_val):
+    return ADDRESS_RES[group].search(tag_val) is not None
+
+
+def iter_elements(osm_file):
+    """Yield each complete top level element of the OSM file, and the root element last"""
+    # Each element is cleared, and the root's reference to it dropped, as soon as the caller asks for the next one.
+    # The root is yielded without its children, but with its attributes, so that audits that look at every element
+    # still see it. Compressed files are decompressed as they are read (see osm_input.py). PBF files have no root
+    # element, an empty <osm> one stands in for it.
+    if not hasattr(osm_file, 'read') and pbf.is_pbf(osm_file):
+        for elem in pbf.iter_pbf(osm_file):
+            yield elem
+        yield Element('osm', {})
+        return
+    f = open_osm(osm_file)
+    try:
+        context = ET.iterparse(f, events=('start', 'end'))
+        _, root = next(context)
+        root_attrib = dict(root.attrib)
+        depth = 1
+        for event, elem in context:
+            if event == 'start':
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 1:
+                    yield elem
+                    elem.clear()
+                    root.clear()
+    finally:
+        if f is not osm_file:
+            f.close()
+    # clear() also drops the root's attributes
+    root.attrib.update(root_attrib)
+    yield root
+
+
+def iter_all_elements(osm_file):
+    """Yield every element of the OSM file, child elements included, releasing them the same way as iter_elements"""
+    for top in iter_elements(osm_file):
+        for elem in top.iter():
+            yield elem
+
+
+def default_auditors():
+    """Return one of each of the notebook's audits"""
+    return [TagCounter(), AttributeAuditor(), StreetTypeAuditor(), AddressAuditor(), OtherValuesAuditor()]
+
+
+def run_audits(osm_file, auditors=None, cache=None):
+    """Parse osm_file once, pass every element to every auditor and return their reports keyed by auditor name"""
+    if auditors is None:
+        auditors = default_auditors()
+
+    # With an audit_cache.AuditCache, the reports of auditors that already ran on the same file are read back, and
+    # the file is only parsed for the others. Open files can't be keyed, so they are always parsed.
+    reports = {}
+    keys = {}
+    if cache is not None and not hasattr(osm_file, 'read'):
+        pending = []
+        for auditor, key in zip(auditors, cache.keys(osm_file, auditors)):
+            report = cache.get(key)
+            if report is None:
+                keys[auditor] = key
+                pending.append(auditor)
+            else:
+                reports[auditor.name] = report
+        auditors = pending
+
+    if auditors:
+        for elem in iter_elements(osm_file):
+            for auditor in auditors:
+                auditor.audit(elem)
+
+    for auditor in auditors:
+        reports[auditor.name] = auditor.report()
+        if auditor in keys:
+            cache.put(keys[auditor], reports[auditor.name])
+    return reports
@@ -0,0 +1,148 @@
+# Compares the dictionary based shaping and csv writing (shape_element and UnicodeDictWriter) with the tuple based
+# one (shape_rows and RowWriter) on sample.osm, or on the file given as argument.
+#
+# For every element the dictionary path builds one dictionary for the element, one per node/way, tag and nd row,
+# and UnicodeDictWriter builds another dictionary and csv.DictWriter a list for every row it writes. The tuple path
+# builds one tuple per row and no dictionaries. The times include parsing.
+#
+# The dicts, lists and tuples per element are counted in a separate run, since CPython frees them as soon as a row has
+# been written and Python 2 can't count allocations: that run keeps every object that shaping returns and that the
+# writers build from it alive, then counts the distinct containers reachable from them.
+
+import io
+import sys
+import time
+
+from shaping import (get_element, shape_element, shape_rows, UnicodeDictWriter, RowWriter, NODE_FIELDS,
+                     NODE_TAGS_FIELDS, WAY_FIELDS, WAY_NODES_FIELDS, WAY_TAGS_FIELDS)
+
+FIELDS = [NODE_FIELDS, NODE_TAGS_FIELDS, WAY_FIELDS, WAY_NODES_FIELDS, WAY_TAGS_FIELDS]
+
+
+def count_containers(objects):
+    # Returns the number of distinct dicts, lists and tuples in objects and inside them.
+    counts = {'dicts': 0, 'lists': 0, 'tuples': 0}
+    seen = set()
+    stack = list(objects)
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        if isinstance(obj, dict):
+            counts['dicts'] += 1
+            stack.extend(obj.values())
+        elif isinstance(obj, list):
+            counts['lists'] += 1
+            stack.extend(obj)
+        elif isinstance(obj, tuple):
+            counts['tuples'] += 1
+            stack.extend(obj)
+    return counts
+
+
+def keeping(func, keep):
+    # Wraps func so that its arguments and result are appended to keep.
+    def wrapper(*args):
+        result = func(*args)
+        keep.extend(args)
+        keep.append(result)
+        return result
+    return wrapper
+
+
+def run_dicts(osm_file, keep=None):
+    writers = [UnicodeDictWriter(io.BytesIO(), fields) for fields in FIELDS]
+    if keep is not None:
+        # UnicodeDictWriter hands its encoded dict to csv.DictWriter, which converts it to a list for csv.writer
+        for writer in writers:
+            writer._dict_to_list = keeping(writer._dict_to_list, keep)
+    nodes_writer, node_tags_writer, ways_writer, way_nodes_writer, way_tags_writer = writers
+    elements = 0
+    for element in get_element(osm_file, tags=('node', 'way')):
+        el = shape_element(element)
+        if keep is not None:
+            keep.append(el)
+        if el:
+            elements += 1
+            if element.tag == 'node':
+                nodes_writer.writerow(el['node'])
+                node_tags_writer.writerows(el['node_tags'])
+            else:
+                ways_writer.writerow(el['way'])
+                way_nodes_writer.writerows(el['way_nodes'])
+                way_tags_writer.writerows(el['way_tags'])
+    return elements
+
+
+def run_tuples(osm_file, keep=None):
+    writers = [RowWriter(io.BytesIO(), fields) for fields in FIELDS]
+    if keep is not None:
+        # RowWriter hands its batches of rows to csv.writer
+        for writer in writers:
+            writer.writer = KeepingWriter(writer.writer, keep)
+    nodes_writer, node_tags_writer, ways_writer, way_nodes_writer, way_tags_writer = writers
+    elements = 0
+    for element in get_element(osm_file, tags=('node', 'way')):
+        el = shape_rows(element)
+        if keep is not None:
+            keep.append(el)
+        if el:
+            elements += 1
+            tag, row, tag_rows, way_node_rows = el
+            if tag == 'node':
+                nodes_writer.writerow(row)
+                node_tags_writer.writerows(tag_rows)
+            else:
+                ways_writer.writerow(row)
+                way_nodes_writer.writerows(way_node_rows)
+                way_tags_writer.writerows(tag_rows)
+    for writer in writers:
+        writer.flush()
+    return elements
+
+
+class KeepingWriter(object):
+    """csv.writer that keeps the rows it is given"""
+
+    def __init__(self, writer, keep):
+        self.writer = writer
+        self.keep = keep
+
+    def writerow(self, row):
+        self.keep.append(row)
+        self.writer.writerow(row)
+
+    def writerows(self, rows):
+        # RowWriter empties its batch once it has been written, so the rows are kept rather than the batch
+        rows = list(rows)
+        self.keep.extend(rows)
+        self.writer.writerows(rows)
+
+
+def best_time(run, osm_file, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        elements = run(osm_file)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, elements
+
+
+def allocations(run, osm_file):
+    # Returns the dicts, lists and tuples built by one run, see the note at the top.
+    keep = []
+    run(osm_file, keep)
+    return count_containers(keep)
+
+
+if __name__ == '__main__':
+    osm_file = sys.argv[1] if len(sys.argv) > 1 else 'sample.osm'
+    for name, run in [('dicts', run_dicts), ('tuples', run_tuples)]:
+        elapsed, elements = best_time(run, osm_file)
+        counts = allocations(run, osm_file)
+        print '{0:7} {1:8.2f} us/element  {2:5.1f} dicts  {3:5.1f} lists  {4:5.1f} tuples per element'.format(
+            name, elapsed / elements * 1e6, counts['dicts'] / float(elements),
+            counts['lists'] / float(elements), counts['tuples'] / float(elements))
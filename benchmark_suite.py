@@ -0,0 +1,233 @@
+# Note: Times every step of the project on synthetic OSM files from synthetic_osm.py at 1x, 10x and 100x the size of
+# sample.osm: parsing, auditing, shaping and csv writing, loading into SQLite, and the exploration queries of the
+# notebook. The files are generated with a fixed seed, so runs of different versions of the code measure the same
+# input, and the results are written as JSON with the commit they were measured on.
+#
+# The shaping and loading are run under profiler.py, so their time is split by stage (shape, clean, write, insert,
+# sql); the profiler adds a few percent to those totals. Each step is run repeat times and the fastest run is kept.
+#
+# Give --compare an earlier results file to print the change of every step, flagging the ones that got slower by more
+# than --threshold.
+#
+# Usage: python benchmark_suite.py [--scales 1,10,100] [--repeat N] [--seed N] [--output FILE] [--compare FILE]
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+
+import auditors
+import profiler
+import synthetic_osm
+from xml_backends import get_element
+
+SCALES = [1, 10, 100]
+
+# The exploration queries of the notebook
+QUERIES = [('top_cities', '''SELECT key, value, COUNT(*) AS count FROM tags WHERE key LIKE '%city%'
+    GROUP BY 1, 2 ORDER BY count DESC LIMIT 10;'''),
+           ('top_postcodes', '''SELECT key, value, COUNT(*) FROM tags WHERE key LIKE '%postcode%'
+    GROUP BY 1, 2 ORDER BY 3 DESC LIMIT 10;'''),
+           ('countries', '''SELECT key, value, COUNT(*) FROM tags WHERE key LIKE '%country%'
+    GROUP BY 1, 2 ORDER BY 3 DESC LIMIT 20;'''),
+           ('states', '''SELECT key, value, COUNT(*) FROM tags WHERE key LIKE '%state%'
+    GROUP BY 1, 2 ORDER BY 3 DESC LIMIT 20;'''),
+           ('top_contributors', 'SELECT user, total FROM user_stats ORDER BY 2 DESC LIMIT 10;'),
+           ('unique_users', 'SELECT COUNT(DISTINCT user) FROM user_stats;'),
+           ('posts_per_user', 'SELECT MIN(total), MAX(total), AVG(total) FROM user_stats;'),
+           ('top_keys', 'SELECT key, COUNT(*) AS count FROM tags GROUP BY 1 ORDER BY count DESC LIMIT 50;'),
+           ('top_amenities', '''SELECT key, value, COUNT(*) AS count FROM tags WHERE key == 'amenity'
+    GROUP BY 1, 2 ORDER BY count DESC LIMIT 10;'''),
+           ('restaurant_cuisines', '''SELECT r.value, c.value, COUNT(*)
+    FROM (SELECT * FROM tags WHERE value == 'restaurant') AS r,
+         (SELECT * FROM tags WHERE key == 'cuisine') AS c
+    ON r.element_type = c.element_type AND r.id = c.id
+    GROUP BY 1, 2 ORDER BY 3 DESC LIMIT 10;'''),
+           ('worship_religions', '''SELECT r.value, c.value, COUNT(*)
+    FROM (SELECT * FROM tags WHERE value == 'place_of_worship') AS r,
+         (SELECT * FROM tags WHERE key == 'religion') AS c
+    ON r.element_type = c.element_type AND r.id = c.id
+    GROUP BY 1, 2 ORDER BY 3 DESC LIMIT 10;'''),
+           ('top_shops', '''SELECT key, value, COUNT(*) FROM tags WHERE key == 'shop'
+    GROUP BY 1, 2 ORDER BY 3 DESC LIMIT 10;'''),
+           ('above_average_users', '''SELECT COUNT(DISTINCT user) FROM user_stats
+    WHERE total > (SELECT ROUND(AVG(total), 2) FROM user_stats);'''),
+           ('single_post_users', 'SELECT COUNT(DISTINCT user) FROM user_stats WHERE total == 1;'),
+           ('user_shares', '''SELECT user, total,
+    ROUND(ROUND(total, 4) / ROUND((SELECT SUM(total) FROM user_stats), 4) * 100, 2) AS percent
+    FROM user_stats ORDER BY 2 DESC;''')]
+
+
+def best_of(repeat, func, *args):
+    # Runs func repeat times. Returns (fastest time in seconds, result of the fastest run).
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        result = func(*args)
+        elapsed = time.time() - start
+        if best is None or elapsed < best[0]:
+            best = (elapsed, result)
+    return best
+
+
+def count_elements(osm_file):
+    return sum(1 for _ in get_element(osm_file))
+
+
+def profile_stages(osm_file, db_file=None):
+    # Returns the profiler report of shaping osm_file into csv files in the current directory, or loading it into
+    # db_file.
+    if db_file is not None and os.path.exists(db_file):
+        os.remove(db_file)
+    return profiler.profile_map(osm_file, db_file=db_file, progress=False)
+
+
+def run_queries(db_file, repeat):
+    conn = sqlite3.connect(db_file)
+    try:
+        results = OrderedDict()
+        for name, query in QUERIES:
+            results[name] = round(best_of(repeat, lambda: conn.execute(query).fetchall())[0], 6)
+        return results
+    finally:
+        conn.close()
+
+
+def step(seconds, count=None, unit=None):
+    result = OrderedDict([('seconds', round(seconds, 4))])
+    if count is not None:
+        result[unit] = count
+        result[unit + '_per_second'] = round(count / seconds) if seconds else None
+    return result
+
+
+def run_scale(scale, work_dir, seed=0, repeat=1, out=sys.stdout):
+    """Generate the file for one scale in work_dir and time each step on it"""
+    osm_file = os.path.join(work_dir, 'synthetic_%dx.osm' % scale)
+    db_file = os.path.join(work_dir, 'synthetic_%dx.db' % scale)
+    steps = OrderedDict()
+
+    start = time.time()
+    synthetic_osm.write_file(osm_file, scale, seed)
+    out.write('%dx: generated %.1fMB in %.1fs\n' % (scale, os.path.getsize(osm_file) / 1e6, time.time() - start))
+
+    seconds, elements = best_of(repeat, count_elements, osm_file)
+    steps['parse'] = step(seconds, elements, 'elements')
+    seconds, _ = best_of(repeat, auditors.run_audits, osm_file)
+    steps['audit'] = step(seconds, elements, 'elements')
+
+    # The csv files are written to the current directory
+    cwd = os.getcwd()
+    os.chdir(work_dir)
+    try:
+        seconds, report = best_of(repeat, profile_stages, osm_file)
+    finally:
+        os.chdir(cwd)
+    steps['shape'] = step(seconds, elements, 'elements')
+    steps['shape']['stages'] = report['stages']
+    steps['shape']['csv_bytes'] = sum(os.path.getsize(os.path.join(work_dir, name))
+                                      for name in os.listdir(work_dir) if name.endswith('.csv'))
+
+    seconds, report = best_of(repeat, profile_stages, osm_file, db_file)
+    steps['load'] = step(seconds, elements, 'elements')
+    steps['load']['stages'] = report['stages']
+    steps['load']['db_bytes'] = os.path.getsize(db_file)
+
+    queries = run_queries(db_file, repeat)
+    steps['queries'] = step(sum(queries.values()))
+    steps['queries']['queries'] = queries
+
+    for name, result in steps.items():
+        out.write('%dx: %-8s %8.3fs\n' % (scale, name, result['seconds']))
+    return OrderedDict([('osm_bytes', os.path.getsize(osm_file)), ('elements', elements), ('steps', steps)])
+
+
+def git_commit():
+    # The commit the benchmarks ran on, with a + if the tree has uncommitted changes, or None outside a git checkout
+    here = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=here, stderr=subprocess.STDOUT).strip()
+        dirty = subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=here).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ('+' if dirty else '')
+
+
+def run_suite(scales=SCALES, seed=0, repeat=1, work_dir=None, out=sys.stdout):
+    """Run the benchmarks at each scale and return the results"""
+    results = OrderedDict([('commit', git_commit()),
+                           ('date', time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())),
+                           ('python', platform.python_version()),
+                           ('platform', platform.platform()),
+                           ('seed', seed),
+                           ('repeat', repeat),
+                           ('scales', OrderedDict())])
+    temporary = work_dir is None
+    if temporary:
+        work_dir = tempfile.mkdtemp(prefix='osm_benchmark_')
+    try:
+        for scale in scales:
+            scale_dir = os.path.join(work_dir, '%dx' % scale)
+            if not os.path.isdir(scale_dir):
+                os.makedirs(scale_dir)
+            results['scales'][str(scale)] = run_scale(scale, scale_dir, seed, repeat, out)
+    finally:
+        if temporary:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+def compare(old, new, threshold=0.2, out=sys.stdout):
+    """Print the change of each step between two results, and return the steps slower by more than threshold"""
+    regressions = []
+    for scale, result in new['scales'].items():
+        previous = old['scales'].get(scale)
+        if previous is None:
+            continue
+        for name, current in result['steps'].items():
+            before = previous['steps'].get(name)
+            if before is None or not before['seconds']:
+                continue
+            change = current['seconds'] / before['seconds'] - 1
+            flag = ''
+            if change > threshold:
+                flag = '  <-- slower'
+                regressions.append((scale, name, change))
+            out.write('%sx %-8s %8.3fs -> %8.3fs %+6.0f%%%s\n' % (
+                scale, name, before['seconds'], current['seconds'], change * 100, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the pipeline on synthetic OSM files')
+    parser.add_argument('--scales', default=','.join(str(scale) for scale in SCALES),
+                        help='comma separated multiples of sample.osm (default 1,10,100)')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of each step, the fastest is kept (default 3)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--work-dir', help='keep the generated files here instead of a temporary directory')
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', help='earlier results file to compare with')
+    parser.add_argument('--threshold', type=float, default=0.2, help='slowdown flagged by --compare (default 0.2)')
+    args = parser.parse_args()
+
+    results = run_suite([int(scale) for scale in args.scales.split(',')], args.seed, args.repeat, args.work_dir)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+        f.write('\n')
+
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+        if compare(old, results, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
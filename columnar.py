@@ -0,0 +1,154 @@
+# Note: Writes the tables to typed columnar files instead of csv, either Parquet (zstd compressed, in row
+# groups) or Arrow IPC files. The column types come from schema.py (integer -> int64, float -> float64, string -> utf8
+# string), so ids, coordinates and positions are stored as numbers rather than text, and a later scan can read only
+# the columns it needs (see read_table).
+#
+# pyarrow is optional: everything else in the project works without it, and only the functions below need it.
+
+import os
+
+import validation
+from shaping import (get_element, shape_rows, write_rows, SCHEMA, NODE_FIELDS, NODE_TAGS_FIELDS, WAY_FIELDS,
+                     WAY_NODES_FIELDS, WAY_TAGS_FIELDS, RELATION_FIELDS, RELATION_MEMBERS_FIELDS, RELATION_TAGS_FIELDS)
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+# (table name, schema key, fields) of each output, in the order of the writers passed to write_rows
+TABLES = [('nodes', 'node', NODE_FIELDS),
+          ('nodes_tags', 'node_tags', NODE_TAGS_FIELDS),
+          ('ways', 'way', WAY_FIELDS),
+          ('ways_nodes', 'way_nodes', WAY_NODES_FIELDS),
+          ('ways_tags', 'way_tags', WAY_TAGS_FIELDS),
+          ('relations', 'relation', RELATION_FIELDS),
+          ('relation_members', 'relation_members', RELATION_MEMBERS_FIELDS),
+          ('relation_tags', 'relation_tags', RELATION_TAGS_FIELDS)]
+
+EXTENSIONS = {'parquet': '.parquet', 'arrow': '.arrow'}
+
+ROW_GROUP_SIZE = 1 << 17
+
+
+def require_pyarrow():
+    if pa is None:
+        raise ImportError("pyarrow is needed to write or read Parquet and Arrow files (pip install pyarrow)")
+
+
+def field_rules(key):
+    # Returns the {field: rules} dictionary of a top level key of the schema, for both dict and list keys.
+    rules = SCHEMA[key]
+    if rules['type'] == 'list':
+        rules = rules['schema']
+    return rules['schema']
+
+
+def arrow_type(rules):
+    return {'integer': pa.int64(), 'float': pa.float64(), 'string': pa.string()}[rules['type']]
+
+
+def arrow_schema(key, fields):
+    """Return the pyarrow schema of the rows of key, with the columns in the order of fields"""
+    require_pyarrow()
+    rules = field_rules(key)
+    return pa.schema([pa.field(name, arrow_type(rules[name]), nullable=not rules[name].get('required'))
+                      for name in fields])
+
+
+def table_path(name, file_format='parquet', output_dir='.'):
+    if file_format not in EXTENSIONS:
+        raise ValueError("Unknown columnar format '{0}', choose from {1}".format(
+            file_format, ", ".join(sorted(EXTENSIONS))))
+    return os.path.join(output_dir, name + EXTENSIONS[file_format])
+
+
+class ColumnWriter(object):
+    """Write rows from shape_rows to a Parquet or Arrow file, one row group per row_group_size rows"""
+
+    # Has the writerow, writerows and flush methods of shaping.RowWriter, so write_rows can use either. Rows are
+    # buffered and converted to typed columns a row group at a time, using the coerce functions of the schema.
+
+    def __init__(self, path, key, fields, file_format='parquet', compression='zstd',
+                 row_group_size=ROW_GROUP_SIZE):
+        require_pyarrow()
+        self.schema = arrow_schema(key, fields)
+        rules = field_rules(key)
+        self.coercions = [rules[name].get('coerce') for name in fields]
+        self.batch = []
+        self.row_group_size = row_group_size
+        if file_format == 'parquet':
+            self.writer = pq.ParquetWriter(path, self.schema, compression=compression)
+            self.sink = None
+        elif file_format == 'arrow':
+            self.sink = pa.OSFile(path, 'wb')
+            self.writer = pa.RecordBatchFileWriter(self.sink, self.schema)
+        else:
+            raise ValueError("Unknown columnar format '{0}', choose from {1}".format(
+                file_format, ", ".join(sorted(EXTENSIONS))))
+
+    def writeheader(self):
+        # The column names are stored in the file's schema
+        pass
+
+    def writerow(self, row):
+        self.batch.append(row)
+        if len(self.batch) >= self.row_group_size:
+            self.flush()
+
+    def writerows(self, rows):
+        self.batch.extend(rows)
+        if len(self.batch) >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        if not self.batch:
+            return
+        columns = zip(*self.batch)
+        arrays = []
+        for values, coerce, field in zip(columns, self.coercions, self.schema):
+            if coerce is not None:
+                values = [coerce(value) for value in values]
+            arrays.append(pa.array(values, type=field.type))
+        table = pa.Table.from_arrays(arrays, schema=self.schema)
+        del self.batch[:]
+        if self.sink is None:
+            self.writer.write_table(table)
+        else:
+            for batch in table.to_batches():
+                self.writer.write_batch(batch)
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+        if self.sink is not None:
+            self.sink.close()
+
+
+def process_map(file_in, validate, file_format='parquet', compression='zstd', output_dir='.', backend=None):
+    """Iteratively process each XML element and write to Parquet or Arrow files"""
+    require_pyarrow()
+    writers = [ColumnWriter(table_path(name, file_format, output_dir), key, fields, file_format, compression)
+               for name, key, fields in TABLES]
+    try:
+        validator = validation.Validator(SCHEMA)
+        for element in get_element(file_in, tags=('node', 'way', 'relation'), backend=backend):
+            write_rows(shape_rows(element), writers, validate, validator)
+    finally:
+        for writer in writers:
+            writer.close()
+
+
+def read_table(name, columns=None, file_format='parquet', output_dir='.'):
+    """Read a table written by process_map as a pyarrow Table, with only the given columns if columns is set"""
+    # e.g. read_table('nodes', ['uid']).to_pandas()
+    require_pyarrow()
+    path = table_path(name, file_format, output_dir)
+    if file_format == 'parquet':
+        return pq.read_table(path, columns=columns)
+    source = pa.memory_map(path, 'r')
+    table = pa.RecordBatchFileReader(source).read_all()
+    if columns is not None:
+        table = pa.Table.from_arrays([table.column(column) for column in columns], names=columns)
+    return table
@@ -0,0 +1,463 @@
+# Note: These are the create table and insert queries from the "Data Import" section of the notebook, together with
+# a loader that shapes the OSM file straight into the SQLite database. Loading this way skips writing the csv files and
+# reading them back, and only keeps one batch of rows per table in memory. import_csv does the same batching for csv
+# files that have already been written.
+
+import sqlite3
+import csv
+import time
+from itertools import islice
+
+import spatial
+from shaping import get_element, shape_element
+
+NODES_FIELDS = ['id', 'lat', 'lon', 'user', 'uid', 'version', 'changeset', 'timestamp']
+NODES_INSERT = "INSERT INTO nodes(id, lat, lon, user, uid, version, changeset, timestamp) VALUES (?, ?, ?, ?, ?, ?, ?, ?);"
+NODES_QUERY = '''CREATE TABLE nodes (
+    id INTEGER PRIMARY KEY,
+    lat FLOAT,
+    lon FLOAT,
+    user STRING,
+    uid INTEGER,
+    version STRING,
+    changeset INTEGER,
+    timestamp STRING
+    );
+'''
+
+NODE_TAGS_FIELDS = ['id', 'key', 'value', 'type']
+NODES_TAGS_INSERT = '''INSERT INTO nodes_tags(id, key, value, type) VALUES (?, ?, ?, ?);'''
+NODES_TAGS_QUERY = '''CREATE TABLE nodes_tags (
+    id INTEGER,
+    key STRING,
+    value STRING,
+    type STRING,
+    FOREIGN KEY (id) REFERENCES nodes
+    );'''
+
+WAY_FIELDS = ['id', 'user', 'uid', 'version', 'changeset', 'timestamp']
+WAYS_INSERT = '''INSERT INTO ways(id, user, uid, version, changeset, timestamp) VALUES (?, ?, ?, ?, ?, ?);'''
+WAYS_QUERY = '''CREATE TABLE ways (
+    id INTEGER PRIMARY KEY,
+    user STRING,
+    uid INTEGER,
+    version STRING,
+    changeset INTEGER,
+    timestamp STRING
+    );'''
+
+WAY_NODES_FIELDS = ['id', 'node_id', 'position']
+WAYS_NODES_INSERT = '''INSERT INTO ways_nodes(id, node_id, position) VALUES (?, ?, ?);'''
+WAYS_NODES_QUERY = '''CREATE TABLE ways_nodes (
+    id INTEGER,
+    node_id INTEGER,
+    position INTEGER,
+    FOREIGN KEY (id) REFERENCES ways,
+    FOREIGN KEY (id) REFERENCES ways_tags
+    );'''
+
+WAY_TAGS_FIELDS = ['id', 'key', 'value', 'type']
+WAYS_TAGS_INSERT = '''INSERT INTO ways_tags(id, key, value, type) VALUES (?, ?, ?, ?);'''
+WAYS_TAGS_QUERY = '''CREATE TABLE ways_tags (
+    id INTEGER,
+    key STRING,
+    value STRING,
+    type STRING,
+    FOREIGN KEY (id) REFERENCES ways,
+    FOREIGN KEY (id) REFERENCES ways_nodes
+    );'''
+
+RELATION_FIELDS = ['id', 'user', 'uid', 'version', 'changeset', 'timestamp']
+RELATIONS_INSERT = '''INSERT INTO relations(id, user, uid, version, changeset, timestamp) VALUES (?, ?, ?, ?, ?, ?);'''
+RELATIONS_QUERY = '''CREATE TABLE relations (
+    id INTEGER PRIMARY KEY,
+    user STRING,
+    uid INTEGER,
+    version STRING,
+    changeset INTEGER,
+    timestamp STRING
+    );'''
+
+# member_id is the ref of the member, which is a node, way or relation id depending on type
+RELATION_MEMBERS_FIELDS = ['id', 'member_id', 'type', 'role', 'position']
+RELATION_MEMBERS_INSERT = '''INSERT INTO relation_members(id, member_id, type, role, position)
+    VALUES (?, ?, ?, ?, ?);'''
+RELATION_MEMBERS_QUERY = '''CREATE TABLE relation_members (
+    id INTEGER,
+    member_id INTEGER,
+    type STRING,
+    role STRING,
+    position INTEGER,
+    FOREIGN KEY (id) REFERENCES relations
+    );'''
+
+RELATION_TAGS_FIELDS = ['id', 'key', 'value', 'type']
+RELATION_TAGS_INSERT = '''INSERT INTO relation_tags(id, key, value, type) VALUES (?, ?, ?, ?);'''
+RELATION_TAGS_QUERY = '''CREATE TABLE relation_tags (
+    id INTEGER,
+    key STRING,
+    value STRING,
+    type STRING,
+    FOREIGN KEY (id) REFERENCES relations
+    );'''
+
+# Tables in load order, with the key of their rows in the dictionary returned by shape_element
+TABLES = [('nodes', NODES_QUERY, NODES_INSERT, NODES_FIELDS, 'node'),
+          ('nodes_tags', NODES_TAGS_QUERY, NODES_TAGS_INSERT, NODE_TAGS_FIELDS, 'node_tags'),
+          ('ways', WAYS_QUERY, WAYS_INSERT, WAY_FIELDS, 'way'),
+          ('ways_nodes', WAYS_NODES_QUERY, WAYS_NODES_INSERT, WAY_NODES_FIELDS, 'way_nodes'),
+          ('ways_tags', WAYS_TAGS_QUERY, WAYS_TAGS_INSERT, WAY_TAGS_FIELDS, 'way_tags'),
+          ('relations', RELATIONS_QUERY, RELATIONS_INSERT, RELATION_FIELDS, 'relation'),
+          ('relation_members', RELATION_MEMBERS_QUERY, RELATION_MEMBERS_INSERT, RELATION_MEMBERS_FIELDS,
+           'relation_members'),
+          ('relation_tags', RELATION_TAGS_QUERY, RELATION_TAGS_INSERT, RELATION_TAGS_FIELDS, 'relation_tags')]
+
+# All of the tags in one table, with the type of element they belong to (node, way or relation), so that tag queries
+# read one indexed table instead of a UNION ALL of the tag tables. It is filled from the tag tables once they are
+# loaded (create_tags_table) and kept in sync with them by triggers after that.
+TAGS_QUERY = '''CREATE TABLE tags (
+    element_type STRING,
+    id INTEGER,
+    key STRING,
+    value STRING,
+    type STRING
+    );'''
+
+# (element type, tag table) of each table the tags table is built from
+TAGS_SOURCES = [('node', 'nodes_tags'), ('way', 'ways_tags'), ('relation', 'relation_tags')]
+
+TAGS_INSERT = '''INSERT INTO tags(element_type, id, key, value, type)
+    SELECT '{0}', id, key, value, type FROM {1};'''
+
+# A deleted tag row only removes one matching row of tags, in case an element has the same tag twice
+TAGS_TRIGGERS = '''CREATE TRIGGER {1}_insert AFTER INSERT ON {1} BEGIN
+    INSERT INTO tags(element_type, id, key, value, type) VALUES ('{0}', NEW.id, NEW.key, NEW.value, NEW.type);
+END;
+CREATE TRIGGER {1}_delete AFTER DELETE ON {1} BEGIN
+    DELETE FROM tags WHERE rowid = (
+        SELECT rowid FROM tags
+        WHERE element_type = '{0}' AND id = OLD.id AND key IS OLD.key AND value IS OLD.value AND type IS OLD.type
+        LIMIT 1);
+END;
+CREATE TRIGGER {1}_update AFTER UPDATE ON {1} BEGIN
+    DELETE FROM tags WHERE rowid = (
+        SELECT rowid FROM tags
+        WHERE element_type = '{0}' AND id = OLD.id AND key IS OLD.key AND value IS OLD.value AND type IS OLD.type
+        LIMIT 1);
+    INSERT INTO tags(element_type, id, key, value, type) VALUES ('{0}', NEW.id, NEW.key, NEW.value, NEW.type);
+END;'''
+
+# Number of nodes and ways each user has posted, and the first and last timestamp of their posts, for the user
+# activity queries of the notebook. load_map counts them while it shapes the file (UserStats); create_user_stats
+# computes them from the nodes and ways tables, and refresh_user_stats recomputes the rows of some users after the
+# tables have been updated. A user who was renamed is listed under the name of their latest post (the greatest name if
+# several posts share that timestamp), whichever way the table was built.
+USER_STATS_QUERY = '''CREATE TABLE user_stats (
+    uid INTEGER PRIMARY KEY,
+    user STRING,
+    nodes INTEGER,
+    ways INTEGER,
+    total INTEGER,
+    first_timestamp STRING,
+    last_timestamp STRING
+    );'''
+
+USER_STATS_INSERT = '''INSERT OR REPLACE INTO user_stats(uid, user, nodes, ways, total, first_timestamp, last_timestamp)
+    VALUES (?, ?, ?, ?, ?, ?, ?);'''
+
+# Timestamps are ISO 8601 strings in UTC, so MIN and MAX order them correctly. They all have the same length, so the
+# greatest timestamp || user starts with the latest timestamp, and the rest of it is the name of the latest post.
+USER_STATS_SELECT = '''INSERT OR REPLACE INTO user_stats(uid, user, nodes, ways, total, first_timestamp, last_timestamp)
+    SELECT uid, SUBSTR(MAX(timestamp || user), LENGTH(MAX(timestamp)) + 1), SUM(is_node), SUM(1 - is_node), COUNT(*),
+        MIN(timestamp), MAX(timestamp)
+    FROM (
+        SELECT uid, user, 1 as is_node, timestamp
+        FROM nodes
+        {0}
+        UNION ALL
+        SELECT uid, user, 0, timestamp
+        FROM ways
+        {0}) as all_posts
+    GROUP BY uid;'''
+
+# Settings for the bulk load: no rollback journal or fsync (a failed load is simply rerun) and a 200Mb page cache.
+LOAD_PRAGMAS = ['PRAGMA journal_mode = OFF;',
+                'PRAGMA synchronous = OFF;',
+                'PRAGMA cache_size = -200000;',
+                'PRAGMA temp_store = MEMORY;']
+
+# Indexes are created after the rows are loaded, which is much faster than updating them on every insert. Each is
+# (name, table, columns). The (key, value, id) indexes cover the tag queries of the notebook: a filter on key, a group
+# by key and value, and a join on id are all answered from the index without reading the table.
+INDEXES = [('nodes_tags_key_value', 'nodes_tags', ['key', 'value', 'id']),
+           ('nodes_tags_id', 'nodes_tags', ['id']),
+           ('ways_tags_key_value', 'ways_tags', ['key', 'value', 'id']),
+           ('ways_tags_id', 'ways_tags', ['id']),
+           ('ways_nodes_id', 'ways_nodes', ['id']),
+           ('ways_nodes_node_id', 'ways_nodes', ['node_id']),
+           ('relation_tags_key_value', 'relation_tags', ['key', 'value', 'id']),
+           ('relation_tags_id', 'relation_tags', ['id']),
+           ('relation_members_id', 'relation_members', ['id']),
+           ('relation_members_member', 'relation_members', ['type', 'member_id']),
+           ('tags_key_value', 'tags', ['key', 'value', 'element_type', 'id']),
+           ('tags_value', 'tags', ['value', 'key']),
+           ('tags_element', 'tags', ['element_type', 'id'])]
+
+
+
+def index_query(name, table, columns):
+    return 'CREATE INDEX IF NOT EXISTS %s ON %s (%s);' % (name, table, ', '.join(columns))
+
+
+INDEX_QUERIES = [index_query(*index) for index in INDEXES]
+
+
+def create_tables(conn):
+    # Drops and recreates the tables so that the database can be reloaded from scratch.
+    cur = conn.cursor()
+    for table, query, _, _, _ in TABLES:
+        cur.execute('DROP TABLE IF EXISTS %s;' % table)
+        cur.execute(query)
+    conn.commit()
+
+
+def create_tags_table(conn):
+    """Build the tags table from the tag tables and add the triggers that keep it in sync with them"""
+    # Tag tables that don't exist (e.g. relation_tags in a database imported from the notebook's csv files) are
+    # skipped.
+    cur = conn.cursor()
+    tables = set(name for name, in cur.execute("SELECT name FROM sqlite_master WHERE type = 'table';"))
+    cur.execute('DROP TABLE IF EXISTS tags;')
+    cur.execute(TAGS_QUERY)
+    for element_type, table in TAGS_SOURCES:
+        if table not in tables:
+            continue
+        for action in ('insert', 'delete', 'update'):
+            cur.execute('DROP TRIGGER IF EXISTS %s_%s;' % (table, action))
+        cur.execute(TAGS_INSERT.format(element_type, table))
+        cur.executescript(TAGS_TRIGGERS.format(element_type, table))
+    conn.commit()
+
+
+class UserStats(object):
+    """Count the nodes and ways of each user while the map is shaped"""
+
+    def __init__(self):
+        # {uid: [user, nodes, ways, first timestamp, last timestamp]}
+        self.users = {}
+
+    def add(self, element_type, attribs):
+        # Takes 'node' or 'way' and the attributes returned by shape_element.
+        uid = int(attribs['uid'])
+        user = attribs['user']
+        timestamp = attribs['timestamp']
+        stats = self.users.get(uid)
+        if stats is None:
+            stats = self.users[uid] = [user, 0, 0, timestamp, timestamp]
+        if element_type == 'node':
+            stats[1] += 1
+        else:
+            stats[2] += 1
+        if timestamp < stats[3]:
+            stats[3] = timestamp
+        if latest(timestamp, user, stats[4], stats[0]):
+            stats[4] = timestamp
+            stats[0] = user
+
+    def rows(self):
+        for uid, (user, nodes, ways, first, last) in self.users.iteritems():
+            yield (uid, user, nodes, ways, nodes + ways, first, last)
+
+    def save(self, conn):
+        # Adds the counts to the user_stats table, merging them with the rows already there.
+        cur = conn.cursor()
+        rows = []
+        for uid, user, nodes, ways, total, first, last in self.rows():
+            old = cur.execute('''SELECT user, nodes, ways, first_timestamp, last_timestamp FROM user_stats
+                WHERE uid = ?;''', (uid,)).fetchone()
+            if old is not None:
+                nodes += old[1]
+                ways += old[2]
+                first = min(first, old[3])
+                if latest(old[4], old[0], last, user):
+                    last = old[4]
+                    user = old[0]
+            rows.append((uid, user, nodes, ways, nodes + ways, first, last))
+        cur.executemany(USER_STATS_INSERT, rows)
+        conn.commit()
+
+
+def latest(timestamp, user, other_timestamp, other_user):
+    # True if a post by user at timestamp is later than one by other_user at other_timestamp, using the same order as
+    # USER_STATS_SELECT: timestamps first, then names.
+    return (timestamp, user) > (other_timestamp, other_user)
+
+
+def create_user_stats(conn, stats=None):
+    """Create the user_stats table, from a UserStats if one is given or from the nodes and ways tables otherwise"""
+    cur = conn.cursor()
+    cur.execute('DROP TABLE IF EXISTS user_stats;')
+    cur.execute(USER_STATS_QUERY)
+    if stats is None:
+        cur.execute(USER_STATS_SELECT.format(''))
+        conn.commit()
+    else:
+        stats.save(conn)
+
+
+def refresh_user_stats(conn, uids):
+    # Recomputes the user_stats rows of the given users from the nodes and ways tables, e.g. after some of their
+    # nodes or ways were changed or deleted. Doesn't commit, so it can be part of the transaction that changed them.
+    cur = conn.cursor()
+    uids = list(uids)
+    for i in range(0, len(uids), 500):
+        batch = uids[i:i + 500]
+        placeholders = ', '.join('?' * len(batch))
+        cur.execute('DELETE FROM user_stats WHERE uid IN (%s);' % placeholders, batch)
+        cur.execute(USER_STATS_SELECT.format('WHERE uid IN (%s)' % placeholders), batch + batch)
+
+
+def create_indexes(conn, verbose=False, indexes=INDEXES):
+    """Create the indexes that don't exist yet and update the query planner's statistics"""
+    # Returns a list of (index name, seconds to build it, size in bytes) for the indexes it built, and prints them if
+    # verbose is set. The size is None if the SQLite library wasn't compiled with the dbstat table. Indexes of tables
+    # that don't exist (e.g. tags before create_tags_table) are skipped. indexes is a list like INDEXES, e.g. the
+    # indexes of the normalised tables (see normalized.py).
+    cur = conn.cursor()
+    existing = set(name for name, in cur.execute("SELECT name FROM sqlite_master WHERE type IN ('index', 'table');"))
+    report = []
+    for name, table, columns in indexes:
+        if name in existing or table not in existing:
+            continue
+        start = time.time()
+        cur.execute(index_query(name, table, columns))
+        conn.commit()
+        report.append((name, time.time() - start, index_size(conn, name)))
+        if verbose:
+            print_index(*report[-1])
+    start = time.time()
+    cur.execute('ANALYZE;')
+    conn.commit()
+    if verbose:
+        print 'ANALYZE: %.1fs' % (time.time() - start)
+    return report
+
+
+def drop_indexes(conn, indexes=INDEXES):
+    # Drops the indexes, e.g. before inserting a large number of rows into tables that already have them. Call
+    # create_indexes again once the rows are in.
+    cur = conn.cursor()
+    for name, _, _ in indexes:
+        cur.execute('DROP INDEX IF EXISTS %s;' % name)
+    conn.commit()
+
+
+def index_size(conn, name):
+    # Returns the size of an index in bytes, or None if the dbstat table isn't available.
+    try:
+        return conn.execute('SELECT SUM(pgsize) FROM dbstat WHERE name = ?;', (name,)).fetchone()[0]
+    except sqlite3.OperationalError:
+        return None
+
+
+def print_index(name, elapsed, size):
+    if size is None:
+        print '%s: %.1fs' % (name, elapsed)
+    else:
+        print '%s: %.1fs, %.1fMb' % (name, elapsed, size / 1e6)
+
+
+def load_map(file_in, db_file, batch_size=10000, spatial_index=False):
+    """Shape the nodes, ways and relations of the XML file and insert them into the tables of db_file"""
+    # If spatial_index is set, the R*Tree indexes of spatial.py are built once the rows are loaded.
+    conn = sqlite3.connect(db_file)
+    try:
+        cur = conn.cursor()
+        for pragma in LOAD_PRAGMAS:
+            cur.execute(pragma)
+        create_tables(conn)
+
+        user_stats = UserStats()
+        inserts = dict((key, (insert, fields)) for _, _, insert, fields, key in TABLES)
+        batches = dict((key, []) for key in inserts)
+
+        def flush(key):
+            insert, fields = inserts[key]
+            cur.executemany(insert, [tuple(row[field] for field in fields) for row in batches[key]])
+            del batches[key][:]
+
+        # All of the inserts happen in one transaction, which is committed at the end
+        for element in get_element(file_in, tags=('node', 'way', 'relation')):
+            el = shape_element(element)
+            if el:
+                if element.tag == 'node':
+                    batches['node'].append(el['node'])
+                    batches['node_tags'].extend(el['node_tags'])
+                    user_stats.add('node', el['node'])
+                elif element.tag == 'way':
+                    batches['way'].append(el['way'])
+                    user_stats.add('way', el['way'])
+                    batches['way_nodes'].extend(el['way_nodes'])
+                    batches['way_tags'].extend(el['way_tags'])
+                elif element.tag == 'relation':
+                    batches['relation'].append(el['relation'])
+                    batches['relation_members'].extend(el['relation_members'])
+                    batches['relation_tags'].extend(el['relation_tags'])
+                for key in el:
+                    if len(batches[key]) >= batch_size:
+                        flush(key)
+
+        for _, _, _, _, key in TABLES:
+            flush(key)
+        conn.commit()
+
+        create_tags_table(conn)
+        create_user_stats(conn, user_stats)
+        create_indexes(conn)
+        if spatial_index:
+            spatial.create_spatial_index(conn)
+    finally:
+        conn.close()
+
+
+def read_csv(path, fields):
+    # Yields each row of a csv file written by process_map as a tuple of unicode values in the order of fields.
+    with open(path, 'rb') as fin:
+        reader = csv.reader(fin)
+        header = next(reader)
+        order = [header.index(field) for field in fields]
+        for row in reader:
+            yield tuple(row[i].decode("utf-8") for i in order)
+
+
+def import_csv(conn, path, table, fields, insert, batch_size=10000, commit_every=1000000, verbose=True):
+    """Insert the rows of a csv file into an existing table in batches of batch_size rows"""
+    # Only one batch of rows is held in memory at a time. The inserts are committed every commit_every rows, and the
+    # number of rows inserted so far and the rate are printed at each commit if verbose is set. Returns the number of
+    # rows inserted.
+    cur = conn.cursor()
+    rows = read_csv(path, fields)
+    count = 0
+    uncommitted = 0
+    start = time.time()
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            break
+        cur.executemany(insert, batch)
+        count += len(batch)
+        uncommitted += len(batch)
+        if uncommitted >= commit_every:
+            conn.commit()
+            uncommitted = 0
+            if verbose:
+                print_rate(table, count, start)
+    conn.commit()
+    if verbose:
+        print_rate(table, count, start)
+    return count
+
+
+def print_rate(table, count, start):
+    elapsed = time.time() - start
+    print '%s: %d rows in %.1fs (%d rows/s)' % (table, count, elapsed, count / elapsed if elapsed else 0)
@@ -0,0 +1,257 @@
+# Note: A compact store of node locations, used to build way geometries (bounding boxes, lengths and centroids)
+# while the map is streamed, instead of joining ways_nodes to nodes in SQL. Node ids are kept in one array and the
+# coordinates in two arrays of 32 bit integers (degrees * 10^7, the precision OSM stores), so a node takes 16 bytes
+# instead of the few hundred a dictionary entry of floats takes. Locations are looked up with a binary search on the
+# ids, which are already sorted in an OSM file; if they weren't, the store is sorted once when the node pass ends.
+#
+# shaping.get_element(..., store=store) fills a store during the node pass of the shaping, and
+# shaping.process_map(..., store=store) uses it to write the geometry of each way to ways_geometry.csv in the same
+# pass (see geometry_row).
+#
+# A store can be saved to a file and opened again memory mapped (NodeStore.load), so the locations of a large map
+# don't have to fit in memory or be rebuilt for every run.
+#
+# Run this file to print the memory used per node and the number of way geometries built from sample.osm (or from
+# the file given as argument).
+
+from array import array
+import bisect
+import math
+import mmap
+import struct
+import sys
+
+from xml_backends import get_element
+
+COORDINATE_SCALE = 10 ** 7
+
+# array has no 64 bit typecode in Python 2; 'l' is 64 bits on 64 bit Linux and macOS. Ids are stored as doubles
+# otherwise, which is exact for ids below 2^53.
+ID_TYPE = 'l' if array('l').itemsize == 8 else 'd'
+
+FILE_MAGIC = 'NODELOC1'
+FILE_HEADER = struct.Struct('<8sQ')
+
+EARTH_RADIUS = 6371008.8  # meters
+
+
+class NodeStore(object):
+    """Locations of nodes by id, in parallel arrays"""
+
+    def __init__(self):
+        self.ids = array(ID_TYPE)
+        self.lats = array('i')
+        self.lons = array('i')
+        self.ordered = True
+
+    def add(self, node_id, lat, lon):
+        node_id = int(node_id)
+        if self.ids and node_id <= self.ids[-1]:
+            self.ordered = False
+        self.ids.append(node_id)
+        self.lats.append(int(round(float(lat) * COORDINATE_SCALE)))
+        self.lons.append(int(round(float(lon) * COORDINATE_SCALE)))
+
+    def add_element(self, element):
+        # Adds the location of a node element, ignoring nodes without one (e.g. deleted nodes in a history file).
+        lat = element.get('lat')
+        lon = element.get('lon')
+        if lat is not None and lon is not None:
+            self.add(element.get('id'), lat, lon)
+
+    def sort(self):
+        # Only needed if nodes were added out of id order. record_locations calls it when the node pass ends.
+        if self.ordered:
+            return
+        order = sorted(range(len(self.ids)), key=self.ids.__getitem__)
+        self.ids = array(self.ids.typecode, (self.ids[i] for i in order))
+        self.lats = array('i', (self.lats[i] for i in order))
+        self.lons = array('i', (self.lons[i] for i in order))
+        self.ordered = True
+
+    def get(self, node_id, default=None):
+        """Return (lat, lon) of a node, or default if it isn't in the store"""
+        # Sorting here would sort the whole store again for every lookup that follows an out of order add
+        if not self.ordered:
+            raise ValueError("Nodes were added out of id order, call sort() before looking them up")
+        node_id = int(node_id)
+        ids = self.ids
+        i = bisect.bisect_left(ids, node_id, 0, len(self))
+        if i < len(self) and ids[i] == node_id:
+            return (float(self.lats[i]) / COORDINATE_SCALE, float(self.lons[i]) / COORDINATE_SCALE)
+        return default
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, node_id):
+        return self.get(node_id) is not None
+
+    def nbytes(self):
+        return sum(a.itemsize * len(a) for a in (self.ids, self.lats, self.lons))
+
+    def save(self, path):
+        """Write the store to path, so that it can be opened again with NodeStore.load"""
+        self.sort()
+        with open(path, 'wb') as f:
+            f.write(FILE_HEADER.pack(FILE_MAGIC, len(self)))
+            # Ids are always written as 64 bit integers. The arrays are written in the machine's byte order.
+            if ID_TYPE == 'l':
+                self.ids.tofile(f)
+            else:
+                f.write(struct.pack('=%dq' % len(self), *(int(i) for i in self.ids)))
+            self.lats.tofile(f)
+            self.lons.tofile(f)
+
+    @classmethod
+    def load(cls, path):
+        """Open a store written by save, memory mapped"""
+        return MappedNodeStore(path)
+
+
+class MappedArray(object):
+    """Read only sequence of fixed size numbers in a buffer, for bisect"""
+
+    def __init__(self, buf, offset, code, length):
+        self.buf = buf
+        self.offset = offset
+        self.item = struct.Struct('=' + code)
+        self.length = length
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.length
+        if not 0 <= i < self.length:
+            raise IndexError(i)
+        return self.item.unpack_from(self.buf, self.offset + i * self.item.size)[0]
+
+    def __len__(self):
+        return self.length
+
+
+class MappedNodeStore(NodeStore):
+    """NodeStore backed by a memory mapped file written by NodeStore.save"""
+
+    def __init__(self, path):
+        self.f = open(path, 'rb')
+        self.buf = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count = FILE_HEADER.unpack_from(self.buf, 0)
+        if magic != FILE_MAGIC:
+            raise ValueError("{0} is not a node location file".format(path))
+        offset = FILE_HEADER.size
+        self.ids = MappedArray(self.buf, offset, 'q', count)
+        offset += 8 * count
+        self.lats = MappedArray(self.buf, offset, 'i', count)
+        offset += 4 * count
+        self.lons = MappedArray(self.buf, offset, 'i', count)
+        self.ordered = True
+
+    def add(self, node_id, lat, lon):
+        raise TypeError("A memory mapped node store is read only")
+
+    def nbytes(self):
+        return len(self.buf)
+
+    def close(self):
+        self.buf.close()
+        self.f.close()
+
+
+def way_coordinates(refs, store):
+    # Takes the node ids of a way and returns the list of their (lat, lon), leaving out nodes missing from the store.
+    coordinates = []
+    for ref in refs:
+        location = store.get(ref)
+        if location is not None:
+            coordinates.append(location)
+    return coordinates
+
+
+def bounding_box(coordinates):
+    # Returns (min_lat, min_lon, max_lat, max_lon), or None if there are no coordinates.
+    if not coordinates:
+        return None
+    lats = [lat for lat, _ in coordinates]
+    lons = [lon for _, lon in coordinates]
+    return (min(lats), min(lons), max(lats), max(lons))
+
+
+def length(coordinates):
+    # Returns the length in meters of the line through the coordinates, using the haversine formula.
+    total = 0.0
+    for (lat1, lon1), (lat2, lon2) in zip(coordinates, coordinates[1:]):
+        phi1 = math.radians(lat1)
+        phi2 = math.radians(lat2)
+        a = (math.sin((phi2 - phi1) / 2) ** 2 +
+             math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2)
+        total += 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+    return total
+
+
+def centroid(coordinates):
+    # Returns the average (lat, lon) of the vertices, counting the last one of a closed way once. None if there are
+    # no coordinates.
+    if len(coordinates) > 1 and coordinates[0] == coordinates[-1]:
+        coordinates = coordinates[:-1]
+    if not coordinates:
+        return None
+    return (sum(lat for lat, _ in coordinates) / len(coordinates),
+            sum(lon for _, lon in coordinates) / len(coordinates))
+
+
+def geometry_row(way_id, coordinates):
+    # Returns the row of ways_geometry.csv for a way: (id, min_lat, min_lon, max_lat, max_lon, length, centroid_lat,
+    # centroid_lon), or None if none of its nodes are in the store.
+    box = bounding_box(coordinates)
+    if box is None:
+        return None
+    return (way_id,) + box + (round(length(coordinates), 2),) + centroid(coordinates)
+
+
+def record_locations(elements, store, tags):
+    """Yield the elements with the requested tags, adding the location of every node to store"""
+    # Nodes come before ways and relations in an OSM file, so the store is complete (and sorted) by the time the
+    # first of them is yielded. A MappedNodeStore holds locations saved by an earlier run, its nodes aren't added.
+    add = not isinstance(store, MappedNodeStore)
+    nodes_done = False
+    for element in elements:
+        if element.tag == 'node':
+            if add:
+                store.add_element(element)
+        elif not nodes_done:
+            store.sort()
+            nodes_done = True
+        if element.tag in tags:
+            yield element
+    store.sort()
+
+
+def parse_tags(tags):
+    # Returns tags with node added: the nodes have to be parsed to fill a store even if they aren't yielded.
+    tags = tuple(tags)
+    return tags if 'node' in tags else ('node',) + tags
+
+
+def way_geometries(osm_file, store=None, backend=None):
+    """Yield (way id, coordinates) for each way, adding the nodes to store as they are parsed"""
+    # The geometries are built in the same pass that reads the nodes.
+    if store is None:
+        store = NodeStore()
+    for element in record_locations(get_element(osm_file, parse_tags(('way',)), backend), store, ('way',)):
+        refs = [nd.get('ref') for nd in element.iter('nd')]
+        yield element.get('id'), way_coordinates(refs, store)
+
+
+if __name__ == '__main__':
+    osm_file = sys.argv[1] if len(sys.argv) > 1 else 'sample.osm'
+    store = NodeStore()
+    ways = complete = 0
+    for way_id, coordinates in way_geometries(osm_file, store):
+        ways += 1
+        complete += bool(coordinates)
+    locations = dict((node_id, store.get(node_id)) for node_id in store.ids)
+    dict_bytes = sys.getsizeof(locations) + sum(sys.getsizeof(k) + sys.getsizeof(v) + 2 * sys.getsizeof(1.0)
+                                                for k, v in locations.items())
+    print '{0} nodes: {1:.1f} bytes/node in the store, {2:.1f} bytes/node in a dict of float tuples'.format(
+        len(store), float(store.nbytes()) / len(store), float(dict_bytes) / len(store))
+    print '{0} ways, {1} with at least one node location'.format(ways, complete)
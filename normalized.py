@@ -0,0 +1,248 @@
+# Note: A normalised storage mode for the shaped map. The rows from shape_rows are rewritten so that repeated text is
+# stored once:
+# * user names move to a users (uid, name) table, and the element rows only keep the uid
+# * tag types and keys move to a tag_keys (id, type, key) table, and the tag rows keep the key_id and the value
+# * version is stored as an integer and timestamp as seconds since the epoch (UTC)
+# User names and tag keys are interned in dictionaries while the map is shaped, so this doesn't need another pass
+# over the file. The csv files and the database are much smaller, and joins on users or tag keys compare integers.
+#
+# process_map writes the csv files to a directory and load_map loads the tables straight into an SQLite database.
+
+import calendar
+import os
+import sqlite3
+
+import validation
+from loader import LOAD_PRAGMAS, INDEXES as LOADER_INDEXES, create_indexes
+from shaping import get_element, shape_rows, write_rows, validate_rows, RowWriter, OUTPUTS, SCHEMA, BUFFER_SIZE
+
+OUTPUT_DIR = "normalized"
+
+NODE_FIELDS = ['id', 'lat', 'lon', 'uid', 'version', 'changeset', 'timestamp']
+NODE_TAGS_FIELDS = ['id', 'key_id', 'value']
+WAY_FIELDS = ['id', 'uid', 'version', 'changeset', 'timestamp']
+WAY_NODES_FIELDS = ['id', 'node_id', 'position']
+WAY_TAGS_FIELDS = ['id', 'key_id', 'value']
+RELATION_FIELDS = ['id', 'uid', 'version', 'changeset', 'timestamp']
+RELATION_MEMBERS_FIELDS = ['id', 'member_id', 'type', 'role', 'position']
+RELATION_TAGS_FIELDS = ['id', 'key_id', 'value']
+USERS_FIELDS = ['uid', 'name']
+TAG_KEYS_FIELDS = ['id', 'type', 'key']
+
+# (table, fields, create query) of each output, in the order of shaping.OUTPUTS
+TABLES = [('nodes', NODE_FIELDS, '''CREATE TABLE nodes (
+    id INTEGER PRIMARY KEY,
+    lat FLOAT,
+    lon FLOAT,
+    uid INTEGER,
+    version INTEGER,
+    changeset INTEGER,
+    timestamp INTEGER
+    );'''),
+          ('nodes_tags', NODE_TAGS_FIELDS, '''CREATE TABLE nodes_tags (
+    id INTEGER,
+    key_id INTEGER,
+    value STRING
+    );'''),
+          ('ways', WAY_FIELDS, '''CREATE TABLE ways (
+    id INTEGER PRIMARY KEY,
+    uid INTEGER,
+    version INTEGER,
+    changeset INTEGER,
+    timestamp INTEGER
+    );'''),
+          ('ways_nodes', WAY_NODES_FIELDS, '''CREATE TABLE ways_nodes (
+    id INTEGER,
+    node_id INTEGER,
+    position INTEGER
+    );'''),
+          ('ways_tags', WAY_TAGS_FIELDS, '''CREATE TABLE ways_tags (
+    id INTEGER,
+    key_id INTEGER,
+    value STRING
+    );'''),
+          ('relations', RELATION_FIELDS, '''CREATE TABLE relations (
+    id INTEGER PRIMARY KEY,
+    uid INTEGER,
+    version INTEGER,
+    changeset INTEGER,
+    timestamp INTEGER
+    );'''),
+          ('relation_members', RELATION_MEMBERS_FIELDS, '''CREATE TABLE relation_members (
+    id INTEGER,
+    member_id INTEGER,
+    type STRING,
+    role STRING,
+    position INTEGER
+    );'''),
+          ('relation_tags', RELATION_TAGS_FIELDS, '''CREATE TABLE relation_tags (
+    id INTEGER,
+    key_id INTEGER,
+    value STRING
+    );''')]
+
+USERS_QUERY = '''CREATE TABLE users (
+    uid INTEGER PRIMARY KEY,
+    name STRING
+    );'''
+
+TAG_KEYS_QUERY = '''CREATE TABLE tag_keys (
+    id INTEGER PRIMARY KEY,
+    type STRING,
+    key STRING
+    );'''
+
+
+def normalized_index(name, table, columns):
+    # Takes an index of loader.INDEXES and returns the same index on the normalised tables, where the tag rows have a
+    # key_id instead of a key.
+    if 'key' not in columns:
+        return (name, table, columns)
+    return (name.replace('_key_value', '_key_id'), table, ['key_id' if column == 'key' else column
+                                                           for column in columns])
+
+
+# The indexes of loader.INDEXES (those of the tags table are skipped by create_indexes, the normalised database has
+# no tags table), plus lookups of tag keys and user names
+INDEXES = ([normalized_index(*index) for index in LOADER_INDEXES] +
+           [('tag_keys_key', 'tag_keys', ['key', 'type']),
+            ('users_name', 'users', ['name'])])
+
+
+def epoch(timestamp):
+    # Converts an OSM timestamp (2016-05-13T19:55:35Z) to seconds since the epoch.
+    return calendar.timegm((int(timestamp[0:4]), int(timestamp[5:7]), int(timestamp[8:10]),
+                            int(timestamp[11:13]), int(timestamp[14:16]), int(timestamp[17:19])))
+
+
+class Interner(object):
+    """Rewrite rows from shape_rows in the normalised form, interning user names and tag keys"""
+
+    def __init__(self):
+        # {uid: name} and {(type, key): id}
+        self.users = {}
+        self.tag_keys = {}
+
+    def key_id(self, tag_type, key):
+        key_id = self.tag_keys.get((tag_type, key))
+        if key_id is None:
+            key_id = self.tag_keys[(tag_type, key)] = len(self.tag_keys) + 1
+        return key_id
+
+    def normalize(self, rows):
+        # Takes the output of shape_rows and returns it in the same (tag, row, tag_rows, child_rows) form, with the
+        # rows in the order of the fields above.
+        if not rows:
+            return rows
+        tag, row, tag_rows, child_rows = rows
+        if tag == 'node':
+            element_id, lat, lon, user, uid, version, changeset, timestamp = row
+            row = (element_id, lat, lon, uid, int(version), changeset, epoch(timestamp))
+        else:
+            element_id, user, uid, version, changeset, timestamp = row
+            row = (element_id, uid, int(version), changeset, epoch(timestamp))
+        self.users[int(uid)] = user
+        key_id = self.key_id
+        tag_rows = [(element_id, key_id(tag_type, key), value) for _, key, value, tag_type in tag_rows]
+        return (tag, row, tag_rows, child_rows)
+
+    def user_rows(self):
+        return sorted(self.users.iteritems())
+
+    def tag_key_rows(self):
+        return sorted((key_id, tag_type, key) for (tag_type, key), key_id in self.tag_keys.iteritems())
+
+
+def process_map(file_in, validate, output_dir=OUTPUT_DIR, backend=None):
+    """Iteratively process each XML element and write normalised csv(s) to output_dir"""
+    # The rows are validated against the schema before they are normalised.
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    interner = Interner()
+    validator = validation.Validator(SCHEMA)
+    paths = [os.path.join(output_dir, os.path.basename(path)) for path, _ in OUTPUTS]
+    files = [open(path, 'wb', BUFFER_SIZE) for path in paths]
+    try:
+        writers = [RowWriter(f, fields) for f, (_, fields, _) in zip(files, TABLES)]
+        for writer in writers:
+            writer.writeheader()
+
+        for element in get_element(file_in, tags=('node', 'way', 'relation'), backend=backend):
+            rows = shape_rows(element)
+            if rows and validate is True:
+                validate_rows(rows, validator)
+            write_rows(interner.normalize(rows), writers, False, validator)
+
+        for writer in writers:
+            writer.flush()
+    finally:
+        for f in files:
+            f.close()
+
+    for name, fields, rows in [('users.csv', USERS_FIELDS, interner.user_rows()),
+                               ('tag_keys.csv', TAG_KEYS_FIELDS, interner.tag_key_rows())]:
+        with open(os.path.join(output_dir, name), 'wb') as f:
+            writer = RowWriter(f, fields)
+            writer.writeheader()
+            writer.writerows(rows)
+            writer.flush()
+
+
+class TableWriter(object):
+    """Insert rows into a table in batches, with the writerow, writerows and flush methods of RowWriter"""
+
+    def __init__(self, cur, table, fields, batch_size=10000):
+        self.cur = cur
+        self.insert = 'INSERT INTO %s(%s) VALUES (%s);' % (table, ', '.join(fields), ', '.join('?' * len(fields)))
+        self.batch = []
+        self.batch_size = batch_size
+
+    def writerow(self, row):
+        self.batch.append(row)
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def writerows(self, rows):
+        self.batch.extend(rows)
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        # Text values from shape_rows are utf-8 encoded, and Python 2's sqlite3 refuses non-ASCII str values
+        self.cur.executemany(self.insert, [tuple(value.decode('utf-8') if isinstance(value, str) else value
+                                                 for value in row) for row in self.batch])
+        del self.batch[:]
+
+
+def load_map(file_in, db_file, validate=False, backend=None):
+    """Shape the XML file and insert the normalised rows into the tables of db_file"""
+    conn = sqlite3.connect(db_file)
+    try:
+        cur = conn.cursor()
+        for pragma in LOAD_PRAGMAS:
+            cur.execute(pragma)
+        for table, _, query in TABLES + [('users', None, USERS_QUERY), ('tag_keys', None, TAG_KEYS_QUERY)]:
+            cur.execute('DROP TABLE IF EXISTS %s;' % table)
+            cur.execute(query)
+
+        interner = Interner()
+        validator = validation.Validator(SCHEMA)
+        writers = [TableWriter(cur, table, fields) for table, fields, _ in TABLES]
+        for element in get_element(file_in, tags=('node', 'way', 'relation'), backend=backend):
+            rows = shape_rows(element)
+            if rows and validate is True:
+                validate_rows(rows, validator)
+            write_rows(interner.normalize(rows), writers, False, validator)
+        for writer in writers:
+            writer.flush()
+
+        for table, fields, rows in [('users', USERS_FIELDS, interner.user_rows()),
+                                    ('tag_keys', TAG_KEYS_FIELDS, interner.tag_key_rows())]:
+            writer = TableWriter(cur, table, fields)
+            writer.writerows(rows)
+            writer.flush()
+        conn.commit()
+
+        create_indexes(conn, indexes=INDEXES)
+    finally:
+        conn.close()
@@ -0,0 +1,157 @@
+# Note: Opens OSM files for the parsers, decompressing them on the fly if they are compressed, so that a
+# san-francisco_california.osm.bz2 extract can be parsed without decompressing it to disk first. The compression is
+# detected from the first bytes of the file, not its name:
+# * gzip and bzip2 -- decompressed with zlib and bz2. bzip2 is decompressed in parallel by lbzip2 or pbzip2 if one of
+#   them is installed, since single threaded bzip2 decompression is slower than the parsing.
+# * xz -- decompressed with the lzma module (backports.lzma in Python 2) or the xz command.
+# * zstd -- decompressed with the zstandard module or the zstd command.
+# Files made of several concatenated gzip, bzip2 or xz streams (e.g. by pbzip2) are read to the end.
+#
+# Everything that reads an OSM file by name (get_element, the audits, osmchange.py) goes through open_osm.
+
+import bz2
+import distutils.spawn
+import multiprocessing
+import subprocess
+import zlib
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+READ_SIZE = 1 << 20
+
+MAGIC = [('\x1f\x8b', 'gzip'),
+         ('BZh', 'bzip2'),
+         ('\xfd7zXZ\x00', 'xz'),
+         ('\x28\xb5\x2f\xfd', 'zstd')]
+
+# Commands that decompress a file to stdout, in order of preference. {threads} is the number of threads to use.
+COMMANDS = {'bzip2': [['lbzip2', '-d', '-c', '-n', '{threads}'],
+                      ['pbzip2', '-d', '-c', '-p{threads}']],
+            'xz': [['xz', '-d', '-c', '-T', '{threads}']],
+            'zstd': [['zstd', '-d', '-c', '-q']]}
+
+
+def detect_compression(path):
+    """Return 'gzip', 'bzip2', 'xz' or 'zstd' if the file is compressed, or None"""
+    with open(path, 'rb') as f:
+        head = f.read(6)
+    for magic, compression in MAGIC:
+        if head.startswith(magic):
+            return compression
+    return None
+
+
+class StreamReader(object):
+    """File-like object decompressing another file object with new_decompressor() decompressors"""
+
+    # A decompressor that reaches the end of its stream leaves what follows in unused_data (zlib, bz2 and lzma all do,
+    # bz2 raises EOFError if it is given more data after the end), and a new decompressor is started on it.
+
+    def __init__(self, f, new_decompressor):
+        self.f = f
+        self.new_decompressor = new_decompressor
+        self.decompressor = new_decompressor()
+        self.buffer = ''
+        self.eof = False
+
+    def decompress(self, data):
+        out = []
+        while data:
+            try:
+                out.append(self.decompressor.decompress(data))
+            except EOFError:
+                self.decompressor = self.new_decompressor()
+                continue
+            data = self.decompressor.unused_data
+            if data:
+                self.decompressor = self.new_decompressor()
+        return ''.join(out)
+
+    def read(self, size=-1):
+        chunks = [self.buffer]
+        length = len(self.buffer)
+        while (size < 0 or length < size) and not self.eof:
+            data = self.f.read(READ_SIZE)
+            if not data:
+                self.eof = True
+                break
+            chunk = self.decompress(data)
+            chunks.append(chunk)
+            length += len(chunk)
+        data = ''.join(chunks)
+        if size < 0:
+            self.buffer = ''
+            return data
+        self.buffer = data[size:]
+        return data[:size]
+
+    def close(self):
+        self.f.close()
+
+
+class CommandReader(object):
+    """File-like object reading the output of a decompression command"""
+
+    def __init__(self, command):
+        self.process = subprocess.Popen(command, stdout=subprocess.PIPE, bufsize=READ_SIZE)
+
+    def read(self, size=-1):
+        return self.process.stdout.read(size)
+
+    def close(self):
+        self.process.stdout.close()
+        if self.process.poll() is None:
+            self.process.terminate()
+        self.process.wait()
+
+
+def command_reader(compression, path, threads):
+    # Returns a CommandReader for the first decompression command that is installed, or None.
+    for command in COMMANDS.get(compression, []):
+        if distutils.spawn.find_executable(command[0]):
+            return CommandReader([arg.format(threads=threads) for arg in command] + [path])
+    return None
+
+
+def open_osm(osm_file, threads=None):
+    """Open an OSM file for reading, decompressing it if it is compressed"""
+    # osm_file can be a file name or a file object, which is returned as it is. threads is the number of threads a
+    # parallel decompression command may use, all of the cores by default; threads=1 always decompresses in this
+    # process when the module for the compression is available.
+    if hasattr(osm_file, 'read'):
+        return osm_file
+    compression = detect_compression(osm_file)
+    if compression is None:
+        return open(osm_file, 'rb')
+    if threads is None:
+        threads = multiprocessing.cpu_count()
+
+    if compression == 'bzip2' and threads > 1:
+        reader = command_reader(compression, osm_file, threads)
+        if reader is not None:
+            return reader
+    if compression == 'gzip':
+        return StreamReader(open(osm_file, 'rb'), lambda: zlib.decompressobj(16 + zlib.MAX_WBITS))
+    if compression == 'bzip2':
+        return StreamReader(open(osm_file, 'rb'), bz2.BZ2Decompressor)
+    if compression == 'xz' and lzma is not None:
+        return StreamReader(open(osm_file, 'rb'), lzma.LZMADecompressor)
+    if compression == 'zstd' and zstandard is not None:
+        return zstandard.ZstdDecompressor().stream_reader(open(osm_file, 'rb'))
+
+    reader = command_reader(compression, osm_file, threads)
+    if reader is None:
+        raise ValueError("{0} is {1} compressed, but neither the Python module nor a command to decompress it is "
+                         "installed".format(osm_file, compression))
+    return reader
@@ -0,0 +1,150 @@
+# Note: Applies OsmChange (.osc) files, the daily, hourly and minutely diffs published for OSM extracts, to a database
+# loaded by loader.load_map, instead of reloading the whole map. Created and modified elements are shaped and cleaned
+# with shape_element, the same way as during the full load, and replace the rows of the element in its tables;
+# deleted elements have their rows removed. Elements that shape_element rejects (e.g. a modify that drops the user)
+# have their old rows removed too, since a full load would have left them out. All of the changes of a file are
+# applied in one transaction.
+#
+# The derived tables follow the changes: the tags table through its triggers, user_stats and the R*Tree indexes
+# (if the database has them) by recomputing the rows of the users, nodes and ways that changed.
+#
+# Usage: python osmchange.py DB_FILE OSC_FILE [OSC_FILE ...]
+
+try:
+    import xml.etree.cElementTree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
+import sqlite3
+import sys
+import time
+
+import loader
+import spatial
+from osm_input import open_osm
+from shaping import shape_element
+
+ACTIONS = ('create', 'modify', 'delete')
+
+# Keys of the dictionary returned by shape_element for each type of element, with the element's own row first
+ELEMENT_KEYS = {'node': ['node', 'node_tags'],
+                'way': ['way', 'way_nodes', 'way_tags'],
+                'relation': ['relation', 'relation_members', 'relation_tags']}
+
+# {key: (table, insert, fields)}
+TABLES = dict((key, (table, insert, fields)) for table, _, insert, fields, key in loader.TABLES)
+
+
+def iter_changes(osc_file):
+    """Yield (action, element) for each node, way and relation of an OsmChange file"""
+    # Elements are cleared, and dropped from their action element, as soon as the caller asks for the next one.
+    # Diffs are usually published gzip compressed (.osc.gz), which open_osm decompresses as they are read.
+    f = open_osm(osc_file)
+    try:
+        context = ET.iterparse(f, events=('start', 'end'))
+        _, root = next(context)
+        action = None
+        depth = 1
+        for event, elem in context:
+            if event == 'start':
+                depth += 1
+                if depth == 2:
+                    action = elem
+            else:
+                depth -= 1
+                if depth == 2:
+                    if action.tag in ACTIONS and elem.tag in ELEMENT_KEYS:
+                        yield action.tag, elem
+                    elem.clear()
+                    action.clear()
+                elif depth == 1:
+                    root.clear()
+    finally:
+        if f is not osc_file:
+            f.close()
+
+
+def apply_changes(conn, changes):
+    """Apply (action, element) changes to the tables of conn in one transaction"""
+    # Returns the number of elements created, modified and deleted, the number rejected by shape_element (whose old
+    # rows, if any, are deleted) and the number skipped: changes that are not newer than the version already in the
+    # database (e.g. from a diff that was already applied) and deletes of elements that aren't in it.
+    cur = conn.cursor()
+    tables = set(name for name, in cur.execute("SELECT name FROM sqlite_master WHERE type = 'table';"))
+    counts = dict((action, 0) for action in ACTIONS + ('rejected', 'skipped'))
+    uids = set()
+    node_ids = set()
+    way_ids = set()
+    try:
+        for action, element in changes:
+            keys = ELEMENT_KEYS[element.tag]
+            element_id = int(element.get('id'))
+            old = cur.execute('SELECT uid, version FROM %s WHERE id = ?;' % TABLES[keys[0]][0],
+                              (element_id,)).fetchone()
+            version = element.get('version')
+            if old is not None and version is not None and int(old[1]) >= int(version):
+                counts['skipped'] += 1
+                continue
+
+            if action == 'delete':
+                el = None
+                if old is None:
+                    counts['skipped'] += 1
+                    continue
+            else:
+                el = shape_element(element) or None
+                if el is None:
+                    # The element's old rows are deleted below, so that the database matches a reload
+                    action = 'rejected'
+                    if old is None:
+                        counts[action] += 1
+                        continue
+
+            for key in keys:
+                cur.execute('DELETE FROM %s WHERE id = ?;' % TABLES[key][0], (element_id,))
+            if el is not None:
+                for key in keys:
+                    _, insert, fields = TABLES[key]
+                    rows = el[key] if isinstance(el[key], list) else [el[key]]
+                    cur.executemany(insert, [tuple(row[field] for field in fields) for row in rows])
+                uids.add(int(el[keys[0]]['uid']))
+            if old is not None:
+                uids.add(old[0])
+            if element.tag == 'node':
+                node_ids.add(element_id)
+            elif element.tag == 'way':
+                way_ids.add(element_id)
+            counts[action] += 1
+
+        if 'user_stats' in tables:
+            loader.refresh_user_stats(conn, uids)
+        if 'nodes_rtree' in tables:
+            # Ways that use a node that moved have a new bounding box too
+            node_list = list(node_ids)
+            for i in range(0, len(node_list), 500):
+                batch = node_list[i:i + 500]
+                way_ids.update(way_id for way_id, in cur.execute(
+                    'SELECT DISTINCT id FROM ways_nodes WHERE node_id IN (%s);' % ', '.join('?' * len(batch)), batch))
+            spatial.refresh_spatial_index(conn, node_ids, way_ids)
+        conn.commit()
+    except:
+        conn.rollback()
+        raise
+    return counts
+
+
+def apply_change_file(db_file, osc_file):
+    """Apply an OsmChange file to db_file and return the counts of apply_changes"""
+    conn = sqlite3.connect(db_file)
+    try:
+        return apply_changes(conn, iter_changes(osc_file))
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    db_file = sys.argv[1]
+    for osc_file in sys.argv[2:]:
+        start = time.time()
+        counts = apply_change_file(db_file, osc_file)
+        print ('{0}: {1[create]} created, {1[modify]} modified, {1[delete]} deleted, {1[rejected]} rejected, '
+               '{1[skipped]} skipped in {2:.1f}s').format(osc_file, counts, time.time() - start)
@@ -0,0 +1,156 @@
+# Note: This runs the shaping step of the notebook across several processes. The OSM file is split into byte ranges
+# that start on a top level <node>, <way> or <relation> element, each range is parsed and shaped by a worker, and the
+# workers' rows are joined back together in file order. The csv files are byte-identical to the ones written by
+# shaping.process_map. Compressed files can't be split into byte ranges, and are rejected. PBF files are split on
+# blob boundaries instead, and each worker decodes its own blobs with pbf.py.
+
+import multiprocessing
+import shutil
+import tempfile
+import os
+import re
+
+import pbf
+import validation
+from osm_input import detect_compression
+from shaping import get_element, shape_rows, write_rows, RowWriter, SCHEMA, BUFFER_SIZE, NODES_PATH, OUTPUTS
+
+# Start of a top level element. Child elements of a node, way or relation are tag, nd and member, and '<' can't
+# appear unescaped in an attribute value, so every match is a top level element.
+ELEMENT_START = re.compile(r'<(node|way|relation)[\s/>]')
+
+SCAN_SIZE = 1 << 20
+
+
+class ChunkReader(object):
+    """File-like object reading bytes start to end of an OSM file, wrapped in an <osm> root element"""
+
+    def __init__(self, filename, start, end, last):
+        self.f = open(filename, 'rb')
+        self.f.seek(start)
+        self.remaining = end - start
+        self.head = '<osm>'
+        # The last chunk already ends with the file's own closing tag
+        self.tail = '' if last else '</osm>'
+
+    def read(self, size=-1):
+        if size < 0:
+            size = self.remaining + len(self.head) + len(self.tail)
+        data = self.head[:size]
+        self.head = self.head[len(data):]
+        if len(data) < size and self.remaining > 0:
+            block = self.f.read(min(size - len(data), self.remaining))
+            self.remaining -= len(block)
+            if not block:
+                self.remaining = 0
+            data += block
+        if len(data) < size and self.remaining == 0:
+            end = self.tail[:size - len(data)]
+            self.tail = self.tail[len(end):]
+            data += end
+        return data
+
+    def close(self):
+        self.f.close()
+
+
+def find_chunks(filename, count):
+    # Splits the file into at most count byte ranges of about the same size. Every range but the first starts at a
+    # top level element, the first starts at the first element after the <osm> header. Returns a list of
+    # (start, end) offsets.
+    size = os.path.getsize(filename)
+    starts = []
+    with open(filename, 'rb') as f:
+        for i in range(count):
+            start = next_element(f, size * i // count)
+            if start is not None and (not starts or start > starts[-1]):
+                starts.append(start)
+    if not starts:
+        return []
+    return zip(starts, starts[1:] + [size])
+
+
+def next_element(f, offset):
+    # Returns the offset of the first top level element starting at or after offset, or None if there isn't one.
+    f.seek(offset)
+    carry = ''
+    while True:
+        block = f.read(SCAN_SIZE)
+        if not block:
+            return None
+        data = carry + block
+        m = ELEMENT_START.search(data)
+        if m:
+            return offset - len(carry) + m.start()
+        offset += len(block)
+        # Keep the end of the block in case an element start is split across two reads
+        carry = data[-10:]
+
+
+def shape_chunk(args):
+    # Worker: parses and shapes the nodes, ways and relations in one byte range and writes the rows to one part file
+    # per csv, without a header. Returns the part file paths in the order of OUTPUTS. backend is 'pbf' for the blobs
+    # of a PBF file.
+    filename, start, end, last, part_dir, number, validate, backend = args
+    paths = [os.path.join(part_dir, '%s.%05d' % (os.path.basename(path), number)) for path, _ in OUTPUTS]
+    files = [open(path, 'wb', BUFFER_SIZE) for path in paths]
+    try:
+        writers = [RowWriter(f, fields) for f, (_, fields) in zip(files, OUTPUTS)]
+        validator = validation.Validator(SCHEMA)
+
+        if backend == 'pbf':
+            for element in pbf.iter_range(filename, start, end, tags=('node', 'way', 'relation')):
+                write_rows(shape_rows(element), writers, validate, validator)
+        else:
+            source = ChunkReader(filename, start, end, last)
+            try:
+                for element in get_element(source, tags=('node', 'way', 'relation'), backend=backend):
+                    write_rows(shape_rows(element), writers, validate, validator)
+            finally:
+                source.close()
+        for writer in writers:
+            writer.flush()
+    finally:
+        for f in files:
+            f.close()
+    return paths
+
+
+def process_map(file_in, validate, processes=None, chunks_per_process=4, backend=None):
+    """Process the XML file across processes worker processes and write to csv(s)"""
+    # The byte ranges are offsets into the uncompressed XML, so compressed files have to go through
+    # shaping.process_map, which decompresses them as it reads them.
+    compression = detect_compression(file_in)
+    if compression is not None:
+        raise ValueError("{0} is {1} compressed, parallel shaping needs an uncompressed OSM file".format(
+            file_in, compression))
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+
+    if pbf.is_pbf(file_in):
+        backend = 'pbf'
+
+    part_dir = tempfile.mkdtemp(prefix='osm_parts_', dir=os.path.dirname(os.path.abspath(NODES_PATH)))
+    try:
+        if backend == 'pbf':
+            chunks = pbf.find_chunks(file_in, processes * chunks_per_process)
+        else:
+            chunks = find_chunks(file_in, processes * chunks_per_process)
+        tasks = [(file_in, start, end, i == len(chunks) - 1, part_dir, i, validate, backend)
+                 for i, (start, end) in enumerate(chunks)]
+
+        pool = multiprocessing.Pool(processes)
+        try:
+            parts = pool.map(shape_chunk, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+        for i, (path, fields) in enumerate(OUTPUTS):
+            with open(path, 'wb', BUFFER_SIZE) as out:
+                RowWriter(out, fields).writeheader()
+                for part in parts:
+                    with open(part[i], 'rb') as f:
+                        shutil.copyfileobj(f, out)
+    finally:
+        shutil.rmtree(part_dir, ignore_errors=True)
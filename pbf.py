@@ -0,0 +1,449 @@
+# Note: A pure Python reader for OSM PBF files (.osm.pbf), the binary format the extracts are also published in. A PBF
+# file is a sequence of blobs, each a length prefixed BlobHeader followed by a Blob holding a zlib compressed protocol
+# buffer message: one OSMHeader block, then OSMData blocks of up to 8000 nodes, ways or relations. The messages are
+# decoded here without the protobuf library:
+# * every block has its own string table, and tag keys and values, user names and member roles are indexes into it
+# * dense nodes store each attribute of all of the nodes of a block in one packed array, delta coded (ids,
+#   coordinates, timestamps, changesets, uids and user names are stored as the difference to the previous node)
+# * way node refs and relation member ids are delta coded in the same way
+# * coordinates are integers in units of granularity nanodegrees, timestamps in units of date_granularity ms
+#
+# The decoded elements are xml_backends.Element objects with the same attributes and child tag, nd and member
+# elements as the XML, so shape_element and shape_rows handle them unchanged. xml_backends.get_element reads PBF files
+# through iter_pbf, which decodes the blobs in a process pool, and parallel.process_map splits them between its
+# workers with find_chunks.
+
+import multiprocessing
+import os
+import struct
+import time
+import zlib
+from collections import deque
+
+import xml_backends
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Features an OSMHeader can require that this reader supports
+SUPPORTED_FEATURES = set(['OsmSchema-V0.6', 'DenseNodes'])
+
+MEMBER_TYPES = ['node', 'way', 'relation']
+
+# Blobs decoded ahead of the caller, per process, by iter_pbf
+PENDING_PER_PROCESS = 4
+
+
+def is_pbf(path):
+    """Return True if the file is an OSM PBF file"""
+    # The file starts with the 4 byte length of the first BlobHeader, whose first field is the type "OSMHeader".
+    with open(path, 'rb') as f:
+        head = f.read(15)
+    return head[4:] == '\x0a\x09OSMHeader'
+
+
+# ================================================== #
+#               Protocol Buffers                     #
+# ================================================== #
+def varint(buf, pos):
+    # Decodes the varint starting at buf[pos] of a bytearray. Returns (value, position after it).
+    result = 0
+    shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        result |= (b & 0x7f) << shift
+        if b < 0x80:
+            return result, pos
+        shift += 7
+
+
+def signed(value):
+    # int32 and int64 fields encode negative numbers as 64 bit two's complement varints
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def zigzag(value):
+    # sint32 and sint64 fields are zigzag encoded: 0, -1, 1, -2, ... are stored as 0, 1, 2, 3, ...
+    return (value >> 1) ^ -(value & 1)
+
+
+def iter_fields(buf, pos=0, end=None):
+    """Yield (field number, value) for each field of a message in buf[pos:end]"""
+    # The value of a varint field is the integer, and the value of a length delimited field (strings, bytes, embedded
+    # messages and packed arrays) is its (start, end) positions in buf. Fixed size fields are skipped.
+    if end is None:
+        end = len(buf)
+    while pos < end:
+        key, pos = varint(buf, pos)
+        wire_type = key & 7
+        if wire_type == 0:
+            value, pos = varint(buf, pos)
+        elif wire_type == 2:
+            length, pos = varint(buf, pos)
+            value = (pos, pos + length)
+            pos += length
+        elif wire_type == 1:
+            pos += 8
+            continue
+        elif wire_type == 5:
+            pos += 4
+            continue
+        else:
+            raise ValueError("Unsupported protocol buffer wire type {0}".format(wire_type))
+        yield key >> 3, value
+
+
+def packed(buf, span):
+    # Returns the integers of a packed varint array
+    values = []
+    append = values.append
+    pos, end = span
+    while pos < end:
+        # Most values of a delta coded array fit in one byte
+        result = buf[pos]
+        pos += 1
+        if result < 0x80:
+            append(result)
+            continue
+        result &= 0x7f
+        shift = 7
+        while True:
+            b = buf[pos]
+            pos += 1
+            result |= (b & 0x7f) << shift
+            if b < 0x80:
+                break
+            shift += 7
+        append(result)
+    return values
+
+
+def delta(values):
+    # Returns the running sums of the zigzag encoded differences of a packed sint array
+    total = 0
+    result = []
+    append = result.append
+    for value in values:
+        total += (value >> 1) ^ -(value & 1)
+        append(total)
+    return result
+
+
+# ================================================== #
+#               Blobs                                #
+# ================================================== #
+def read_blob(f):
+    # Reads the next blob of the file. Returns (type, blob bytes), or None at the end of the file.
+    head = f.read(4)
+    if not head:
+        return None
+    if len(head) < 4:
+        raise ValueError("Truncated PBF file")
+    header = bytearray(f.read(struct.unpack('>I', head)[0]))
+    blob_type = None
+    size = 0
+    for number, value in iter_fields(header):
+        if number == 1:
+            blob_type = str(header[value[0]:value[1]])
+        elif number == 3:
+            size = value
+    data = f.read(size)
+    if len(data) < size:
+        raise ValueError("Truncated PBF file")
+    return blob_type, data
+
+
+def decompress_blob(data):
+    """Return the uncompressed message of a Blob"""
+    buf = bytearray(data)
+    fields = dict(iter_fields(buf))
+    if 1 in fields:
+        return str(buf[fields[1][0]:fields[1][1]])
+    if 3 in fields:
+        return zlib.decompress(str(buf[fields[3][0]:fields[3][1]]))
+    if 4 in fields and lzma is not None:
+        return lzma.decompress(str(buf[fields[4][0]:fields[4][1]]))
+    if 7 in fields and zstandard is not None:
+        return zstandard.ZstdDecompressor().decompress(str(buf[fields[7][0]:fields[7][1]]),
+                                                        max_output_size=fields.get(2, 0))
+    raise ValueError("Unsupported PBF blob compression (fields {0})".format(sorted(fields)))
+
+
+def check_header(data):
+    # Raises ValueError if the OSMHeader block requires a feature this reader doesn't support, like historical data.
+    buf = bytearray(decompress_blob(data))
+    required = [str(buf[value[0]:value[1]]) for number, value in iter_fields(buf) if number == 4]
+    unsupported = [feature for feature in required if feature not in SUPPORTED_FEATURES]
+    if unsupported:
+        raise ValueError("PBF file requires unsupported features: {0}".format(", ".join(unsupported)))
+
+
+def iter_blobs(f):
+    """Yield the OSMData blobs of a PBF file, after checking its OSMHeader"""
+    while True:
+        blob = read_blob(f)
+        if blob is None:
+            return
+        blob_type, data = blob
+        if blob_type == 'OSMHeader':
+            check_header(data)
+        elif blob_type == 'OSMData':
+            yield data
+
+
+# ================================================== #
+#               Primitive Blocks                     #
+# ================================================== #
+def text(value):
+    # String table entries are utf-8. ASCII ones are kept as str, like the attributes ElementTree returns.
+    try:
+        value.decode('ascii')
+    except UnicodeDecodeError:
+        return value.decode('utf-8')
+    return value
+
+
+def coordinate(value):
+    # Formats nanodegrees the way OSM XML writes coordinates: up to 7 decimals without trailing zeros
+    return ('%.7f' % (value / 1e9)).rstrip('0').rstrip('.')
+
+
+def timestamp(value):
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(value))
+
+
+def decode_info(buf, span, block):
+    # Returns the attributes of the Info message of a node, way or relation
+    attrib = {}
+    for number, value in iter_fields(buf, span[0], span[1]):
+        if number == 1:
+            attrib['version'] = str(value)
+        elif number == 2:
+            attrib['timestamp'] = timestamp(signed(value) * block['date_granularity'] // 1000)
+        elif number == 3:
+            attrib['changeset'] = str(signed(value))
+        elif number == 4:
+            attrib['uid'] = str(signed(value))
+        elif number == 5:
+            attrib['user'] = block['strings'][value]
+    return attrib
+
+
+def decode_element(buf, span, block, tag):
+    # Decodes a Node, Way or Relation message. Returns (tag, attrib, [(k, v)], nds or members).
+    strings = block['strings']
+    attrib = {}
+    keys = vals = refs = roles = member_ids = member_types = ()
+    lat = lon = None
+    for number, value in iter_fields(buf, span[0], span[1]):
+        if number == 1:
+            attrib['id'] = str(zigzag(value) if tag == 'node' else signed(value))
+        elif number == 2:
+            keys = packed(buf, value)
+        elif number == 3:
+            vals = packed(buf, value)
+        elif number == 4:
+            attrib.update(decode_info(buf, value, block))
+        elif number == 8 and tag == 'node':
+            lat = zigzag(value)
+        elif number == 9 and tag == 'node':
+            lon = zigzag(value)
+        elif number == 8 and tag == 'way':
+            refs = delta(packed(buf, value))
+        elif number == 8:
+            roles = packed(buf, value)
+        elif number == 9:
+            member_ids = delta(packed(buf, value))
+        elif number == 10:
+            member_types = packed(buf, value)
+    if tag == 'node':
+        attrib['lat'] = coordinate(block['lat_offset'] + block['granularity'] * lat)
+        attrib['lon'] = coordinate(block['lon_offset'] + block['granularity'] * lon)
+    tags = [(strings[k], strings[v]) for k, v in zip(keys, vals)]
+    if tag == 'way':
+        children = [str(ref) for ref in refs]
+    elif tag == 'relation':
+        children = [(MEMBER_TYPES[t], str(ref), strings[role]) for t, ref, role in zip(member_types, member_ids, roles)]
+    else:
+        children = None
+    return (tag, attrib, tags, children)
+
+
+def decode_dense(buf, span, block):
+    # Decodes a DenseNodes message. Returns a list of (tag, attrib, [(k, v)], None) for its nodes.
+    strings = block['strings']
+    granularity = block['granularity']
+    lat_offset = block['lat_offset']
+    lon_offset = block['lon_offset']
+    ids = lats = lons = keys_vals = ()
+    info = {}
+    for number, value in iter_fields(buf, span[0], span[1]):
+        if number == 1:
+            ids = delta(packed(buf, value))
+        elif number == 5:
+            info = dict(iter_fields(buf, value[0], value[1]))
+        elif number == 8:
+            lats = delta(packed(buf, value))
+        elif number == 9:
+            lons = delta(packed(buf, value))
+        elif number == 10:
+            keys_vals = packed(buf, value)
+
+    # DenseInfo: versions are stored as they are, the other fields are delta coded
+    columns = []
+    if 1 in info:
+        columns.append(('version', [str(v) for v in packed(buf, info[1])]))
+    if 2 in info:
+        scale = block['date_granularity']
+        columns.append(('timestamp', [timestamp(t * scale // 1000) for t in delta(packed(buf, info[2]))]))
+    if 3 in info:
+        columns.append(('changeset', [str(c) for c in delta(packed(buf, info[3]))]))
+    if 4 in info:
+        columns.append(('uid', [str(u) for u in delta(packed(buf, info[4]))]))
+    if 5 in info:
+        columns.append(('user', [strings[s] for s in delta(packed(buf, info[5]))]))
+
+    columns = [('id', [str(node_id) for node_id in ids]),
+               ('lat', [coordinate(lat_offset + granularity * lat) for lat in lats]),
+               ('lon', [coordinate(lon_offset + granularity * lon) for lon in lons])] + columns
+    names = [name for name, _ in columns]
+    nodes = []
+    kv = 0
+    for values in zip(*[column for _, column in columns]):
+        # keys_vals holds key, value string indexes for each node in turn, each node's tags ending with a 0
+        tags = []
+        if keys_vals:
+            while keys_vals[kv] != 0:
+                tags.append((strings[keys_vals[kv]], strings[keys_vals[kv + 1]]))
+                kv += 2
+            kv += 1
+        nodes.append(('node', dict(zip(names, values)), tags, None))
+    return nodes
+
+
+def decode_block(data, tags=('node', 'way', 'relation')):
+    """Decode an OSMData blob into a list of (tag, attrib, [(k, v)], nds or members) for the requested tags"""
+    buf = bytearray(decompress_blob(data))
+    block = {'strings': [], 'granularity': 100, 'date_granularity': 1000, 'lat_offset': 0, 'lon_offset': 0}
+    groups = []
+    for number, value in iter_fields(buf):
+        if number == 1:
+            block['strings'] = [text(str(buf[s:e])) for n, (s, e) in iter_fields(buf, value[0], value[1]) if n == 1]
+        elif number == 2:
+            groups.append(value)
+        elif number == 17:
+            block['granularity'] = value
+        elif number == 18:
+            block['date_granularity'] = value
+        elif number == 19:
+            block['lat_offset'] = signed(value)
+        elif number == 20:
+            block['lon_offset'] = signed(value)
+
+    elements = []
+    for start, end in groups:
+        for number, value in iter_fields(buf, start, end):
+            if number == 1 and 'node' in tags:
+                elements.append(decode_element(buf, value, block, 'node'))
+            elif number == 2 and 'node' in tags:
+                elements.extend(decode_dense(buf, value, block))
+            elif number == 3 and 'way' in tags:
+                elements.append(decode_element(buf, value, block, 'way'))
+            elif number == 4 and 'relation' in tags:
+                elements.append(decode_element(buf, value, block, 'relation'))
+    return elements
+
+
+def make_element(item):
+    """Build the xml_backends.Element, with its child elements, of a decoded element"""
+    tag, attrib, tags, children = item
+    Element = xml_backends.Element
+    element = Element(tag, attrib)
+    if tag == 'way':
+        element.children = [Element('nd', {'ref': ref}) for ref in children]
+    elif tag == 'relation':
+        element.children = [Element('member', {'type': member_type, 'ref': ref, 'role': role})
+                            for member_type, ref, role in children]
+    element.children.extend(Element('tag', {'k': k, 'v': v}) for k, v in tags)
+    return element
+
+
+# ================================================== #
+#               Readers                              #
+# ================================================== #
+def iter_pbf(osm_file, tags=('node', 'way', 'relation'), processes=None):
+    """Yield the elements of a PBF file with one of the given tags, in file order"""
+    # The blobs are read here and decoded by a pool of processes, all of the cores by default. At most
+    # PENDING_PER_PROCESS blobs per process are read ahead, so memory use doesn't grow with the file.
+    tags = tuple(tags)
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    with open(osm_file, 'rb') as f:
+        if processes <= 1:
+            for data in iter_blobs(f):
+                for item in decode_block(data, tags):
+                    yield make_element(item)
+            return
+
+        pool = multiprocessing.Pool(processes)
+        try:
+            pending = deque()
+            for data in iter_blobs(f):
+                pending.append(pool.apply_async(decode_block, (data, tags)))
+                if len(pending) >= processes * PENDING_PER_PROCESS:
+                    for item in pending.popleft().get():
+                        yield make_element(item)
+            while pending:
+                for item in pending.popleft().get():
+                    yield make_element(item)
+        finally:
+            pool.terminate()
+            pool.join()
+
+
+def find_chunks(filename, count):
+    # Splits the OSMData blobs of the file into at most count byte ranges of about the same size, for
+    # parallel.process_map. Returns a list of (start, end) offsets, each starting and ending on a blob boundary.
+    size = os.path.getsize(filename)
+    starts = []
+    with open(filename, 'rb') as f:
+        while True:
+            offset = f.tell()
+            head = f.read(4)
+            if not head:
+                break
+            header = bytearray(f.read(struct.unpack('>I', head)[0]))
+            fields = dict(iter_fields(header))
+            blob_type = str(header[fields[1][0]:fields[1][1]])
+            if blob_type == 'OSMHeader':
+                f.seek(offset + 4 + len(header))
+                check_header(f.read(fields.get(3, 0)))
+            else:
+                f.seek(fields.get(3, 0), os.SEEK_CUR)
+                if blob_type == 'OSMData' and (not starts or offset >= size * len(starts) // count):
+                    starts.append(offset)
+    return zip(starts, starts[1:] + [size])
+
+
+def iter_range(filename, start, end, tags=('node', 'way', 'relation')):
+    """Yield the elements of the blobs in bytes start to end of a PBF file, decoded in this process"""
+    with open(filename, 'rb') as f:
+        f.seek(start)
+        while f.tell() < end:
+            blob = read_blob(f)
+            if blob is None:
+                break
+            if blob[0] == 'OSMData':
+                for item in decode_block(blob[1], tags):
+                    yield make_element(item)
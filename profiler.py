@@ -0,0 +1,379 @@
+# Note: Measures where the time goes when a map is shaped into csv files (shaping.process_map) or loaded into SQLite
+# (loader.load_map). While instrument() is active the functions of each stage are replaced by timed versions:
+# * parse -- the elements yielded by get_element, and the bytes read from the OSM file
+# * shape -- shape_rows and shape_element
+# * clean -- get_tag_info, get_value and the value cleaners (clean_street, clean_postcode, ...)
+# * validate -- validate_element and validate_rows
+# * write -- the batches written by RowWriter, and the bytes written to the csv files
+# * insert -- the executemany batches of the SQLite inserts
+# * sql -- the other SQLite statements (derived tables, indexes, ANALYZE)
+# Each stage records its own time, without the time of the stages it calls (the cleaners run inside shape_rows, but
+# their time only counts towards clean), the number of calls, elements and rows, and the highest resident memory seen
+# when it finished. Time not spent in any stage is reported as other. A progress line is written to stderr while the
+# map is processed, and the report is written as JSON at the end.
+#
+# The timed versions add a few microseconds per call, so the totals are a little higher than without the profiler.
+# Only the serial code paths are instrumented; the worker processes of parallel.py are not.
+#
+# Usage: python profiler.py [--db DB_FILE] [--validate] [--report REPORT_FILE] OSM_FILE
+
+import argparse
+import json
+import os
+import resource
+import sqlite3
+import sys
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import loader
+import pbf
+import shaping
+import xml_backends
+
+STAGES = ['parse', 'shape', 'clean', 'validate', 'write', 'insert', 'sql']
+
+# The resident memory is sampled every RSS_EVERY calls of a stage, and the progress line is updated at most every
+# PROGRESS_INTERVAL seconds
+RSS_EVERY = 1000
+PROGRESS_INTERVAL = 1.0
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def rss():
+    # Returns the resident memory of this process in bytes: the current size from /proc on Linux, the peak size from
+    # getrusage elsewhere.
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (IOError, IndexError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class Stage(object):
+    """Counters of one stage of the pipeline"""
+
+    __slots__ = ('name', 'seconds', 'calls', 'elements', 'rows', 'bytes_read', 'bytes_written', 'peak_rss')
+
+    def __init__(self, name):
+        self.name = name
+        self.seconds = 0.0
+        self.calls = 0
+        self.elements = 0
+        self.rows = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.peak_rss = 0
+
+    def report(self, wall):
+        return OrderedDict([('seconds', round(self.seconds, 3)),
+                            ('share', round(self.seconds / wall, 3) if wall else 0.0),
+                            ('calls', self.calls),
+                            ('elements', self.elements),
+                            ('rows', self.rows),
+                            ('bytes_read', self.bytes_read),
+                            ('bytes_written', self.bytes_written),
+                            ('elements_per_second', round(self.elements / self.seconds) if self.elements else None),
+                            ('rows_per_second', round(self.rows / self.seconds) if self.rows else None),
+                            ('peak_rss', self.peak_rss)])
+
+
+class Profiler(object):
+    """Time the stages of a run, show its progress and report the results"""
+
+    def __init__(self, progress=True, out=sys.stderr):
+        self.stages = OrderedDict((name, Stage(name)) for name in STAGES)
+        # [stage, time it was last entered or resumed] for each stage currently running, innermost last
+        self.stack = []
+        self.progress = progress
+        self.out = out
+        self.started = time.time()
+        self.finished = None
+        self.last_progress = self.started
+
+    def enter(self, name):
+        now = time.time()
+        if self.stack:
+            running = self.stack[-1]
+            running[0].seconds += now - running[1]
+        self.stack.append([self.stages[name], now])
+
+    def exit(self, elements=0, rows=0):
+        now = time.time()
+        stage, resumed = self.stack.pop()
+        stage.seconds += now - resumed
+        stage.calls += 1
+        stage.elements += elements
+        stage.rows += rows
+        if stage.calls % RSS_EVERY == 1:
+            stage.peak_rss = max(stage.peak_rss, rss())
+        if self.stack:
+            self.stack[-1][1] = now
+        if self.progress and stage.name == 'parse' and now - self.last_progress >= PROGRESS_INTERVAL:
+            self.last_progress = now
+            self.show_progress(now)
+
+    @contextmanager
+    def stage(self, name):
+        self.enter(name)
+        try:
+            yield self.stages[name]
+        finally:
+            self.exit()
+
+    def timed(self, name, func, count=None):
+        # Returns func wrapped to run in the stage name. count(result) returns the (elements, rows) of a call.
+        def wrapper(*args, **kwargs):
+            self.enter(name)
+            result = None
+            try:
+                result = func(*args, **kwargs)
+                return result
+            finally:
+                elements, rows = count(result) if count is not None and result is not None else (0, 0)
+                self.exit(elements, rows)
+        wrapper.__name__ = func.__name__
+        wrapper.__doc__ = func.__doc__
+        return wrapper
+
+    def timed_iter(self, name, iterable):
+        # Yields the items of iterable, timing each step in the stage name and counting it as an element.
+        iterator = iter(iterable)
+        while True:
+            self.enter(name)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.exit()
+                return
+            except:
+                self.exit()
+                raise
+            self.exit(elements=1)
+            yield item
+
+    def show_progress(self, now):
+        parse = self.stages['parse']
+        elapsed = now - self.started
+        busiest = max(self.stages.values(), key=lambda stage: stage.seconds)
+        line = '{0:,} elements, {1:,.0f}/s, {2:.1f}MB read, {3:.1f}MB written, RSS {4:.0f}MB, {5} {6:.0%}'.format(
+            parse.elements, parse.elements / elapsed if elapsed else 0, parse.bytes_read / 1e6,
+            sum(stage.bytes_written for stage in self.stages.values()) / 1e6, rss() / 1e6,
+            busiest.name, busiest.seconds / elapsed if elapsed else 0)
+        self.out.write('\r' + line.ljust(100))
+        self.out.flush()
+
+    def finish(self):
+        self.finished = time.time()
+        if self.progress:
+            self.show_progress(self.finished)
+            self.out.write('\n')
+            self.out.flush()
+
+    def report(self):
+        """Return the results as a dictionary, with the stages that did some work"""
+        wall = (self.finished or time.time()) - self.started
+        stages = OrderedDict((stage.name, stage.report(wall)) for stage in self.stages.values() if stage.calls)
+        other = wall - sum(stage.seconds for stage in self.stages.values())
+        stages['other'] = OrderedDict([('seconds', round(other, 3)), ('share', round(other / wall, 3) if wall else 0)])
+        busiest = max(self.stages.values(), key=lambda stage: stage.seconds)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return OrderedDict([('wall_seconds', round(wall, 3)),
+                            ('limiting_stage', busiest.name if busiest.calls else None),
+                            ('peak_rss', peak if sys.platform == 'darwin' else peak * 1024),
+                            ('stages', stages)])
+
+    def write_report(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+            f.write('\n')
+
+
+class CountingReader(object):
+    """File-like object counting the bytes read from another one towards a stage"""
+
+    def __init__(self, f, stage):
+        self.f = f
+        self.stage = stage
+
+    def read(self, size=-1):
+        data = self.f.read(size)
+        self.stage.bytes_read += len(data)
+        return data
+
+    def close(self):
+        self.f.close()
+
+
+class ProfiledCursor(sqlite3.Cursor):
+    """Cursor timing executemany batches as insert and other statements as sql"""
+
+    profiler = None
+
+    def execute(self, *args):
+        self.profiler.enter('sql')
+        try:
+            return sqlite3.Cursor.execute(self, *args)
+        finally:
+            self.profiler.exit()
+
+    def executemany(self, sql, rows):
+        rows = rows if isinstance(rows, list) else list(rows)
+        self.profiler.enter('insert')
+        try:
+            return sqlite3.Cursor.executemany(self, sql, rows)
+        finally:
+            self.profiler.exit(rows=len(rows))
+
+
+class ProfiledConnection(sqlite3.Connection):
+    """Connection whose cursors are ProfiledCursors"""
+
+    def cursor(self, factory=None):
+        return sqlite3.Connection.cursor(self, factory or ProfiledCursor)
+
+    def execute(self, *args):
+        return self.cursor().execute(*args)
+
+    def commit(self):
+        ProfiledCursor.profiler.enter('sql')
+        try:
+            sqlite3.Connection.commit(self)
+        finally:
+            ProfiledCursor.profiler.exit()
+
+
+class ProfiledSqlite(object):
+    """Stands in for the sqlite3 module in loader, connecting with ProfiledConnection"""
+
+    def connect(self, *args, **kwargs):
+        kwargs['factory'] = ProfiledConnection
+        return sqlite3.connect(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(sqlite3, name)
+
+
+def shaped_rows(result):
+    # (elements, rows) of a shape_rows result
+    if not result:
+        return 0, 0
+    return 1, 1 + len(result[2]) + len(result[3])
+
+
+def shaped_element(result):
+    # (elements, rows) of a shape_element result
+    if not result:
+        return 0, 0
+    return 1, sum(len(rows) if isinstance(rows, list) else 1 for rows in result.values())
+
+
+@contextmanager
+def instrument(profiler):
+    """Replace the functions of each stage with timed versions while the block runs"""
+    patches = []
+
+    def patch(owner, name, value):
+        patches.append((owner, name, getattr(owner, name)))
+        setattr(owner, name, value)
+
+    parse = profiler.stages['parse']
+    write = profiler.stages['write']
+
+    def get_element(osm_file, tags=('node', 'way', 'relation'), backend=None, store=None):
+        return profiler.timed_iter('parse', original_get_element(osm_file, tags, backend, store))
+
+    def open_osm(osm_file, threads=None):
+        f = original_open_osm(osm_file, threads)
+        return f if f is osm_file else CountingReader(f, parse)
+
+    def read_blob(f):
+        blob = original_read_blob(f)
+        if blob is not None:
+            parse.bytes_read += len(blob[1])
+        return blob
+
+    def get_cleaner(word):
+        cleaner = original_get_cleaner(word)
+        return profiler.timed('clean', cleaner) if cleaner is not None else None
+
+    def flush(writer):
+        rows = len(writer.batch)
+        start = writer.f.tell()
+        profiler.enter('write')
+        try:
+            original_flush(writer)
+        finally:
+            profiler.exit(rows=rows)
+        write.bytes_written += writer.f.tell() - start
+
+    original_get_element = shaping.get_element
+    original_open_osm = xml_backends.open_osm
+    original_read_blob = pbf.read_blob
+    original_get_cleaner = shaping.get_cleaner
+    original_flush = shaping.RowWriter.flush
+
+    ProfiledCursor.profiler = profiler
+    try:
+        patch(shaping, 'get_element', get_element)
+        patch(loader, 'get_element', get_element)
+        patch(xml_backends, 'open_osm', open_osm)
+        patch(pbf, 'read_blob', read_blob)
+        patch(shaping, 'shape_rows', profiler.timed('shape', shaping.shape_rows, shaped_rows))
+        patch(shaping, 'shape_element', profiler.timed('shape', shaping.shape_element, shaped_element))
+        patch(loader, 'shape_element', shaping.shape_element)
+        patch(shaping, 'get_tag_info', profiler.timed('clean', shaping.get_tag_info))
+        patch(shaping, 'get_value', profiler.timed('clean', shaping.get_value))
+        patch(shaping, 'get_cleaner', get_cleaner)
+        patch(shaping, 'validate_element', profiler.timed('validate', shaping.validate_element))
+        patch(shaping, 'validate_rows', profiler.timed('validate', shaping.validate_rows))
+        patch(shaping.RowWriter, 'flush', flush)
+        patch(loader, 'sqlite3', ProfiledSqlite())
+        # The cached key classifications hold the cleaners, so they are rebuilt with the timed ones
+        shaping.key_classes.clear()
+        yield profiler
+    finally:
+        for owner, name, value in reversed(patches):
+            setattr(owner, name, value)
+        shaping.key_classes.clear()
+        ProfiledCursor.profiler = None
+        profiler.finish()
+
+
+def profile_map(file_in, validate=False, db_file=None, report_file=None, backend=None, progress=True):
+    """Shape file_in into csv files, or load it into db_file, and return the profiler's report"""
+    profiler = Profiler(progress=progress)
+    with instrument(profiler):
+        if db_file is None:
+            shaping.process_map(file_in, validate, backend=backend)
+        else:
+            loader.load_map(file_in, db_file)
+    if report_file is not None:
+        profiler.write_report(report_file)
+    return profiler.report()
+
+
+def print_report(report):
+    print 'Total: {0:.1f}s, limited by {1}, peak RSS {2:.0f}MB'.format(
+        report['wall_seconds'], report['limiting_stage'], report['peak_rss'] / 1e6)
+    for name, stage in report['stages'].items():
+        print '  {0:<8} {1:>8.2f}s {2:>6.1%} {3:>12,} calls {4:>12,} rows'.format(
+            name, stage['seconds'], stage['share'], stage.get('calls', 0), stage.get('rows', 0))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Profile the shaping (or loading) of an OSM file by stage')
+    parser.add_argument('osm_file')
+    parser.add_argument('--db', help='load the map into this SQLite database instead of writing csv files')
+    parser.add_argument('--validate', action='store_true', help='validate the rows against the schema')
+    parser.add_argument('--report', default='profile.json', help='JSON report file (default profile.json)')
+    args = parser.parse_args()
+    report = profile_map(args.osm_file, args.validate, args.db, args.report)
+    print_report(report)
+
+
+if __name__ == '__main__':
+    main()
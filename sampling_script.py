@@ -1,34 +1,158 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-import xml.etree.ElementTree as ET  # Use cElementTree or lxml if too slow
+# Writes a sample of the top level elements of an OSM file, in one streaming pass over the file:
+# * systematic -- every k-th top level element (the original sampling)
+# * reservoir -- a uniform random sample of SAMPLE_SIZE top level elements
+# * stratified -- a uniform random sample of STRATA[tag] elements of each type (node, way and relation)
+# With --closed, the nodes referenced by the sampled ways are added to the sample, so that every way in it is
+# complete. Nodes come before ways in an OSM file, so this rereads the node section of the file once the sample has
+# been taken (the way and relation sections are not parsed again).
+#
+# The sample sizes default to the parameters below and can be given on the command line: --every for systematic,
+# --size for reservoir and --strata (e.g. node=8000,way=1900,relation=100) for stratified sampling.
+#
+# Usage: python sampling_script.py [--mode systematic|reservoir|stratified] [--every K] [--size N]
+#                                  [--strata TAG=N,...] [--closed] [--seed N] [OSM_FILE [SAMPLE_FILE]]
+
+import argparse
+import random
+import shutil
+import tempfile
+
+from xml_backends import get_element, tostring  # Uses lxml if it is installed
 
 OSM_FILE = "/Users/elizabethallen/Documents/Udacity_P3_Project/san-francisco_california.osm"  # Replace this with your osm file
 SAMPLE_FILE = "sample.osm"
 
 k = 1000 # Parameter: take every k-th top level element
+SAMPLE_SIZE = 10000 # Parameter: number of top level elements in a reservoir sample
+STRATA = {'node': 8000, 'way': 1900, 'relation': 100} # Parameter: elements of each type in a stratified sample
+
+
+def parse_strata(text):
+    # Parses the --strata option, e.g. "node=8000,way=1900", into {tag: size}. Types that aren't listed aren't sampled.
+    strata = {}
+    for item in text.split(','):
+        tag, _, size = item.partition('=')
+        tag = tag.strip()
+        if tag not in STRATA or not size.strip().isdigit():
+            raise argparse.ArgumentTypeError("expected TAG=N pairs with TAG one of {0}, got '{1}'".format(
+                ", ".join(sorted(STRATA)), item))
+        strata[tag] = int(size)
+    return strata
+
 
-def get_element(osm_file, tags=('node', 'way', 'relation')):
-    """Yield element if it is the right type of tag
+def positive_int(text):
+    value = int(text)
+    if value < 1:
+        raise argparse.ArgumentTypeError("must be at least 1, got {0}".format(value))
+    return value
 
-    Reference:
-    http://stackoverflow.com/questions/3095434/inserting-newlines-in-xml-file-generated-via-xml-etree-elementtree-in-python
-    """
-    context = iter(ET.iterparse(osm_file, events=('start', 'end')))
-    _, root = next(context)
-    for event, elem in context:
-        if event == 'end' and elem.tag in tags:
-            yield elem
-            root.clear()
 
+def snapshot(index, element):
+    # Takes what the output needs from an element before the parser releases it: its position in the file, its
+    # tag and id, its XML and the nodes it references if it is a way.
+    refs = [nd.get('ref') for nd in element.iter('nd')] if element.tag == 'way' else []
+    return (index, element.tag, element.get('id'), tostring(element), refs)
 
-with open(SAMPLE_FILE, 'wb') as output:
-    output.write('<?xml version="1.0" encoding="UTF-8"?>\n')
-    output.write('<osm>\n  ')
 
-    # Write every kth top level element
-    for i, element in enumerate(get_element(OSM_FILE)):
+def systematic_sample(osm_file, k):
+    """Yield every k-th top level element as it is parsed"""
+    for i, element in enumerate(get_element(osm_file)):
         if i % k == 0:
-            output.write(ET.tostring(element, encoding='utf-8'))
+            yield snapshot(i, element)
+
+
+def reservoir_sample(osm_file, sizes, rng):
+    """Yield a uniform random sample of sizes[tag] elements of each type, in file order"""
+    # sizes maps each tag to the size of its reservoir, or None to share one reservoir of that size between all tags.
+    # Only the elements currently in a reservoir are kept in memory.
+    reservoirs = {}
+    seen = {}
+    for i, element in enumerate(get_element(osm_file)):
+        stratum = element.tag if None not in sizes else None
+        size = sizes.get(stratum, 0)
+        if not size:
+            continue
+        reservoir = reservoirs.setdefault(stratum, [])
+        n = seen.get(stratum, 0)
+        seen[stratum] = n + 1
+        if n < size:
+            reservoir.append(snapshot(i, element))
+        else:
+            j = rng.randint(0, n)
+            if j < size:
+                reservoir[j] = snapshot(i, element)
+
+    sample = []
+    for reservoir in reservoirs.values():
+        sample.extend(reservoir)
+    sample.sort()
+    for item in sample:
+        yield item
+
+
+def write_sample(output, sample, osm_file=None, closed=False):
+    """Write sampled elements to output as they are produced, adding the nodes of sampled ways if closed is set"""
+    if not closed:
+        for _, _, _, xml, _ in sample:
+            output.write(xml)
+        return
+
+    # The ways and relations are spooled to a temporary file while the ids of the sampled and referenced nodes are
+    # collected. The nodes are then written from a second read of the node section, in file order.
+    node_ids = set()
+    spool = tempfile.TemporaryFile()
+    try:
+        for _, tag, element_id, xml, refs in sample:
+            if tag == 'node':
+                node_ids.add(element_id)
+            else:
+                node_ids.update(refs)
+                spool.write(xml)
+
+        for element in get_element(osm_file):
+            if element.tag != 'node':
+                break
+            if element.get('id') in node_ids:
+                output.write(tostring(element))
+
+        spool.seek(0)
+        shutil.copyfileobj(spool, output)
+    finally:
+        spool.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write a sample of the top level elements of an OSM file')
+    parser.add_argument('osm_file', nargs='?', default=OSM_FILE)
+    parser.add_argument('sample_file', nargs='?', default=SAMPLE_FILE)
+    parser.add_argument('--mode', choices=['systematic', 'reservoir', 'stratified'], default='systematic')
+    parser.add_argument('--every', type=positive_int, default=k, metavar='K',
+                        help='systematic: take every k-th top level element (default {0})'.format(k))
+    parser.add_argument('--size', type=positive_int, default=SAMPLE_SIZE, metavar='N',
+                        help='reservoir: number of top level elements (default {0})'.format(SAMPLE_SIZE))
+    parser.add_argument('--strata', type=parse_strata, default=STRATA, metavar='TAG=N,...',
+                        help='stratified: number of elements of each type (default {0})'.format(
+                            ','.join('{0}={1}'.format(tag, STRATA[tag]) for tag in ('node', 'way', 'relation'))))
+    parser.add_argument('--closed', action='store_true', help='add the nodes referenced by sampled ways')
+    parser.add_argument('--seed', type=int, default=None, help='random seed, for a reproducible sample')
+    args = parser.parse_args()
+
+    if args.mode == 'systematic':
+        sample = systematic_sample(args.osm_file, args.every)
+    elif args.mode == 'reservoir':
+        sample = reservoir_sample(args.osm_file, {None: args.size}, random.Random(args.seed))
+    else:
+        sample = reservoir_sample(args.osm_file, args.strata, random.Random(args.seed))
+
+    with open(args.sample_file, 'wb') as output:
+        output.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        output.write('<osm>\n  ')
+        write_sample(output, sample, args.osm_file, args.closed)
+        output.write('</osm>')
+
 
-    output.write('</osm>')
\ No newline at end of file
+if __name__ == '__main__':
+    main()
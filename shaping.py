@@ -0,0 +1,475 @@
+# Note: This is the cleaning and shaping code from the "Data Shaping" section of the notebook. It is stored in a .py
+# file, the same way the schema is, so that it can be imported by other modules and by worker processes when the map
+# is processed in parallel (see parallel.py).
+
+import csv
+import re
+from collections import OrderedDict
+import node_locations
+import schema
+import validation
+import xml_backends
+
+NODES_PATH = "nodes.csv"
+NODE_TAGS_PATH = "nodes_tags.csv"
+WAYS_PATH = "ways.csv"
+WAY_NODES_PATH = "ways_nodes.csv"
+WAY_TAGS_PATH = "ways_tags.csv"
+RELATIONS_PATH = "relations.csv"
+RELATION_MEMBERS_PATH = "relation_members.csv"
+RELATION_TAGS_PATH = "relation_tags.csv"
+WAY_GEOMETRY_PATH = "ways_geometry.csv"
+
+BUFFER_SIZE = 1 << 20
+
+LOWER_COLON = re.compile(r'^([a-z]|_)+:([a-z]|_)+')
+PROBLEMCHARS = re.compile(r'[=\+/&<>;\'"\?%#$@\,\. \t\r\n]')
+
+SCHEMA = schema.schema
+
+# Make sure the fields order in the csvs matches the column order in the sql table schema
+NODE_FIELDS = ['id', 'lat', 'lon', 'user', 'uid', 'version', 'changeset', 'timestamp']
+NODE_TAGS_FIELDS = ['id', 'key', 'value', 'type']
+WAY_FIELDS = ['id', 'user', 'uid', 'version', 'changeset', 'timestamp']
+WAY_TAGS_FIELDS = ['id', 'key', 'value', 'type']
+WAY_NODES_FIELDS = ['id', 'node_id', 'position']
+RELATION_FIELDS = ['id', 'user', 'uid', 'version', 'changeset', 'timestamp']
+RELATION_TAGS_FIELDS = ['id', 'key', 'value', 'type']
+RELATION_MEMBERS_FIELDS = ['id', 'member_id', 'type', 'role', 'position']
+WAY_GEOMETRY_FIELDS = ['id', 'min_lat', 'min_lon', 'max_lat', 'max_lon', 'length', 'centroid_lat', 'centroid_lon']
+
+# (path, fields) of each csv, in the order of the writers passed to write_rows
+OUTPUTS = [(NODES_PATH, NODE_FIELDS),
+           (NODE_TAGS_PATH, NODE_TAGS_FIELDS),
+           (WAYS_PATH, WAY_FIELDS),
+           (WAY_NODES_PATH, WAY_NODES_FIELDS),
+           (WAY_TAGS_PATH, WAY_TAGS_FIELDS),
+           (RELATIONS_PATH, RELATION_FIELDS),
+           (RELATION_MEMBERS_PATH, RELATION_MEMBERS_FIELDS),
+           (RELATION_TAGS_PATH, RELATION_TAGS_FIELDS)]
+
+# Based on the earlier analysis of street types, I have updated the mappings dictionary for street types
+street_mapping = { "St": "Street",
+            "St.": "Street",
+            "Ave": "Avenue",
+            "Ave.": "Avenue",
+            "Rd": "Road",
+            "Rd.": "Road",
+            "Dr.": "Drive",
+            "Dr": "Drive",
+            "Pl": "Place",
+            "Plz": "Plaza",
+            "Blvd": "Boulevard",
+            "Blvd.": "Boulevard",
+            "Ct": "Court",
+            "Ctr": "Center",
+            "Ln.": "Lane"
+            }
+
+street_type_re = re.compile(r'\b\S+\.?$', re.IGNORECASE)
+lower_colon_re = re.compile(r'^([a-z]|_)*:([a-z]|_)*$')
+postal_code_re = re.compile(r'\d{5}(\-\d{4}$)?')
+phone_number_re = re.compile(r'(\d\-)?\d{3}\-\d{3}\-\d{4}|\(\d{3}\)\s\d{3}\-\d{4}|\d{3}\.\d{3}\.\d{4}')
+california_re = re.compile(r'[C|c][A|a]([L|l][I|i][F|f][O|o][R|r][N|n][I|i][A|a])?')
+unitedstates_re = re.compile(r'[U|u][S|s]')
+contains_letters_re = re.compile('[a-zA-Z]')
+word_re = re.compile(r'\S+')
+
+def shape_element(element, node_attr_fields=NODE_FIELDS, way_attr_fields=WAY_FIELDS,
+                  problem_chars=PROBLEMCHARS, default_tag_type='regular'):
+    # Takes the element and fields lists and shapes the element into python dictionaries according to the rules 
+    # I outlined above. Returns the dictionaries.
+    node_attribs = {}
+    way_attribs = {}
+    way_nodes = []
+    tags = []  # Handle secondary tags the same way for both node and way elements
+    
+    if element.tag == 'node':
+        
+        node_attribs = get_attribs(node_attribs, element)
+        if skip_record(NODE_FIELDS, node_attribs):
+            return False
+        if element.iter("tag") != None:
+            tags = get_tag_info(element, tags)
+        return {'node': node_attribs, 'node_tags': tags}
+    elif element.tag == 'way':
+                
+        way_attribs = get_attribs(way_attribs, element)
+        if skip_record(WAY_FIELDS, way_attribs):
+            return False
+        
+        if element.iter("tag") != None:
+            tags = get_tag_info(element, tags)
+        if element.iter("nd") != None:
+            index = 0
+            for nd in element.iter("nd"):
+                tag_info = {}
+                tag_info['id'] = element.get('id')
+                tag_info['node_id'] = nd.attrib['ref']
+                tag_info['position'] = index
+                index += 1
+                
+                way_nodes.append(tag_info)
+        return {'way': way_attribs, 'way_nodes': way_nodes, 'way_tags': tags}
+    elif element.tag == 'relation':
+
+        relation_attribs = get_attribs({}, element)
+        if skip_record(RELATION_FIELDS, relation_attribs):
+            return False
+
+        tags = get_tag_info(element, tags)
+        members = []
+        for position, member in enumerate(element.iter("member")):
+            members.append({'id': element.get('id'),
+                            'member_id': member.get('ref'),
+                            'type': member.get('type'),
+                            'role': member.get('role', ''),
+                            'position': position})
+        return {'relation': relation_attribs, 'relation_members': members, 'relation_tags': tags}
+
+def shape_rows(element):
+    # Positional version of shape_element, used when writing the csv files. Takes the element and returns a tuple of
+    # (tag, row, tag_rows, child_rows), with each row a tuple of values in the order of the csv fields
+    # (NODE_FIELDS, WAY_FIELDS or RELATION_FIELDS, the matching tags fields, and WAY_NODES_FIELDS for the nds of a
+    # way or RELATION_MEMBERS_FIELDS for the members of a relation). Text values are utf-8 encoded, so the rows can be
+    # written with csv.writer as they are. Returns False if the element should be skipped and None if it isn't a
+    # node, way or relation.
+    tag = element.tag
+    if tag == 'node':
+        fields = NODE_FIELDS
+    elif tag == 'way':
+        fields = WAY_FIELDS
+    elif tag == 'relation':
+        fields = RELATION_FIELDS
+    else:
+        return None
+
+    get = element.get
+    row = [get(field) for field in fields]
+    for value in row:
+        if not value or value == 'NULL':
+            return False
+    user = fields.index('user')
+    row[user] = utf8(row[user])
+    element_id = row[0]
+
+    tag_rows = []
+    for child in element.iter("tag"):
+        skip, tag_type, key, cleaner = classify_key(child.get('k'))
+        if skip:
+            continue
+        value = child.get('v')
+        if cleaner is not None:
+            value = cleaner(value)
+        tag_rows.append((element_id, utf8(key), utf8(value), utf8(tag_type)))
+
+    if tag == 'way':
+        child_rows = [(element_id, nd.get('ref'), position) for position, nd in enumerate(element.iter("nd"))]
+    elif tag == 'relation':
+        child_rows = [(element_id, member.get('ref'), member.get('type'), utf8(member.get('role', '')), position)
+                      for position, member in enumerate(element.iter("member"))]
+    else:
+        child_rows = []
+    return (tag, tuple(row), tag_rows, child_rows)
+
+def utf8(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+def skip_record(FIELDS, attribs):
+    # Takes the list of fields expected and the dictionary of attributes from the element and checks if the attributes
+    # are in the list of Fields or if the value associated with the attribute is empty. If the attribute is not in the
+    # list of fields or if the value of the attribute is empty, returns True.
+    for val in FIELDS:
+        if val not in attribs:
+            return True
+        elif attribs[val] == 'NULL' or attribs[val] == None or attribs[val] == '': 
+            return True
+    
+
+def get_attribs(attrib_dict, element):
+    # Takes attribute dictionary and element, and for each attribute in the element, it adds the attribute name
+    # to the attribute dictionary and returns the dictionary.
+    for attrib in element.attrib:
+        attrib_dict[attrib] = element.get(attrib)
+    
+    return attrib_dict
+    
+
+def get_value(word, search_val):
+    # Takes an attribute and its value and cleans the value with the cleaner for that type of attribute, if there is
+    # one. Returns the cleaned value.
+    cleaner = classify_key(word)[3]
+    if cleaner is None:
+        return search_val
+    return cleaner(search_val)
+
+def clean_state(value):
+    # Variations of "CA" and "California" become 'CA', other states become 'None'
+    if california_re.search(value):
+        return 'CA'
+    return 'None'
+
+def clean_street(value):
+    return street_normalizer(value)
+
+def clean_postcode(value):
+    # Keeps the standard Zipcode part of the value, or 'None' if there isn't one
+    l = postal_code_re.search(value)
+    if l:
+        return l.group()
+    return 'None'
+
+def clean_phone(value):
+    # Phone numbers that contain letters become 'None'
+    if contains_letters_re.search(value):
+        return 'None'
+    return value
+
+def get_cleaner(word):
+    # Returns the function that cleans values of the attribute word, or None if its values are kept as they are.
+    if word == 'addr:state':
+        return clean_state
+    elif word == 'addr:street':
+        return clean_street
+    elif 'postcode' in word:
+        return clean_postcode
+    elif 'phone' in word:
+        return clean_phone
+    return None
+
+# Tag "k" values repeat heavily across a file, so each distinct one is only run through the regexes once and its
+# classification is kept here.
+key_classes = {}
+
+def classify_key(word):
+    # Takes a tag "k" value and returns (skip, type, key, cleaner): whether the tag should be skipped because of
+    # problem characters, the tag type and key it is split into, and the cleaner for its values.
+    try:
+        return key_classes[word]
+    except KeyError:
+        pass
+    if PROBLEMCHARS.search(word):
+        key_class = (True, None, None, get_cleaner(word))
+    elif LOWER_COLON.search(word):
+        index = word.find(':')
+        key_class = (False, word[:index], word[index+1:], get_cleaner(word))
+    else:
+        key_class = (False, 'regular', word, get_cleaner(word))
+    key_classes[word] = key_class
+    return key_class
+
+class StreetNameNormalizer(object):
+    """Replace the street type at the end of a street name with the approved name from a mapping"""
+
+    # The mapping is turned into a dictionary keyed by the words of each abbreviation, so the cost of normalising a
+    # name doesn't depend on the size of the mapping, and only whole words at the end of the name are replaced ("St"
+    # in "Stanyan St" becomes "Stanyan Street", not "Streetanyan Street"). Results for the most recently seen
+    # cache_size names are kept, since the same street names appear on many nodes and ways.
+
+    def __init__(self, mapping, cache_size=10000):
+        self.mapping = mapping
+        self.suffixes = dict((' '.join(key.split()), value) for key, value in mapping.items())
+        self.max_words = max([len(key.split()) for key in self.suffixes] or [0])
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+
+    def __call__(self, name):
+        try:
+            value = self.cache.pop(name)
+        except KeyError:
+            value = self.normalize(name)
+            if len(self.cache) >= self.cache_size:
+                self.cache.popitem(last=False)
+        self.cache[name] = value
+        return value
+
+    def normalize(self, name):
+        words = [m.span() for m in word_re.finditer(name)][-self.max_words:] if self.max_words else []
+        for n in range(len(words), 0, -1):
+            start, end = words[-n][0], words[-1][1]
+            value = self.suffixes.get(' '.join(name[i:j] for i, j in words[-n:]))
+            if value is not None:
+                return name[:start] + value + name[end:]
+        return name
+
+street_normalizer = StreetNameNormalizer(street_mapping)
+
+def update_name(name, street_mapping):
+    # Takes the a name and replaces the street type at the end of it with the approved name mapping. Returns the new
+    # name.
+    if street_mapping is street_normalizer.mapping:
+        return street_normalizer(name)
+    return StreetNameNormalizer(street_mapping).normalize(name)
+
+def get_tag_info(element, tags):
+    # Takes the element and empty list, skips tags with problem characters, splits the tag keys on colons and 
+    # returns the list with the clean tag info.
+    element_id = element.get('id')
+    for tag in element.iter("tag"):
+        skip, tag_type, key, cleaner = classify_key(tag.get('k'))
+        if skip:
+            continue
+        value = tag.get('v')
+        if cleaner is not None:
+            value = cleaner(value)
+        tags.append({'id': element_id, 'key': key, 'value': value, 'type': tag_type})
+    return tags
+
+# ================================================== #
+#               Helper Functions                     #
+# ================================================== #
+def get_element(osm_file, tags=('node', 'way', 'relation'), backend=None, store=None):
+    """Yield element if it is the right type of tag"""
+    # The parsing is done by one of the backends in xml_backends.py: lxml if it is installed, ElementTree otherwise.
+    # With a node_locations.NodeStore, the location of every node is recorded in it as the nodes are parsed, so the
+    # ways that follow can look up the locations of their nodes.
+    if store is None:
+        return xml_backends.get_element(osm_file, tags, backend)
+    elements = xml_backends.get_element(osm_file, node_locations.parse_tags(tags), backend)
+    return node_locations.record_locations(elements, store, tags)
+
+
+def validate_element(element, validator, schema=SCHEMA):
+    """Raise ValidationError if element does not match schema"""
+    if validator.validate(element, schema) is not True:
+        raise_errors(validator.errors)
+
+
+def raise_errors(validator_errors):
+    # Raises a ValidationError listing the errors of the first invalid field of a validator's errors.
+    field, errors = next(validator_errors.iteritems())
+    message_string = "\nElement of type '{0}' has the following errors:\n{1}"
+    error_strings = (
+        "{0}: {1}".format(k, v if isinstance(v, str) else ", ".join(v))
+        for k, v in errors.iteritems()
+    )
+    raise validation.ValidationError(
+        message_string.format(field, "\n".join(error_strings))
+    )
+
+
+def validate_rows(rows, validator):
+    """Raise ValidationError if the rows from shape_rows do not match schema"""
+    tag, row, tag_rows, child_rows = rows
+    if tag == 'node':
+        checks = [('node', NODE_FIELDS, [row]), ('node_tags', NODE_TAGS_FIELDS, tag_rows)]
+    elif tag == 'way':
+        checks = [('way', WAY_FIELDS, [row]), ('way_nodes', WAY_NODES_FIELDS, child_rows),
+                  ('way_tags', WAY_TAGS_FIELDS, tag_rows)]
+    else:
+        checks = [('relation', RELATION_FIELDS, [row]), ('relation_members', RELATION_MEMBERS_FIELDS, child_rows),
+                  ('relation_tags', RELATION_TAGS_FIELDS, tag_rows)]
+    for key, fields, key_rows in checks:
+        if validator.validate_rows(key, fields, key_rows) is not True:
+            raise_errors(validator.errors)
+
+
+class UnicodeDictWriter(csv.DictWriter, object):
+    """Extend csv.DictWriter to handle Unicode input"""
+
+    def writerow(self, row):
+        super(UnicodeDictWriter, self).writerow({
+            k: (v.encode('utf-8') if isinstance(v, unicode) else v) for k, v in row.iteritems()
+        })
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+
+class RowWriter(object):
+    """Write rows from shape_rows to a csv file in batches"""
+
+    # The rows are already tuples in field order with utf-8 encoded text, so they are handed to csv.writer in
+    # batches without building a dictionary per row. The output is the same as UnicodeDictWriter's.
+
+    def __init__(self, f, fieldnames, batch_size=1000):
+        self.f = f
+        self.writer = csv.writer(f)
+        self.fieldnames = fieldnames
+        self.batch = []
+        self.batch_size = batch_size
+
+    def writeheader(self):
+        self.writer.writerow(self.fieldnames)
+
+    def writerow(self, row):
+        self.batch.append(row)
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def writerows(self, rows):
+        self.batch.extend(rows)
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        self.writer.writerows(self.batch)
+        del self.batch[:]
+
+
+# ================================================== #
+#               Main Function                        #
+# ================================================== #
+def process_map(file_in, validate, backend=None, store=None):
+    """Iteratively process each XML element and write to csv(s)"""
+    # With a node_locations.NodeStore, the node locations are recorded in it and the geometry of each way is written
+    # to WAY_GEOMETRY_PATH as well.
+
+    outputs = OUTPUTS if store is None else OUTPUTS + [(WAY_GEOMETRY_PATH, WAY_GEOMETRY_FIELDS)]
+    files = [open(path, 'wb', BUFFER_SIZE) for path, _ in outputs]
+    try:
+        writers = [RowWriter(f, fields) for f, (_, fields) in zip(files, outputs)]
+
+        for writer in writers:
+            writer.writeheader()
+
+        validator = validation.Validator(SCHEMA)
+
+        # Nodes, ways and relations are all shaped in the same pass over the file
+        for element in get_element(file_in, tags=('node', 'way', 'relation'), backend=backend, store=store):
+            rows = shape_rows(element)
+            write_rows(rows, writers[:len(OUTPUTS)], validate, validator)
+            if store is not None and rows and rows[0] == 'way':
+                write_geometry(rows, store, writers[-1])
+
+        for writer in writers:
+            writer.flush()
+    finally:
+        for f in files:
+            f.close()
+
+
+def write_geometry(rows, store, writer):
+    # Takes the output of shape_rows for a way and writes its geometry, from the node locations in store.
+    _, row, _, way_node_rows = rows
+    coordinates = node_locations.way_coordinates([node_id for _, node_id, _ in way_node_rows], store)
+    geometry = node_locations.geometry_row(row[0], coordinates)
+    if geometry is not None:
+        writer.writerow(geometry)
+
+
+def write_rows(rows, writers, validate, validator):
+    # Takes the output of shape_rows and the writers of OUTPUTS (nodes, node_tags, ways, way_nodes, way_tags,
+    # relations, relation_members and relation_tags), validates the rows if validate is True and writes them.
+    if not rows:
+        return
+    tag, row, tag_rows, child_rows = rows
+    (nodes_writer, node_tags_writer, ways_writer, way_nodes_writer, way_tags_writer,
+     relations_writer, relation_members_writer, relation_tags_writer) = writers
+    if validate is True:
+        validate_rows(rows, validator)
+
+    if tag == 'node':
+        nodes_writer.writerow(row)
+        node_tags_writer.writerows(tag_rows)
+    elif tag == 'way':
+        ways_writer.writerow(row)
+        way_nodes_writer.writerows(child_rows)
+        way_tags_writer.writerows(tag_rows)
+    elif tag == 'relation':
+        relations_writer.writerow(row)
+        relation_members_writer.writerows(child_rows)
+        relation_tags_writer.writerows(tag_rows)
@@ -0,0 +1,109 @@
+# Note: An SQLite R*Tree index over the node coordinates and the way bounding boxes, built after the tables are
+# loaded. Without it every "what is in this area" query scans the whole nodes table; with it SQLite only visits the
+# entries whose boxes overlap the area.
+#
+# R*Tree stores its coordinates as 32 bit floats, rounded outwards, so the index can return a few nodes just outside
+# the box. query_bbox checks the nodes' own coordinates as well, so the results are exact.
+#
+# Usage: python spatial.py DB_FILE MIN_LAT MIN_LON MAX_LAT MAX_LON
+
+import sqlite3
+import sys
+import time
+
+NODES_RTREE_QUERY = '''CREATE VIRTUAL TABLE nodes_rtree USING rtree(
+    id,
+    min_lat, max_lat,
+    min_lon, max_lon
+    );'''
+
+WAYS_RTREE_QUERY = '''CREATE VIRTUAL TABLE ways_rtree USING rtree(
+    id,
+    min_lat, max_lat,
+    min_lon, max_lon
+    );'''
+
+# {0} is an optional WHERE clause, to only index some of the nodes or ways
+NODES_RTREE_INSERT = '''INSERT INTO nodes_rtree(id, min_lat, max_lat, min_lon, max_lon)
+    SELECT id, lat, lat, lon, lon FROM nodes
+    {0};'''
+
+# The bounding box of a way is the box of the nodes it references that are in the nodes table
+WAYS_RTREE_INSERT = '''INSERT INTO ways_rtree(id, min_lat, max_lat, min_lon, max_lon)
+    SELECT ways_nodes.id, MIN(nodes.lat), MAX(nodes.lat), MIN(nodes.lon), MAX(nodes.lon)
+    FROM ways_nodes JOIN nodes ON nodes.id = ways_nodes.node_id
+    {0}
+    GROUP BY ways_nodes.id;'''
+
+NODES_IN_BBOX = '''SELECT nodes.id, nodes.lat, nodes.lon
+    FROM nodes_rtree JOIN nodes ON nodes.id = nodes_rtree.id
+    WHERE nodes_rtree.min_lat <= :max_lat AND nodes_rtree.max_lat >= :min_lat
+      AND nodes_rtree.min_lon <= :max_lon AND nodes_rtree.max_lon >= :min_lon
+      AND nodes.lat BETWEEN :min_lat AND :max_lat
+      AND nodes.lon BETWEEN :min_lon AND :max_lon;'''
+
+NODE_TAGS_IN_BBOX = '''SELECT nodes_tags.id, nodes_tags.key, nodes_tags.value, nodes_tags.type
+    FROM nodes_rtree JOIN nodes ON nodes.id = nodes_rtree.id JOIN nodes_tags ON nodes_tags.id = nodes.id
+    WHERE nodes_rtree.min_lat <= :max_lat AND nodes_rtree.max_lat >= :min_lat
+      AND nodes_rtree.min_lon <= :max_lon AND nodes_rtree.max_lon >= :min_lon
+      AND nodes.lat BETWEEN :min_lat AND :max_lat
+      AND nodes.lon BETWEEN :min_lon AND :max_lon;'''
+
+# Ways whose bounding box overlaps the box. A way can overlap the box without any of its nodes being inside it.
+WAYS_IN_BBOX = '''SELECT id, min_lat, min_lon, max_lat, max_lon
+    FROM ways_rtree
+    WHERE min_lat <= :max_lat AND max_lat >= :min_lat
+      AND min_lon <= :max_lon AND max_lon >= :min_lon;'''
+
+
+def create_spatial_index(conn):
+    """Build (or rebuild) the R*Tree indexes of the nodes and ways tables"""
+    cur = conn.cursor()
+    cur.execute('DROP TABLE IF EXISTS nodes_rtree;')
+    cur.execute('DROP TABLE IF EXISTS ways_rtree;')
+    cur.execute(NODES_RTREE_QUERY)
+    cur.execute(WAYS_RTREE_QUERY)
+    cur.execute(NODES_RTREE_INSERT.format(''))
+    cur.execute(WAYS_RTREE_INSERT.format(''))
+    conn.commit()
+
+
+def refresh_spatial_index(conn, node_ids, way_ids):
+    # Recomputes the index entries of some nodes and ways from the nodes and ways_nodes tables after they have been
+    # changed, e.g. by an OsmChange file. Entries of nodes or ways that were deleted are removed. Doesn't commit.
+    cur = conn.cursor()
+    for table, insert, column, ids in [('nodes_rtree', NODES_RTREE_INSERT, 'id', list(node_ids)),
+                                       ('ways_rtree', WAYS_RTREE_INSERT, 'ways_nodes.id', list(way_ids))]:
+        for i in range(0, len(ids), 500):
+            batch = ids[i:i + 500]
+            placeholders = ', '.join('?' * len(batch))
+            cur.execute('DELETE FROM %s WHERE id IN (%s);' % (table, placeholders), batch)
+            cur.execute(insert.format('WHERE %s IN (%s)' % (column, placeholders)), batch)
+
+
+def query_bbox(conn, min_lat, min_lon, max_lat, max_lon):
+    """Return the nodes, node tags and ways in a bounding box"""
+    # Returns a dictionary of:
+    # * nodes -- a list of (id, lat, lon) of the nodes inside the box
+    # * node_tags -- a dictionary of the tags of those nodes, {id: [(key, value, type)]}
+    # * ways -- a list of (id, min_lat, min_lon, max_lat, max_lon) of the ways whose bounding box overlaps the box
+    bbox = {'min_lat': min_lat, 'min_lon': min_lon, 'max_lat': max_lat, 'max_lon': max_lon}
+    cur = conn.cursor()
+    nodes = cur.execute(NODES_IN_BBOX, bbox).fetchall()
+    node_tags = {}
+    for node_id, key, value, tag_type in cur.execute(NODE_TAGS_IN_BBOX, bbox):
+        node_tags.setdefault(node_id, []).append((key, value, tag_type))
+    ways = cur.execute(WAYS_IN_BBOX, bbox).fetchall()
+    return {'nodes': nodes, 'node_tags': node_tags, 'ways': ways}
+
+
+if __name__ == '__main__':
+    db_file = sys.argv[1]
+    min_lat, min_lon, max_lat, max_lon = [float(arg) for arg in sys.argv[2:6]]
+    conn = sqlite3.connect(db_file)
+    start = time.time()
+    result = query_bbox(conn, min_lat, min_lon, max_lat, max_lon)
+    elapsed = time.time() - start
+    print '{0} nodes, {1} tagged nodes and {2} ways in {3:.1f} ms'.format(
+        len(result['nodes']), len(result['node_tags']), len(result['ways']), elapsed * 1000)
+    conn.close()
@@ -0,0 +1,227 @@
+# Note: Generates synthetic OSM XML files for the benchmarks in benchmark_suite.py. The output looks like the San
+# Francisco extract: nodes in the San Francisco bounding box, ways made of those nodes, relations of nodes and ways,
+# non-ASCII user names, and tags drawn from the keys the audits and cleaners look at (addr:street, addr:postcode,
+# addr:state, phone, ...) as well as common ones (building, highway, amenity, tiger:*). The file only depends on the
+# options and the seed, so the same options always produce the same bytes.
+#
+# The options control the size and the mix of the data:
+# * nodes, ways, relations -- the number of each element
+# * tag_density -- the average number of tag draws per node, three times that per way (every way gets at least one).
+#   Some draws add several related tags (an address, an amenity and its name); the default gives about as many tags
+#   as sample.osm
+# * street_mix -- {street type: weight} of the street types in addr:street values, including the abbreviations
+#   shaping.street_mapping expands and types the audit doesn't expect
+# * problem_rate -- the share of tag keys containing problem characters, which shaping skips
+# At scale 1 the counts match sample.osm.
+#
+# Usage: python synthetic_osm.py [--scale N] [--seed N] [--tag-density X] [--problem-rate X] OUTPUT_FILE
+
+import argparse
+import random
+from xml.sax.saxutils import quoteattr
+
+# Element counts at scale 1, the same as sample.osm
+NODES = 4506
+WAYS = 520
+RELATIONS = 5
+
+TAG_DENSITY = 0.15
+PROBLEM_RATE = 0.01
+
+STREET_MIX = {'Street': 30, 'Avenue': 20, 'Boulevard': 5, 'Drive': 5, 'Court': 3, 'Place': 3, 'Lane': 2, 'Road': 4,
+              'Way': 4, 'St': 8, 'St.': 3, 'Ave': 6, 'Ave.': 2, 'Blvd': 2, 'Rd': 1, 'Dr': 1, 'Pl': 1}
+
+# San Francisco bounding box
+MIN_LAT, MAX_LAT = 37.70, 37.83
+MIN_LON, MAX_LON = -122.52, -122.35
+
+STREET_NAMES = ['Mission', 'Market', 'Valencia', 'Polk', 'Geary', 'Arguello', 'Irving', 'Judah', 'Noriega',
+                'Taraval', 'Folsom', 'Howard', 'Bryant', 'Harrison', 'Divisadero', 'Fillmore', 'Castro', 'Church',
+                'Dolores', 'Guerrero', 'Haight', 'Stanyan', 'Clement', 'Balboa', 'Fulton', 'Grove', 'Hayes', 'Oak',
+                'Page', 'Fell', '24th', '19th', 'Martin Luther King Jr', 'North Point', 'Grizzly Peak']
+CITIES = ['San Francisco', 'Oakland', 'Berkeley', 'Redwood City', 'Daly City', 'San Mateo', 'Alameda']
+USERS = [u'dchiles', u'juergenb22', u'KindredCoda', u'oba510', u'Luis36995', u'nmixter', u'ediyes', u'Eureka gold',
+         u'M\xfcller', u'Jos\xe9 S\xe1nchez', u'\u5f20\u4f1f', u'StellanL', u'woodpeck_fixbot', u'mk408']
+AMENITIES = ['parking', 'restaurant', 'place_of_worship', 'school', 'cafe', 'bench', 'fast_food', 'bicycle_parking',
+             'post_box', 'bank', 'toilets', 'fuel']
+CUISINES = ['mexican', 'chinese', 'pizza', 'japanese', 'italian', 'thai', 'burger', 'vietnamese', 'indian']
+RELIGIONS = ['christian', 'buddhist', 'jewish', 'muslim']
+SHOPS = ['convenience', 'supermarket', 'clothes', 'hairdresser', 'yes', 'bakery', 'car_repair']
+HIGHWAYS = ['residential', 'service', 'footway', 'tertiary', 'secondary', 'primary', 'unclassified']
+PROBLEM_KEYS = ['addr street', 'name.en', 'fixme?', 'note&source', 'old=name', 'is_in,state', 'source#1']
+
+
+def weighted_choice(rng, weights):
+    # Returns a key of weights, chosen with probability proportional to its weight. The keys are sorted first so the
+    # choice doesn't depend on the dictionary's order.
+    items = sorted(weights.items())
+    r = rng.uniform(0, sum(weight for _, weight in items))
+    for key, weight in items:
+        r -= weight
+        if r <= 0:
+            return key
+    return items[-1][0]
+
+
+def tag_count(rng, density):
+    # Number of tags of an element: most elements have none, the rest have a few, averaging density draws per element.
+    tagged = min(1.0, density / 2.0)
+    if density <= 0 or rng.random() >= tagged:
+        return 0
+    return rng.randint(1, max(1, int(round(2 * density / tagged - 1))))
+
+
+def address_tags(rng, street_mix):
+    tags = [('addr:housenumber', str(rng.randint(1, 4999))),
+            ('addr:street', '%s %s' % (rng.choice(STREET_NAMES), weighted_choice(rng, street_mix)))]
+    if rng.random() < 0.6:
+        tags.append(('addr:city', rng.choice(CITIES)))
+    if rng.random() < 0.5:
+        postcode = '94%03d' % rng.randint(100, 199)
+        tags.append(('addr:postcode', rng.choice([postcode, postcode, postcode + '-%04d' % rng.randint(0, 9999),
+                                                  'CA ' + postcode, 'CA'])))
+    if rng.random() < 0.3:
+        tags.append(('addr:state', rng.choice(['CA', 'CA', 'California', 'ca', 'NY'])))
+    if rng.random() < 0.1:
+        tags.append(('addr:country', rng.choice(['US', 'US', 'us', 'MX'])))
+    return tags
+
+
+def random_tags(rng, tag, count, street_mix, problem_rate):
+    # Returns about count (key, value) tags for an element of type tag. Related tags (an address, an amenity and its
+    # name) are added together, so there can be a few more.
+    tags = []
+    while len(tags) < count:
+        r = rng.random()
+        if r < problem_rate:
+            tags.append((rng.choice(PROBLEM_KEYS), 'x'))
+        elif r < 0.25:
+            tags.extend(address_tags(rng, street_mix))
+        elif r < 0.45:
+            amenity = rng.choice(AMENITIES)
+            tags.append(('amenity', amenity))
+            if amenity == 'restaurant':
+                tags.append(('cuisine', rng.choice(CUISINES)))
+            elif amenity == 'place_of_worship':
+                tags.append(('religion', rng.choice(RELIGIONS)))
+            tags.append(('name', '%s %s' % (rng.choice(STREET_NAMES), amenity.replace('_', ' ').title())))
+        elif r < 0.55:
+            tags.append(('shop', rng.choice(SHOPS)))
+        elif r < 0.65:
+            tags.append(('phone', rng.choice(['415-%03d-%04d', '(415) %03d-%04d', '415.%03d.%04d', '+1 415 %03d %04d'])
+                         % (rng.randint(200, 999), rng.randint(0, 9999))))
+        elif r < 0.8 and tag == 'way':
+            tags.append(('highway', rng.choice(HIGHWAYS)))
+            tags.append(('tiger:county', 'San Francisco, CA'))
+            tags.append(('tiger:name_base', rng.choice(STREET_NAMES)))
+        elif r < 0.8:
+            tags.append(('source', rng.choice(['PGS', 'Bing', 'survey', 'tiger_import_dch_v0.6_20070809'])))
+        else:
+            tags.append(('building', rng.choice(['yes', 'yes', 'house', 'residential', 'commercial'])))
+    # Keys are unique within an element
+    unique = []
+    seen = set()
+    for k, v in tags:
+        if k not in seen:
+            seen.add(k)
+            unique.append((k, v))
+    return unique
+
+
+def attributes(rng, element_id):
+    # The attributes every element has, as an XML attribute string
+    user = rng.choice(USERS)
+    return 'changeset="%d" id="%d" timestamp="%04d-%02d-%02dT%02d:%02d:%02dZ" uid="%d" user=%s version="%d"' % (
+        rng.randint(1000000, 40000000), element_id, rng.randint(2007, 2016), rng.randint(1, 12),
+        rng.randint(1, 28), rng.randint(0, 23), rng.randint(0, 59), rng.randint(0, 59),
+        USERS.index(user) * 7919 + 1000, quoteattr(user.encode('utf-8')), rng.randint(1, 12))
+
+
+def write_element(out, indent, open_tag, children):
+    # Writes an element with its child elements, or as an empty element if it has none
+    if children:
+        out.write('%s<%s>\n' % (indent, open_tag))
+        for child in children:
+            out.write('%s\t%s\n' % (indent, child))
+        out.write('%s</%s>\n' % (indent, open_tag.split(' ', 1)[0]))
+    else:
+        out.write('%s<%s />\n' % (indent, open_tag))
+
+
+def tag_elements(tags):
+    return ['<tag k=%s v=%s />' % (quoteattr(k), quoteattr(v)) for k, v in tags]
+
+
+def generate(out, nodes=NODES, ways=WAYS, relations=RELATIONS, tag_density=TAG_DENSITY, street_mix=STREET_MIX,
+             problem_rate=PROBLEM_RATE, seed=0):
+    """Write a synthetic OSM XML file to the file object out"""
+    rng = random.Random(seed)
+    out.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+    out.write('<osm version="0.6" generator="synthetic_osm">\n')
+    out.write('\t<bounds minlat="%.7f" minlon="%.7f" maxlat="%.7f" maxlon="%.7f" />\n'
+              % (MIN_LAT, MIN_LON, MAX_LAT, MAX_LON))
+
+    node_ids = []
+    node_id = 25000000
+    for _ in xrange(nodes):
+        node_id += rng.randint(1, 50)
+        node_ids.append(node_id)
+        lat = '%.7f' % rng.uniform(MIN_LAT, MAX_LAT)
+        lon = '%.7f' % rng.uniform(MIN_LON, MAX_LON)
+        tags = random_tags(rng, 'node', tag_count(rng, tag_density), street_mix, problem_rate)
+        write_element(out, '\t', 'node %s lat="%s" lon="%s"' % (attributes(rng, node_id), lat, lon),
+                      tag_elements(tags))
+
+    way_ids = []
+    way_id = 8000000
+    for _ in xrange(ways):
+        way_id += rng.randint(1, 50)
+        way_ids.append(way_id)
+        # A way is a run of nearby nodes, closed into a ring for a building now and then
+        start = rng.randint(0, max(0, len(node_ids) - 2))
+        refs = node_ids[start:start + rng.randint(2, 12)]
+        tags = random_tags(rng, 'way', max(1, tag_count(rng, tag_density * 3)), street_mix, problem_rate)
+        if refs and any(k == 'building' for k, _ in tags):
+            refs.append(refs[0])
+        write_element(out, '\t', 'way %s' % attributes(rng, way_id),
+                      ['<nd ref="%d" />' % ref for ref in refs] + tag_elements(tags))
+
+    relation_id = 100000
+    for _ in xrange(relations):
+        relation_id += rng.randint(1, 50)
+        members = []
+        for _ in xrange(rng.randint(2, 20)):
+            if way_ids and rng.random() < 0.7:
+                members.append(('way', rng.choice(way_ids), rng.choice(['outer', 'inner', ''])))
+            elif node_ids:
+                members.append(('node', rng.choice(node_ids), rng.choice(['stop', 'platform', ''])))
+        tags = [('type', rng.choice(['multipolygon', 'route', 'restriction'])),
+                ('name', '%s Line' % rng.choice(STREET_NAMES))]
+        write_element(out, '\t', 'relation %s' % attributes(rng, relation_id),
+                      ['<member type="%s" ref="%d" role=%s />' % (member_type, ref, quoteattr(role))
+                       for member_type, ref, role in members] + tag_elements(tags))
+    out.write('</osm>\n')
+
+
+def write_file(path, scale=1, seed=0, **options):
+    """Write a synthetic OSM file with scale times the elements of sample.osm"""
+    options.setdefault('nodes', NODES * scale)
+    options.setdefault('ways', WAYS * scale)
+    options.setdefault('relations', RELATIONS * scale)
+    with open(path, 'wb') as out:
+        generate(out, seed=seed, **options)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write a synthetic OSM XML file')
+    parser.add_argument('output_file')
+    parser.add_argument('--scale', type=int, default=1, help='multiple of the element counts of sample.osm')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--tag-density', type=float, default=TAG_DENSITY, help='average tags per element')
+    parser.add_argument('--problem-rate', type=float, default=PROBLEM_RATE, help='share of keys with problem chars')
+    args = parser.parse_args()
+    write_file(args.output_file, args.scale, args.seed, tag_density=args.tag_density, problem_rate=args.problem_rate)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+# Note: Checks that AuditCache returns the reports of a previous run on an unchanged file without parsing it again,
+# misses when the file or an auditor's settings change, treats a corrupt report as a miss, and evicts the least
+# recently used reports once it is bigger than max_bytes.
+#
+# Run the tests with: python -m unittest discover -p 'test_*.py'
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import auditors
+from audit_cache import AuditCache
+
+SAMPLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sample.osm')
+
+
+class AuditCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='test_audit_cache_')
+        self.osm_file = os.path.join(self.dir, 'sample.osm')
+        shutil.copyfile(SAMPLE, self.osm_file)
+        self.cache = AuditCache(os.path.join(self.dir, 'cache'))
+        self.iter_elements = auditors.iter_elements
+        self.parses = 0
+
+        def counting_iter_elements(osm_file):
+            self.parses += 1
+            return self.iter_elements(osm_file)
+        auditors.iter_elements = counting_iter_elements
+
+    def tearDown(self):
+        auditors.iter_elements = self.iter_elements
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def run_audits(self, audits=None):
+        return auditors.run_audits(self.osm_file, audits or auditors.default_auditors(), cache=self.cache)
+
+    def test_second_run_hits(self):
+        first = self.run_audits()
+        self.assertEqual((self.parses, self.cache.hits, self.cache.misses), (1, 0, 5))
+        second = self.run_audits()
+        self.assertEqual((self.parses, self.cache.hits, self.cache.misses), (1, 5, 5))
+        self.assertEqual(second, first)
+        self.assertEqual(first, auditors.run_audits(SAMPLE))
+
+    def test_changed_file_misses(self):
+        self.run_audits()
+        # The same contents with a new modification time
+        stat = os.stat(self.osm_file)
+        os.utime(self.osm_file, (stat.st_atime, stat.st_mtime + 10))
+        self.run_audits()
+        self.assertEqual((self.parses, self.cache.hits), (2, 0))
+        # Different contents
+        with open(self.osm_file, 'rb') as f:
+            data = f.read()
+        with open(self.osm_file, 'wb') as f:
+            f.write(data.replace('Street', 'Streeet', 1))
+        reports = self.run_audits()
+        self.assertEqual((self.parses, self.cache.hits), (3, 0))
+        self.assertIn('Streeet', reports['street_types'])
+
+    def test_changed_settings_miss_only_that_auditor(self):
+        self.run_audits()
+        audits = auditors.default_auditors()
+        audits[2] = auditors.StreetTypeAuditor(expected=auditors.expected + ['Way'])
+        reports = self.run_audits(audits)
+        self.assertEqual((self.parses, self.cache.hits, self.cache.misses), (2, 4, 6))
+        self.assertNotIn('Way', reports['street_types'])
+
+    def test_corrupt_report_misses(self):
+        first = self.run_audits()
+        for _, _, path in self.cache.entries():
+            with open(path, 'wb') as f:
+                f.write('not a pickle')
+        self.assertEqual(self.run_audits(), first)
+        self.assertEqual((self.parses, self.cache.hits), (2, 0))
+
+    def test_eviction(self):
+        reports = [('key%d' % i, {'report': 'x' * 1000, 'number': i}) for i in range(6)]
+        for i, (key, report) in enumerate(reports):
+            self.cache.put(key, report)
+            # Distinct last used times, whatever the resolution of the file system
+            os.utime(self.cache.path(key), (1000000 + i, 1000000 + i))
+        size = self.cache.size()
+        # Reading the oldest report makes it the most recently used
+        self.assertEqual(self.cache.get('key0'), reports[0][1])
+
+        self.cache.max_bytes = size * 4 // 6 + 1
+        self.cache.put('key6', {'report': 'x' * 1000, 'number': 6})
+        self.assertLessEqual(self.cache.size(), self.cache.max_bytes)
+        kept = [key for key in ['key%d' % i for i in range(7)] if os.path.exists(self.cache.path(key))]
+        self.assertEqual(kept, ['key0', 'key4', 'key5', 'key6'])
+
+    def test_clear(self):
+        self.run_audits()
+        self.assertEqual(len(self.cache.entries()), 5)
+        self.cache.clear()
+        self.assertEqual(self.cache.entries(), [])
+        self.run_audits()
+        self.assertEqual(self.parses, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+# Note: Checks that open_osm reads gzip, bzip2, xz and zstd compressed copies of sample.osm back byte for byte, also
+# when they are made of several concatenated streams, and that the parsers see the same elements as in the plain file.
+# xz and zstd are skipped when neither their Python module nor their command is installed.
+#
+# Run the tests with: python -m unittest discover -p 'test_*.py'
+
+import bz2
+import distutils.spawn
+import gzip
+import io
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+import osm_input
+from osm_input import open_osm, detect_compression
+from xml_backends import get_element, BACKENDS
+
+SAMPLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sample.osm')
+
+
+def gzip_compress(data):
+    out = io.BytesIO()
+    f = gzip.GzipFile(fileobj=out, mode='wb')
+    try:
+        f.write(data)
+    finally:
+        f.close()
+    return out.getvalue()
+
+
+def command_compress(command, data):
+    process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    out, _ = process.communicate(data)
+    return out
+
+
+def xz_compress(data):
+    if osm_input.lzma is not None:
+        return osm_input.lzma.compress(data)
+    return command_compress(['xz', '-z', '-c'], data)
+
+
+def zstd_compress(data):
+    if osm_input.zstandard is not None:
+        return osm_input.zstandard.ZstdCompressor().compress(data)
+    return command_compress(['zstd', '-z', '-c', '-q'], data)
+
+
+def available(module, command):
+    return module is not None or distutils.spawn.find_executable(command) is not None
+
+
+# (compression, compress function, whether it can be decompressed here)
+COMPRESSIONS = [('gzip', gzip_compress, True),
+                ('bzip2', bz2.compress, True),
+                ('xz', xz_compress, available(osm_input.lzma, 'xz')),
+                ('zstd', zstd_compress, available(osm_input.zstandard, 'zstd'))]
+
+
+def read_all(f, size):
+    chunks = []
+    while True:
+        chunk = f.read(size)
+        if not chunk:
+            return ''.join(chunks)
+        chunks.append(chunk)
+
+
+class OpenOsmTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        with open(SAMPLE, 'rb') as f:
+            cls.data = f.read()
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='test_osm_input_')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def write(self, name, data):
+        path = os.path.join(self.dir, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def compressed_files(self):
+        # Yields (compression, path) of a compressed copy of sample.osm for each compression that is available.
+        for compression, compress, can_decompress in COMPRESSIONS:
+            if can_decompress:
+                yield compression, self.write('sample.osm.' + compression, compress(self.data))
+
+    def test_plain_file(self):
+        self.assertIsNone(detect_compression(SAMPLE))
+        f = open_osm(SAMPLE)
+        try:
+            self.assertEqual(f.read(), self.data)
+        finally:
+            f.close()
+
+    def test_round_trip(self):
+        compressions = []
+        for compression, path in self.compressed_files():
+            compressions.append(compression)
+            self.assertEqual(detect_compression(path), compression)
+            for threads in (1, None):
+                for size in (-1, 1000, 1 << 20):
+                    f = open_osm(path, threads)
+                    try:
+                        data = f.read() if size < 0 else read_all(f, size)
+                    finally:
+                        f.close()
+                    self.assertEqual(data, self.data, '%s with threads=%s and reads of %d' % (
+                        compression, threads, size))
+        self.assertTrue(set(['gzip', 'bzip2']) <= set(compressions))
+
+    def test_concatenated_streams(self):
+        # pbzip2 and parallel gzip tools write one stream per block
+        half = len(self.data) // 2
+        for compression, compress, can_decompress in COMPRESSIONS:
+            if not can_decompress:
+                continue
+            path = self.write('parts.osm.' + compression, compress(self.data[:half]) + compress(self.data[half:]))
+            f = open_osm(path, threads=1)
+            try:
+                self.assertEqual(read_all(f, 4096), self.data, compression)
+            finally:
+                f.close()
+
+    def test_parsers_see_the_same_elements(self):
+        expected = [(elem.tag, elem.get('id')) for elem in get_element(SAMPLE)]
+        for compression, path in self.compressed_files():
+            for backend in sorted(BACKENDS):
+                self.assertEqual([(elem.tag, elem.get('id')) for elem in get_element(path, backend=backend)],
+                                 expected, '%s with the %s backend' % (compression, backend))
+
+    def test_file_objects_are_returned_as_they_are(self):
+        with open(SAMPLE, 'rb') as f:
+            self.assertIs(open_osm(f), f)
+
+
+if __name__ == '__main__':
+    unittest.main()
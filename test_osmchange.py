@@ -0,0 +1,146 @@
+# Note: Checks that osmchange.apply_changes creates, modifies and deletes elements in a database loaded from
+# sample.osm, keeps the derived tables (tags and user_stats) in step, removes elements that shaping rejects, and that
+# applying the same diff again changes nothing.
+#
+# Run the tests with: python -m unittest discover -p 'test_*.py'
+
+import gzip
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+import loader
+import osmchange
+
+SAMPLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sample.osm')
+
+TABLES = ['nodes', 'nodes_tags', 'ways', 'ways_nodes', 'ways_tags', 'relations', 'relation_members',
+          'relation_tags', 'tags', 'user_stats']
+
+DIFF = '''<?xml version="1.0" encoding="UTF-8"?>
+<osmChange version="0.6" generator="test">
+  <create>
+    <node id="-1" version="1" timestamp="2017-01-01T00:00:00Z" uid="1" user="tester" changeset="9000001"
+          lat="37.7" lon="-122.4">
+      <tag k="amenity" v="cafe"/>
+      <tag k="addr:street" v="Market St"/>
+    </node>
+    <way id="-2" version="1" timestamp="2017-01-01T00:00:01Z" uid="1" user="tester" changeset="9000001">
+      <nd ref="-1"/>
+      <nd ref="{node}"/>
+      <tag k="highway" v="footway"/>
+    </way>
+  </create>
+  <modify>
+    <node id="{node}" version="{node_version}" timestamp="2017-01-02T00:00:00Z" uid="1" user="tester"
+          changeset="9000002" lat="37.8" lon="-122.3">
+      <tag k="name" v="Renamed"/>
+    </node>
+    <node id="{rejected}" version="{rejected_version}" timestamp="2017-01-02T00:00:00Z" changeset="9000002"
+          lat="37.8" lon="-122.3"/>
+  </modify>
+  <delete>
+    <way id="{way}" version="{way_version}" timestamp="2017-01-03T00:00:00Z" uid="1" user="tester"
+         changeset="9000003"/>
+  </delete>
+</osmChange>
+'''
+
+
+def dump(conn):
+    # Returns the sorted rows of every table.
+    return dict((table, sorted(conn.execute('SELECT * FROM %s;' % table).fetchall())) for table in TABLES)
+
+
+class ApplyChangesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='test_osmchange_')
+        self.db_file = os.path.join(self.dir, 'sample.db')
+        loader.load_map(SAMPLE, self.db_file)
+        self.conn = sqlite3.connect(self.db_file)
+        # The way to delete, a tagged node that isn't in it to modify, and another node to reject
+        (self.way, way_version), = self.conn.execute('SELECT id, version FROM ways ORDER BY id LIMIT 1;')
+        (self.node, node_version), = self.conn.execute(
+            '''SELECT id, version FROM nodes WHERE id IN (SELECT id FROM nodes_tags) AND id NOT IN
+               (SELECT node_id FROM ways_nodes WHERE id = ?) ORDER BY id LIMIT 1;''', (self.way,))
+        (self.rejected, rejected_version), = self.conn.execute(
+            'SELECT id, version FROM nodes WHERE id != ? ORDER BY id DESC LIMIT 1;', (self.node,))
+        self.diff = os.path.join(self.dir, 'change.osc')
+        with open(self.diff, 'wb') as f:
+            f.write(DIFF.format(node=self.node, node_version=int(node_version) + 1, rejected=self.rejected,
+                                rejected_version=int(rejected_version) + 1, way=self.way,
+                                way_version=int(way_version) + 1))
+
+    def tearDown(self):
+        self.conn.close()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def apply(self, path=None):
+        counts = osmchange.apply_change_file(self.db_file, path or self.diff)
+        # The connection of the test doesn't see the changes without a new transaction
+        self.conn.commit()
+        return counts
+
+    def test_create_modify_delete(self):
+        before = dump(self.conn)
+        counts = self.apply()
+        self.assertEqual(counts, {'create': 2, 'modify': 1, 'delete': 1, 'rejected': 1, 'skipped': 0})
+        query = self.conn.execute
+
+        self.assertEqual(query('SELECT lat, lon, user FROM nodes WHERE id = -1;').fetchall(),
+                         [(37.7, -122.4, 'tester')])
+        # The street type is cleaned the same way as during the full load
+        self.assertEqual(sorted(query('SELECT key, value, type FROM nodes_tags WHERE id = -1;')),
+                         [('amenity', 'cafe', 'regular'), ('street', 'Market Street', 'addr')])
+        self.assertEqual(query('SELECT node_id, position FROM ways_nodes WHERE id = -2 ORDER BY position;').fetchall(),
+                         [(-1, 0), (self.node, 1)])
+
+        self.assertEqual(query('SELECT lat, lon, changeset FROM nodes WHERE id = ?;', (self.node,)).fetchall(),
+                         [(37.8, -122.3, 9000002)])
+        self.assertEqual(query('SELECT key, value FROM nodes_tags WHERE id = ?;', (self.node,)).fetchall(),
+                         [('name', 'Renamed')])
+
+        # The node without a user is rejected by shape_element, so its old rows are gone, as after a reload
+        for table in ('nodes', 'nodes_tags'):
+            self.assertEqual(query('SELECT COUNT(*) FROM %s WHERE id = ?;' % table, (self.rejected,)).fetchone(),
+                             (0,))
+
+        for table in ('ways', 'ways_nodes', 'ways_tags'):
+            self.assertEqual(query('SELECT COUNT(*) FROM %s WHERE id = ?;' % table, (self.way,)).fetchone(), (0,))
+
+        # The tags table follows its source tables through the triggers
+        self.assertEqual(query("SELECT COUNT(*) FROM tags WHERE element_type = 'node';").fetchone(),
+                         query('SELECT COUNT(*) FROM nodes_tags;').fetchone())
+        self.assertEqual(query("SELECT COUNT(*) FROM tags WHERE element_type = 'way';").fetchone(),
+                         query('SELECT COUNT(*) FROM ways_tags;').fetchone())
+
+        # user_stats is the same as when it is rebuilt from the nodes and ways tables
+        after = dump(self.conn)
+        self.assertNotEqual(before, after)
+        loader.create_user_stats(self.conn)
+        self.assertEqual(after['user_stats'], dump(self.conn)['user_stats'])
+
+    def test_rerun_changes_nothing(self):
+        self.apply()
+        after = dump(self.conn)
+        counts = self.apply()
+        # The rejected node isn't in the database any more, so it is rejected again without changing anything
+        self.assertEqual(counts, {'create': 0, 'modify': 0, 'delete': 0, 'rejected': 1, 'skipped': 4})
+        self.assertEqual(dump(self.conn), after)
+
+    def test_compressed_diff(self):
+        path = self.diff + '.gz'
+        with open(self.diff, 'rb') as f:
+            out = gzip.open(path, 'wb')
+            try:
+                shutil.copyfileobj(f, out)
+            finally:
+                out.close()
+        self.assertEqual(self.apply(path)['create'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+# Note: Checks that parallel.process_map writes exactly the same csv files as shaping.process_map, whatever the number
+# of processes and chunks, and with each parser backend.
+#
+# Run the tests with: python -m unittest discover -p 'test_*.py'
+
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+import parallel
+import shaping
+import xml_backends
+
+SAMPLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sample.osm')
+
+
+def read_outputs(directory):
+    # Returns {csv name: contents} of the csv files written to directory.
+    outputs = {}
+    for path, _ in shaping.OUTPUTS:
+        with open(os.path.join(directory, path), 'rb') as f:
+            outputs[path] = f.read()
+    return outputs
+
+
+class ParallelTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.dir = tempfile.mkdtemp(prefix='test_parallel_')
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def run_in(self, name, process_map, *args, **kwargs):
+        # Runs process_map in a directory of its own, since the csv files are written to the current directory.
+        directory = os.path.join(self.dir, name)
+        os.mkdir(directory)
+        os.chdir(directory)
+        try:
+            process_map(*args, **kwargs)
+        finally:
+            os.chdir(self.cwd)
+        return read_outputs(directory)
+
+    def test_same_csv_files_as_serial(self):
+        serial = self.run_in('serial', shaping.process_map, SAMPLE, validate=True)
+        self.assertGreater(serial[shaping.NODES_PATH].count('\n'), 1)
+        for processes, chunks_per_process in [(1, 1), (2, 4), (3, 7)]:
+            name = 'parallel_%d_%d' % (processes, chunks_per_process)
+            result = self.run_in(name, parallel.process_map, SAMPLE, validate=True, processes=processes,
+                                 chunks_per_process=chunks_per_process)
+            for path in serial:
+                self.assertEqual(serial[path], result[path], '%s differs in %s' % (path, name))
+
+    def test_backends(self):
+        serial = self.run_in('serial', shaping.process_map, SAMPLE, validate=False)
+        for backend in sorted(xml_backends.BACKENDS):
+            result = self.run_in(backend, parallel.process_map, SAMPLE, validate=False, processes=2, backend=backend)
+            self.assertEqual(serial, result, 'the %s backend differs' % backend)
+
+    def test_chunks_start_on_elements(self):
+        chunks = parallel.find_chunks(SAMPLE, 16)
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(chunks[-1][1], os.path.getsize(SAMPLE))
+        with open(SAMPLE, 'rb') as f:
+            for (start, end), (next_start, _) in zip(chunks, chunks[1:]):
+                self.assertEqual(end, next_start)
+                f.seek(next_start)
+                self.assertRegexpMatches(f.read(10), r'^<(node|way|relation)[\s/>]')
+
+    def test_rejects_compressed_files(self):
+        path = os.path.join(self.dir, 'sample.osm.gz')
+        with open(SAMPLE, 'rb') as f:
+            out = gzip.open(path, 'wb')
+            try:
+                shutil.copyfileobj(f, out)
+            finally:
+                out.close()
+        self.assertRaises(ValueError, parallel.process_map, path, False)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,252 @@
+# Note: Checks that pbf.py decodes OSM PBF files into the same elements as the XML: sample.osm is encoded to PBF here
+# (with dense or plain nodes, zlib compressed or raw blobs, and several blocks) and every element, attribute and child
+# element read back from it is compared with the ones the XML parser returns. The csv files shaped from the PBF file,
+# serially and in parallel, must also be the same as the ones shaped from the XML.
+#
+# Run the tests with: python -m unittest discover -p 'test_*.py'
+
+import calendar
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+import zlib
+
+import parallel
+import pbf
+import shaping
+from xml_backends import get_element
+
+SAMPLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sample.osm')
+
+MEMBER_TYPES = ['node', 'way', 'relation']
+
+
+# ================================================== #
+#               Encoder                              #
+# ================================================== #
+def uvarint(value):
+    if value < 0:
+        value += 1 << 64
+    out = []
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if not value:
+            out.append(chr(byte))
+            return ''.join(out)
+        out.append(chr(byte | 0x80))
+
+
+def zigzag(value):
+    return (value << 1) ^ (value >> 63)
+
+
+def varint_field(number, value):
+    return uvarint(number << 3) + uvarint(value)
+
+
+def bytes_field(number, data):
+    return uvarint(number << 3 | 2) + uvarint(len(data)) + data
+
+
+def packed_field(number, values):
+    return bytes_field(number, ''.join(uvarint(value) for value in values)) if values else ''
+
+
+def delta(values):
+    previous = 0
+    out = []
+    for value in values:
+        out.append(zigzag(value - previous))
+        previous = value
+    return out
+
+
+def epoch(timestamp):
+    return calendar.timegm((int(timestamp[0:4]), int(timestamp[5:7]), int(timestamp[8:10]),
+                            int(timestamp[11:13]), int(timestamp[14:16]), int(timestamp[17:19])))
+
+
+def degrees(value):
+    # Returns a coordinate in the default granularity of 100 nanodegrees.
+    negative = value.startswith('-')
+    whole, _, fraction = value.lstrip('-').partition('.')
+    units = int(whole) * 10 ** 7 + int((fraction + '0000000')[:7])
+    return -units if negative else units
+
+
+class StringTable(object):
+    """Strings of a block, by index"""
+
+    def __init__(self):
+        self.strings = ['']
+        self.index = {'': 0}
+
+    def __call__(self, value):
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        if value not in self.index:
+            self.index[value] = len(self.strings)
+            self.strings.append(value)
+        return self.index[value]
+
+
+def encode_info(attrib, strings):
+    return (varint_field(1, int(attrib['version'])) + varint_field(2, epoch(attrib['timestamp'])) +
+            varint_field(3, int(attrib['changeset'])) + varint_field(4, int(attrib['uid'])) +
+            varint_field(5, strings(attrib['user'])))
+
+
+def encode_tags(tags, strings):
+    return packed_field(2, [strings(k) for k, _ in tags]) + packed_field(3, [strings(v) for _, v in tags])
+
+
+def encode_dense(nodes, strings):
+    keys_vals = []
+    for _, _, tags, _ in nodes:
+        for k, v in tags:
+            keys_vals.extend([strings(k), strings(v)])
+        keys_vals.append(0)
+    attribs = [attrib for _, attrib, _, _ in nodes]
+    info = (packed_field(1, [int(a['version']) for a in attribs]) +
+            packed_field(2, delta([epoch(a['timestamp']) for a in attribs])) +
+            packed_field(3, delta([int(a['changeset']) for a in attribs])) +
+            packed_field(4, delta([int(a['uid']) for a in attribs])) +
+            packed_field(5, delta([strings(a['user']) for a in attribs])))
+    return (packed_field(1, delta([int(a['id']) for a in attribs])) + bytes_field(5, info) +
+            packed_field(8, delta([degrees(a['lat']) for a in attribs])) +
+            packed_field(9, delta([degrees(a['lon']) for a in attribs])) + packed_field(10, keys_vals))
+
+
+def encode_element(tag, attrib, tags, children, strings):
+    if tag == 'node':
+        return (varint_field(1, zigzag(int(attrib['id']))) + encode_tags(tags, strings) +
+                bytes_field(4, encode_info(attrib, strings)) + varint_field(8, zigzag(degrees(attrib['lat']))) +
+                varint_field(9, zigzag(degrees(attrib['lon']))))
+    info = bytes_field(4, encode_info(attrib, strings))
+    message = varint_field(1, int(attrib['id'])) + encode_tags(tags, strings) + info
+    if tag == 'way':
+        return message + packed_field(8, delta([int(ref) for ref in children]))
+    return (message + packed_field(8, [strings(member['role']) for member in children]) +
+            packed_field(9, delta([int(member['ref']) for member in children])) +
+            packed_field(10, [MEMBER_TYPES.index(member['type']) for member in children]))
+
+
+def encode_block(elements, dense):
+    # Returns a PrimitiveBlock of elements of a single type, in one PrimitiveGroup.
+    strings = StringTable()
+    if dense and elements[0][0] == 'node':
+        group = bytes_field(2, encode_dense(elements, strings))
+    else:
+        number = {'node': 1, 'way': 3, 'relation': 4}[elements[0][0]]
+        group = ''.join(bytes_field(number, encode_element(*element + (strings,))) for element in elements)
+    return bytes_field(1, ''.join(bytes_field(1, s) for s in strings.strings)) + bytes_field(2, group)
+
+
+def encode_blob(blob_type, message, compress):
+    if compress:
+        blob = varint_field(2, len(message)) + bytes_field(3, zlib.compress(message))
+    else:
+        blob = bytes_field(1, message)
+    header = bytes_field(1, blob_type) + varint_field(3, len(blob))
+    return struct.pack('>I', len(header)) + header + blob
+
+
+def xml_elements(osm_file):
+    # Returns (tag, attrib, [(k, v)], nd refs or member attributes) for each element of an XML file.
+    elements = []
+    for element in get_element(osm_file):
+        tags = [(tag.get('k'), tag.get('v')) for tag in element.iter('tag')]
+        if element.tag == 'way':
+            children = [nd.get('ref') for nd in element.iter('nd')]
+        else:
+            children = [dict(member.attrib) for member in element.iter('member')]
+        elements.append((element.tag, dict(element.attrib), tags, children))
+    return elements
+
+
+def write_pbf(path, elements, dense=True, compress=True, block_size=8000, features=('OsmSchema-V0.6', 'DenseNodes')):
+    # Writes elements to a PBF file, in blocks of at most block_size elements of the same type.
+    with open(path, 'wb') as f:
+        f.write(encode_blob('OSMHeader', ''.join(bytes_field(4, feature) for feature in features), compress))
+        block = []
+        for element in elements + [None]:
+            if block and (element is None or element[0] != block[0][0] or len(block) == block_size):
+                f.write(encode_blob('OSMData', encode_block(block, dense), compress))
+                block = []
+            block.append(element)
+
+
+# ================================================== #
+#               Tests                                #
+# ================================================== #
+def structure(element):
+    # Returns the tag, attributes and children of an element from any of the parsers, for comparisons.
+    return (element.tag, dict(element.attrib), [structure(child) for child in element])
+
+
+class PbfTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.expected = [structure(element) for element in get_element(SAMPLE)]
+        cls.elements = xml_elements(SAMPLE)
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='test_pbf_')
+        self.cwd = os.getcwd()
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def write(self, name, **options):
+        path = os.path.join(self.dir, name)
+        write_pbf(path, self.elements, **options)
+        return path
+
+    def test_same_elements_as_xml(self):
+        for name, options in [('dense.osm.pbf', {}),
+                              ('plain.osm.pbf', {'dense': False}),
+                              ('raw.osm.pbf', {'compress': False}),
+                              ('small_blocks.osm.pbf', {'block_size': 100})]:
+            path = self.write(name, **options)
+            self.assertTrue(pbf.is_pbf(path))
+            for processes in (1, 2):
+                self.assertEqual([structure(element) for element in pbf.iter_pbf(path, processes=processes)],
+                                 self.expected, '%s with %d processes' % (name, processes))
+
+    def test_get_element_filters_tags(self):
+        path = self.write('sample.osm.pbf', block_size=500)
+        self.assertFalse(pbf.is_pbf(SAMPLE))
+        for tags in [('way',), ('node', 'relation')]:
+            self.assertEqual([structure(element) for element in get_element(path, tags)],
+                             [element for element in self.expected if element[0] in tags])
+
+    def test_unsupported_features(self):
+        path = self.write('history.osm.pbf', features=('OsmSchema-V0.6', 'HistoricalInformation'))
+        self.assertRaises(ValueError, list, pbf.iter_pbf(path, processes=1))
+
+    def test_same_csv_files_as_xml(self):
+        path = self.write('sample.osm.pbf', block_size=300)
+        outputs = {}
+        for name, process_map, osm_file in [('xml', shaping.process_map, SAMPLE),
+                                            ('pbf', shaping.process_map, path),
+                                            ('parallel', parallel.process_map, path)]:
+            directory = os.path.join(self.dir, name)
+            os.mkdir(directory)
+            os.chdir(directory)
+            process_map(osm_file, validate=True)
+            os.chdir(self.cwd)
+            outputs[name] = {}
+            for csv_path, _ in shaping.OUTPUTS:
+                with open(os.path.join(directory, csv_path), 'rb') as f:
+                    outputs[name][csv_path] = f.read()
+        self.assertEqual(outputs['pbf'], outputs['xml'])
+        self.assertEqual(outputs['parallel'], outputs['xml'])
+
+
+if __name__ == '__main__':
+    unittest.main()
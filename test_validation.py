@@ -0,0 +1,105 @@
+# Note: Checks that the compiled validator of validation.py accepts and rejects the same shaped elements as cerberus,
+# which it replaced: every element of sample.osm, and copies of them with the kinds of errors the schema catches.
+#
+# Run the tests with: python -m unittest discover -p 'test_*.py'
+
+import copy
+import os
+import unittest
+
+try:
+    import cerberus
+except ImportError:
+    cerberus = None
+
+import schema
+import shaping
+import validation
+
+SAMPLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sample.osm')
+
+
+def shaped_elements():
+    # Returns the shaped elements of sample.osm, and the rows shape_rows returns for the same elements.
+    elements = []
+    for element in shaping.get_element(SAMPLE):
+        el = shaping.shape_element(element)
+        if el:
+            elements.append((el, shaping.shape_rows(element)))
+    return elements
+
+
+def broken_copies(el):
+    # Yields copies of a shaped element with one error each: a missing required field, a null value, a value that
+    # can't be coerced, a value of the wrong type and an unknown field.
+    key = [key for key in el if isinstance(el[key], dict)][0]
+    fields = schema.schema[key]['schema']
+    for name in sorted(fields):
+        if fields[name].get('required'):
+            broken = copy.deepcopy(el)
+            del broken[key][name]
+            yield 'missing ' + name, broken
+        broken = copy.deepcopy(el)
+        broken[key][name] = None
+        yield 'null ' + name, broken
+        if fields[name].get('coerce') is not None:
+            broken = copy.deepcopy(el)
+            broken[key][name] = 'not a number'
+            yield 'uncoercible ' + name, broken
+        elif fields[name]['type'] == 'string':
+            broken = copy.deepcopy(el)
+            broken[key][name] = 42
+            yield 'integer ' + name, broken
+    broken = copy.deepcopy(el)
+    broken[key]['unknown'] = 'value'
+    yield 'unknown field', broken
+
+
+@unittest.skipIf(cerberus is None, 'cerberus is not installed')
+class ValidatorTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.elements = shaped_elements()
+
+    def setUp(self):
+        self.validator = validation.Validator(schema.schema)
+        self.cerberus = cerberus.Validator(schema.schema)
+
+    def assertSameVerdict(self, el, description):
+        # cerberus normalises the document it validates, so it is given a copy
+        expected = self.cerberus.validate(copy.deepcopy(el))
+        self.assertEqual(self.validator.validate(el, schema.schema), expected,
+                         '%s: cerberus says %s, errors %r' % (description, expected, self.cerberus.errors))
+        if not expected:
+            self.assertEqual(sorted(self.validator.errors), sorted(self.cerberus.errors), description)
+
+    def test_sample_elements(self):
+        self.assertGreater(len(self.elements), 1000)
+        for el, _ in self.elements:
+            self.assertSameVerdict(el, 'sample element')
+            self.assertEqual(self.validator.errors, {})
+
+    def test_broken_elements(self):
+        # One node, way and relation
+        seen = set()
+        for el, _ in self.elements:
+            tag = [key for key in el if isinstance(el[key], dict)][0]
+            if tag in seen:
+                continue
+            seen.add(tag)
+            for description, broken in broken_copies(el):
+                self.assertSameVerdict(broken, '%s %s' % (tag, description))
+        self.assertTrue(set(['node', 'way']) <= seen)
+
+    def test_rows_match_elements(self):
+        for el, rows in self.elements:
+            self.assertTrue(self.validator.validate(el, schema.schema))
+            shaping.validate_rows(rows, self.validator)
+        tag, row, tag_rows, child_rows = self.elements[0][1]
+        broken = (tag, (None,) + row[1:], tag_rows, child_rows)
+        self.assertRaises(validation.ValidationError, shaping.validate_rows, broken, self.validator)
+
+
+if __name__ == '__main__':
+    unittest.main()
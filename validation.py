@@ -0,0 +1,164 @@
+# Note: A validator for shaped elements, compiled from the schema in schema.py. Each field of the schema is turned
+# into a small check function (coercion, type and required checks) when the Validator is created, so validating an
+# element doesn't walk the schema rules the way cerberus does. It takes a small fraction of the time cerberus takes,
+# which means the full file can be validated when it is processed.
+#
+# Only the rules used in schema.py are supported: type ('dict', 'list', 'integer', 'float', 'string'), required,
+# coerce and schema.
+
+import schema
+
+
+class ValidationError(ValueError):
+    pass
+
+
+TYPE_CHECKS = {
+    'integer': lambda value: isinstance(value, (int, long)) and not isinstance(value, bool),
+    'float': lambda value: isinstance(value, float),
+    'string': lambda value: isinstance(value, basestring),
+}
+
+
+def compile_value(rules):
+    # Returns a function that takes a field value and returns a list of errors, or None if the value is valid.
+    type_name = rules['type']
+    is_type = TYPE_CHECKS[type_name]
+    coerce = rules.get('coerce')
+    type_error = 'must be of {0} type'.format(type_name)
+
+    if coerce is None:
+        def check(value):
+            if value is None:
+                return ['null value not allowed']
+            if not is_type(value):
+                return [type_error]
+            return None
+    else:
+        def check(value):
+            if value is None:
+                return ['null value not allowed']
+            try:
+                value = coerce(value)
+            except (TypeError, ValueError) as e:
+                return [type_error, 'cannot be coerced: {0}'.format(e)]
+            if not is_type(value):
+                return [type_error]
+            return None
+    return check
+
+
+def compile_dict(fields):
+    # Returns a function that takes a dictionary and returns a dictionary of errors by field name, which is empty if
+    # the dictionary is valid.
+    checks = [(name, compile_value(rules)) for name, rules in fields.items()]
+    required = dict((name, bool(rules.get('required'))) for name, rules in fields.items())
+
+    def check(doc):
+        if not isinstance(doc, dict):
+            return {'': ['must be of dict type']}
+        errors = {}
+        present = 0
+        for name, check_value in checks:
+            if name in doc:
+                present += 1
+                value_errors = check_value(doc[name])
+                if value_errors:
+                    errors[name] = value_errors
+            elif required[name]:
+                errors[name] = ['required field']
+        if present != len(doc):
+            for name in doc:
+                if name not in required:
+                    errors[name] = ['unknown field']
+        return errors
+    return check
+
+
+def compile_rules(rules):
+    # Compiles the rules of a top level field of the schema, which is either a dictionary or a list of dictionaries.
+    if rules['type'] == 'dict':
+        return compile_dict(rules['schema'])
+
+    check_item = compile_dict(rules['schema']['schema'])
+
+    def check(docs):
+        if not isinstance(docs, list):
+            return {'': ['must be of list type']}
+        errors = {}
+        for i, doc in enumerate(docs):
+            for name, field_errors in check_item(doc).items():
+                errors['{0}.{1}'.format(i, name)] = field_errors
+        return errors
+    return check
+
+
+def compile_row(rules, fields):
+    # Returns a function that takes a list of rows, each a tuple of values in the order of fields, and returns a
+    # dictionary of errors by "row.field", which is empty if the rows are valid.
+    if rules['type'] == 'list':
+        rules = rules['schema']
+    field_rules = rules['schema']
+    unknown = [name for name in fields if name not in field_rules]
+    if unknown:
+        raise ValueError("Fields {0} are not in the schema".format(", ".join(unknown)))
+    checks = list(enumerate((name, compile_value(field_rules[name])) for name in fields))
+    missing = [name for name, rules in field_rules.items() if rules.get('required') and name not in fields]
+
+    def check(rows):
+        errors = {}
+        for i, row in enumerate(rows):
+            for position, (name, check_value) in checks:
+                value_errors = check_value(row[position])
+                if value_errors:
+                    errors['{0}.{1}'.format(i, name)] = value_errors
+            for name in missing:
+                errors['{0}.{1}'.format(i, name)] = ['required field']
+        return errors
+    return check
+
+
+class Validator(object):
+    """Validate shaped elements against a schema, with the validate method and errors attribute of cerberus.Validator"""
+
+    def __init__(self, schema=schema.schema):
+        self.schema = schema
+        self.checks = dict((key, compile_rules(rules)) for key, rules in schema.items())
+        self.row_checks = {}
+        self.errors = {}
+
+    def validate(self, document, schema=None):
+        # Returns True if the document is valid. Otherwise returns False and sets errors to a dictionary of
+        # {top level field: {field: [errors]}}.
+        if schema is not None and schema is not self.schema:
+            self.__init__(schema)
+        errors = {}
+        for key, value in document.items():
+            check = self.checks.get(key)
+            if check is None:
+                errors[key] = {key: ['unknown field']}
+                continue
+            field_errors = check(value)
+            if field_errors:
+                errors[key] = field_errors
+        self.errors = errors
+        return not errors
+
+    def validate_batch(self, documents):
+        # Validates a list of documents. Returns a list of (position, errors) for the documents that are invalid.
+        invalid = []
+        for i, document in enumerate(documents):
+            if not self.validate(document):
+                invalid.append((i, self.errors))
+        self.errors = {}
+        return invalid
+
+    def validate_rows(self, key, fields, rows):
+        # Validates rows given as tuples of values in the order of fields against the schema of key, e.g.
+        # validate_rows('node_tags', NODE_TAGS_FIELDS, rows). Returns True or False and sets errors like validate.
+        check = self.row_checks.get((key, tuple(fields)))
+        if check is None:
+            check = self.row_checks[(key, tuple(fields))] = compile_row(self.schema[key], fields)
+        errors = check(rows)
+        self.errors = {key: errors} if errors else {}
+        return not errors
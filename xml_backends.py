@@ -0,0 +1,200 @@
+# Note: The XML parsers that get_element can use. All of them yield the top level elements of an OSM file one at a
+# time and release them once the caller moves on to the next one:
+# * etree -- iterparse from xml.etree.cElementTree, or xml.etree.ElementTree if the C version is missing. Always
+#   available.
+# * lxml -- lxml.etree.iterparse. Used by default when lxml is installed.
+# * expat -- a callback parser on top of xml.parsers.expat that only builds small Element objects for the requested
+#   tags and their children, instead of ElementTree elements. They support the parts of the ElementTree interface that
+#   shape_element uses (tag, attrib, get and iter), and tostring converts them to ElementTree elements to serialise
+#   them.
+#
+# Compressed files (gzip, bzip2, xz or zstd) are decompressed while they are parsed, see osm_input.py. OSM PBF files
+# aren't XML: get_element reads them with pbf.py whatever the backend, which yields the same Element objects as expat.
+#
+# Run this file to compare the elements per second of each backend on sample.osm (or on the file given as argument).
+
+try:
+    import xml.etree.cElementTree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
+from xml.parsers import expat
+import time
+import sys
+
+import pbf
+from osm_input import open_osm
+
+try:
+    from lxml import etree as lxml_etree
+except ImportError:
+    lxml_etree = None
+
+READ_SIZE = 64 * 1024
+
+
+class Element(object):
+    """Element built by the expat backend"""
+
+    __slots__ = ('tag', 'attrib', 'children')
+
+    def __init__(self, tag, attrib):
+        self.tag = tag
+        self.attrib = attrib
+        self.children = []
+
+    def get(self, key, default=None):
+        return self.attrib.get(key, default)
+
+    def iter(self, tag=None):
+        if tag is None or self.tag == tag:
+            yield self
+        for child in self.children:
+            for elem in child.iter(tag):
+                yield elem
+
+    def __iter__(self):
+        return iter(self.children)
+
+    def __len__(self):
+        return len(self.children)
+
+
+def iter_etree(osm_file, tags):
+    # Reference:
+    # http://stackoverflow.com/questions/3095434/inserting-newlines-in-xml-file-generated-via-xml-etree-elementtree-in-python
+    context = ET.iterparse(osm_file, events=('start', 'end'))
+    _, root = next(context)
+    for event, elem in context:
+        if event == 'end' and elem.tag in tags:
+            yield elem
+            root.clear()
+
+
+def iter_lxml(osm_file, tags):
+    # The tags are filtered here rather than with iterparse's tag argument, so that the top level elements that aren't
+    # requested (e.g. the relations when only nodes and ways are) are released too, not only the ones before a match.
+    for _, elem in lxml_etree.iterparse(osm_file, events=('end',)):
+        parent = elem.getparent()
+        if elem.tag in tags:
+            yield elem
+        elif parent is None or parent.getparent() is not None:
+            # The root, or a child of an element that hasn't ended yet
+            continue
+        # Clear the element and drop the references the root holds to it and to any skipped elements before it
+        elem.clear()
+        while elem.getprevious() is not None:
+            del parent[0]
+
+
+def iter_expat(osm_file, tags):
+    if hasattr(osm_file, 'read'):
+        f = osm_file
+    else:
+        f = open(osm_file, 'rb')
+
+    stack = []
+    done = []
+
+    def start(name, attrs):
+        # Only the requested elements and everything inside them are built
+        if stack or name in tags:
+            elem = Element(name, attrs)
+            if stack:
+                stack[-1].children.append(elem)
+            stack.append(elem)
+
+    def end(name):
+        if stack:
+            elem = stack.pop()
+            if not stack:
+                done.append(elem)
+
+    parser = expat.ParserCreate()
+    parser.StartElementHandler = start
+    parser.EndElementHandler = end
+    try:
+        while True:
+            data = f.read(READ_SIZE)
+            parser.Parse(data, not data)
+            for elem in done:
+                yield elem
+            del done[:]
+            if not data:
+                break
+    finally:
+        if f is not osm_file:
+            f.close()
+
+
+BACKENDS = {'etree': iter_etree, 'expat': iter_expat}
+if lxml_etree is not None:
+    BACKENDS['lxml'] = iter_lxml
+
+DEFAULT_BACKEND = 'lxml' if lxml_etree is not None else 'etree'
+
+
+def get_element(osm_file, tags=('node', 'way', 'relation'), backend=None):
+    """Yield element if it is the right type of tag, using the given parser backend"""
+    # osm_file can be a file name or a file object. backend defaults to lxml, or to etree if lxml isn't installed.
+    # PBF files (only by file name) are decoded by a pool of processes instead, see pbf.iter_pbf.
+    if not hasattr(osm_file, 'read') and pbf.is_pbf(osm_file):
+        return pbf.iter_pbf(osm_file, tags)
+    if backend is None:
+        backend = DEFAULT_BACKEND
+    if backend not in BACKENDS:
+        raise ValueError("Unknown or unavailable XML backend '{0}', choose from {1}".format(
+            backend, ", ".join(sorted(BACKENDS))))
+    return parse_file(BACKENDS[backend], osm_file, tuple(tags))
+
+
+def parse_file(parse, osm_file, tags):
+    # Opens osm_file with open_osm if it is a file name, and closes it once it has been parsed.
+    f = open_osm(osm_file)
+    try:
+        for elem in parse(f, tags):
+            yield elem
+    finally:
+        if f is not osm_file:
+            f.close()
+
+
+def tostring(element):
+    # Serialises an element from any of the backends, or from a PBF file, as utf-8.
+    if lxml_etree is not None and isinstance(element, lxml_etree._Element):
+        return lxml_etree.tostring(element, encoding='utf-8')
+    if isinstance(element, Element):
+        element = to_etree(element)
+    return ET.tostring(element, encoding='utf-8')
+
+
+def to_etree(element):
+    # Converts an expat or PBF Element, and its children, to an ElementTree element.
+    elem = ET.Element(element.tag, element.attrib)
+    elem.extend(to_etree(child) for child in element.children)
+    return elem
+
+
+def benchmark(osm_file, tags=('node', 'way', 'relation'), repeat=3):
+    # Parses osm_file repeat times with each available backend, touching the tags of every element the way
+    # shape_element does. Returns a dictionary of the best elements per second for each backend.
+    results = {}
+    for backend in sorted(BACKENDS):
+        best = None
+        for _ in range(repeat):
+            start = time.time()
+            count = 0
+            for elem in get_element(osm_file, tags, backend):
+                for tag in elem.iter('tag'):
+                    tag.get('k')
+                count += 1
+            elapsed = time.time() - start
+            if best is None or elapsed < best:
+                best = elapsed
+        results[backend] = count / best if best else 0
+    return results
+
+
+if __name__ == '__main__':
+    osm_file = sys.argv[1] if len(sys.argv) > 1 else 'sample.osm'
+    for backend, rate in sorted(benchmark(osm_file).items(), key=lambda item: -item[1]):
+        print '{0:6} {1:10.0f} elements/s'.format(backend, rate)